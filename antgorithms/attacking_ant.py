@@ -1,5 +1,4 @@
 import math
-import random
 
 def antgorithm(self):
     
@@ -33,7 +32,37 @@ def antgorithm(self):
         return("turn", {"rel_angle": angle_to_nearest_ant - self.rotation})
 
     # Do a random-ish walk if no ants are nearby
-    if (random.random() < 0.1):
-        return("turn", {"rel_angle": ((random.random()-0.5)/8) * 2 * math.pi})
+    if (self.rng.random() < 0.1):
+        return("turn", {"rel_angle": ((self.rng.random()-0.5)/8) * 2 * math.pi})
     else:
-        return("walk", {})
\ No newline at end of file
+        return("walk", {})
+
+def team_antgorithm(team):
+    """The same antgorithm for the whole team at once (see vectorized.py)."""
+    from instructions import WALK, TURN, BITE
+
+    codes, angles, distances = team.new_instructions(WALK)
+    near_bounds = team.near_bounds(buffer=10)
+    enemy_x, enemy_y, enemies_nearby = team.nearest_enemy()
+
+    # Do a random-ish walk if no ants are nearby (drawing from each ant's own rng, like the per-ant version)
+    wandering = ~near_bounds & ~enemies_nearby
+    wander_turn = team.random(wandering) < 0.1
+    turn_amounts = team.random(wander_turn)
+    codes[wander_turn] = TURN
+    angles[wander_turn] = ((turn_amounts - 0.5)/8 * 2 * math.pi)[wander_turn]
+
+    # Bite if an enemy ant is in attackable range, otherwise turn toward the nearest ant if it's too far to the side
+    angle_to_nearest_ant = team.angle_toward(enemy_x, enemy_y)
+    turn_to_enemy = enemies_nearby & ~(abs(angle_to_nearest_ant - team.rotation) < math.pi/2)
+    codes[turn_to_enemy] = TURN
+    angles[turn_to_enemy] = (angle_to_nearest_ant - team.rotation)[turn_to_enemy]
+    codes[enemies_nearby & team.can_bite()] = BITE
+
+    # If we're near the edge of the battle, turn and walk towards the center
+    angle_to_center = team.angle_toward(team.bounds[0]/2, team.bounds[1]/2)
+    turn_to_center = near_bounds & (abs(angle_to_center - team.rotation) > math.pi/8)
+    codes[near_bounds] = WALK
+    codes[turn_to_center] = TURN
+    angles[turn_to_center] = (angle_to_center - team.rotation)[turn_to_center]
+    return(codes, angles, distances)
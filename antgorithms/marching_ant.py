@@ -1,5 +1,4 @@
 import math
-import random
 
 def antgorithm(self):
     
@@ -33,4 +32,28 @@ def antgorithm(self):
         return("turn", {"rel_angle": angle_to_nearest_ant - self.rotation})
 
     # March forward if no ants are nearby
-    return("walk", {})
\ No newline at end of file
+    return("walk", {})
+
+def team_antgorithm(team):
+    """The same antgorithm for the whole team at once (see vectorized.py)."""
+    from instructions import WALK, TURN, BITE
+
+    # March forward unless something below applies
+    codes, angles, distances = team.new_instructions(WALK)
+
+    # Bite if an enemy ant is in attackable range, otherwise turn toward the nearest ant if it's too far to the side
+    enemy_x, enemy_y, enemies_nearby = team.nearest_enemy()
+    angle_to_nearest_ant = team.angle_toward(enemy_x, enemy_y)
+    turn_to_enemy = enemies_nearby & ~(abs(angle_to_nearest_ant - team.rotation) < math.pi/2)
+    codes[turn_to_enemy] = TURN
+    angles[turn_to_enemy] = (angle_to_nearest_ant - team.rotation)[turn_to_enemy]
+    codes[enemies_nearby & team.can_bite()] = BITE
+
+    # Near the edge of the battle, turn toward the center (unless already doing so) or walk
+    near_bounds = team.near_bounds(buffer=10)
+    angle_to_center = team.angle_toward(team.bounds[0]/2, team.bounds[1]/2)
+    turn_to_center = near_bounds & (abs(angle_to_center - team.rotation) > math.pi/8)
+    codes[near_bounds] = WALK
+    codes[turn_to_center] = TURN
+    angles[turn_to_center] = (angle_to_center - team.rotation)[turn_to_center]
+    return(codes, angles, distances)
@@ -1,5 +1,4 @@
 import math
-import random
 
 def antgorithm(self):
 
@@ -7,7 +6,7 @@ def antgorithm(self):
     if (self.battle.game_tick == 0):
         self.memory["last_scared"] = 0
         self.memory["attacking_ant"] = False
-        self.memory["blocking_ant"] = random.random() < 0.5
+        self.memory["blocking_ant"] = self.rng.random() < 0.5
 
     # It the ant hasn't been scared in a while, it'll be an attacking ant
     if (self.battle.game_tick - self.memory["last_scared"] > 1000):
@@ -58,7 +57,7 @@ def antgorithm(self):
             return("walk", {})
 
     # Do a random-ish walk if no ants are nearby
-    if (random.random() < 0.1):
-        return("turn", {"rel_angle": ((random.random()-0.5)/8) * 2 * math.pi})
+    if (self.rng.random() < 0.1):
+        return("turn", {"rel_angle": ((self.rng.random()-0.5)/8) * 2 * math.pi})
     else:
         return("walk", {})
\ No newline at end of file
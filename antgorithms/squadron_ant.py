@@ -1,13 +1,12 @@
 import math
-import random
 
 def antgorithm(self):
 
     # Have a few ants declare themselves as squad leaders
     if (self.battle.game_tick == 0):
-        if (random.random() < 0.05):
+        if (self.rng.random() < 0.05):
             self.memory["squad_leader"] = True
-            self.memory["squadron"] = random.randint(100, 999)
+            self.memory["squadron"] = self.rng.randint(100, 999)
         else:
             self.memory["squad_leader"] = False
             self.memory["squadron"] = None
@@ -78,16 +77,14 @@ def antgorithm(self):
 
     # If we're in a squadron, find the newest message from that squadron
     if ((self.memory["squadron"] is not None) and (not self.memory["squad_leader"])):
-        messages = self.receive()
+        # Only this squadron's messages (they're filed under their content, "[squadron]")
+        messages = self.receive(topic=f"[{self.memory['squadron']}]")
         newest_message_coords = None
         newest_message_age = math.inf
         for message in messages:
-            if (message.content.startswith("[") and message.content.endswith("]")):
-                this_squadron = int(message.content[1:-1])
-                if (this_squadron == self.memory["squadron"]):
-                    if (message.age < newest_message_age):
-                        newest_message_coords = (message.x, message.y)
-                        newest_message_age = message.age
+            if (message.age < newest_message_age):
+                newest_message_coords = (message.x, message.y)
+                newest_message_age = message.age
 
         # If we have a trail, follow it
         if (newest_message_coords is not None):
@@ -99,7 +96,7 @@ def antgorithm(self):
                 return("walk", {})
 
     # Do a random-ish walk if no ants are nearby
-    if (random.random() < 0.1):
-        return("turn", {"rel_angle": ((random.random()-0.5)/8) * 2 * math.pi})
+    if (self.rng.random() < 0.1):
+        return("turn", {"rel_angle": ((self.rng.random()-0.5)/8) * 2 * math.pi})
     else:
         return("walk", {})
\ No newline at end of file
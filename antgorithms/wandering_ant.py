@@ -1,5 +1,4 @@
 import math
-import random
 
 def antgorithm(self):
 
@@ -17,8 +16,8 @@ def antgorithm(self):
             return("walk", {})
         
     # Do a random-ish walk
-    if (random.random() < 0.1):
+    if (self.rng.random() < 0.1):
         return("turn", 
-                {"rel_angle": ((random.random()-0.5)/8) * 2 * math.pi})
+                {"rel_angle": ((self.rng.random()-0.5)/8) * 2 * math.pi})
     else:
         return("walk", {})
\ No newline at end of file
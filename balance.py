@@ -0,0 +1,425 @@
+"""Search for balanced ant stats with headless battles.
+
+A candidate is a set of ant stats (BASIC_ANT_STATS with some of them
+changed). It's scored by playing a challenger team with those stats against
+opponents with BASIC_ANT_STATS over a number of seeds, in a process pool.
+Each candidate also has a stat budget, how far up their ranges its stats
+are on average (0 is every stat at its minimum, 1 at its maximum), so the
+question is which stats buy the most wins. The search is random, CMA-ES
+(needs numpy) or a genetic algorithm, all maximizing win rate minus
+--budget-weight times the budget. Every generation goes through successive
+halving: candidates play a few seeds, the best 1/--eta of them play --eta
+times as many, and so on up to --seeds, so weak candidates stop early.
+
+Every battle is appended to battles.jsonl in the output directory and is
+never played again, so rerunning (or extending) a search reuses what's been
+played, as a tournament does. candidates.csv has every candidate and
+pareto.json the Pareto fronts of win rate against stat budget (overall and
+per opponent), counting only candidates that played every seed.
+
+    python balance.py --optimizer cmaes --generations 20 --workers 8
+    python balance.py --antgorithm attacking_ant --opponents marching_ant scared_ant
+"""
+
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import random
+from models import Battle, STAT_NAMES
+from plugins import registry
+from simulate import add_ants, BASIC_ANT_STATS
+from tournament import ARENA_BOUNDS
+try:
+    import numpy as np # Only needed for CMA-ES
+except ImportError:
+    np = None
+
+# (min, max) of each stat the search can change
+STAT_RANGES = {
+    "size": (5, 20),
+    "health": (1, 6),
+    "speed": (0.5, 3),
+    "block_damage": (0, 2),
+    "bite_damage": (0.5, 3),
+    "bite_range": (5, 30),
+    "bite_angle": (math.pi/8, math.pi),
+    "smell_range": (50, 200),
+}
+
+# Stats that make an ant stronger (size only changes how it's drawn and how close to the edge antgorithms turn)
+BUDGET_STATS = ["health", "speed", "block_damage", "bite_damage", "bite_range", "bite_angle", "smell_range"]
+
+OPTIMIZERS = ["random", "cmaes", "genetic"]
+
+def stat_budget(stats):
+    """Return how far up their ranges the stats that make an ant stronger are, on average (0 to 1)."""
+    return(sum((stats[name] - STAT_RANGES[name][0]) / (STAT_RANGES[name][1] - STAT_RANGES[name][0]) for name in BUDGET_STATS) / len(BUDGET_STATS))
+
+def encode(stats, names):
+    """Return the point in the unit cube (one axis per searched stat) of a set of stats."""
+    return([(stats[name] - STAT_RANGES[name][0]) / (STAT_RANGES[name][1] - STAT_RANGES[name][0]) for name in names])
+
+def round_stat(name, value):
+    return(int(round(value)) if name == "size" else round(value, 3))
+
+def decode(point, names):
+    """Return the stats at a point in the unit cube (rounded, so nearby points share cached battles).
+
+    Stats that round to their BASIC_ANT_STATS value get that exact value
+    (bite_angle is pi/4, not 0.785), so the starting point is BASIC_ANT_STATS.
+    """
+    stats = dict(BASIC_ANT_STATS)
+    for name, u in zip(names, point):
+        low, high = STAT_RANGES[name]
+        value = round_stat(name, low + min(max(u, 0), 1) * (high - low))
+        if value != round_stat(name, BASIC_ANT_STATS[name]):
+            stats[name] = value
+    return(stats)
+
+def stats_key(stats):
+    return(tuple(stats[name] for name in STAT_NAMES))
+
+def play_match(stats, antgorithm, opponent, seed, n_ants, max_ticks):
+    """Play a challenger team with the given stats against an opponent with BASIC_ANT_STATS and return the result as a dict."""
+    battle = Battle(seed=seed)
+    battle.bounds = ARENA_BOUNDS
+
+    # Swap sides on odd seeds, as tournaments do
+    left, right = (150, ARENA_BOUNDS[1]/2), (ARENA_BOUNDS[0] - 150, ARENA_BOUNDS[1]/2)
+    if seed % 2 == 1:
+        left, right = right, left
+    add_ants(battle, "challenger", left, n_ants, registry.antgorithm(antgorithm), stats=stats)
+    add_ants(battle, "opponent", right, n_ants, registry.antgorithm(opponent))
+
+    winner = battle.run(max_ticks=max_ticks)
+    survivors = battle.alive_counts
+    return({
+        "stats": stats,
+        "antgorithm": antgorithm,
+        "opponent": opponent,
+        "seed": seed,
+        "winner": winner, # "challenger", "opponent" or None for a draw
+        "ticks": battle.game_tick,
+        "survivors": survivors["challenger"],
+        "opponent_survivors": survivors["opponent"],
+    })
+
+def _play_match_job(job):
+    """Pool wrapper for play_match."""
+    return(play_match(*job))
+
+def battle_key(result):
+    return((stats_key(result["stats"]), result["antgorithm"], result["opponent"], result["seed"]))
+
+def load_battles(path):
+    """Return the battles already in a battles.jsonl file, keyed by (stats, antgorithm, opponent, seed)."""
+    battles = {}
+    if not os.path.exists(path):
+        return(battles)
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut short by an interruption, that battle gets replayed
+            battles[battle_key(result)] = result
+    return(battles)
+
+class RandomSearch():
+    """Asks for batch_size points uniformly at random (the first batch starts with BASIC_ANT_STATS)."""
+    def __init__(self, start, batch_size=16, seed=0):
+        self.start = list(start)
+        self.n = len(start)
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+
+    def ask(self):
+        points = [[self.rng.random() for _ in range(self.n)] for _ in range(self.batch_size)]
+        if self.start is not None:
+            points[0], self.start = self.start, None
+        return(points)
+
+    def tell(self, points, scores):
+        pass
+
+class CMAES():
+    """Covariance matrix adaptation evolution strategy, (mu/mu_w, lambda) with the usual default settings."""
+    def __init__(self, start, sigma=0.3, batch_size=None, seed=0):
+        if np is None:
+            raise ImportError("CMA-ES requires numpy")
+        n = self.n = len(start)
+        self.rng = np.random.default_rng(seed)
+        self.mean = np.array(start, dtype=np.float64)
+        self.sigma = sigma
+        self.batch_size = batch_size or 4 + int(3 * math.log(n))
+        self.mu = self.batch_size // 2
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / (self.weights**2).sum()
+
+        # Learning rates of the paths, the covariance matrix and the step size
+        self.cc = (4 + self.mueff/n) / (n + 4 + 2*self.mueff/n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3)**2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1/self.mueff) / ((n + 2)**2 + self.mueff))
+        self.damps = 1 + 2*max(0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1/(4*n) + 1/(21*n**2)) # Expected length of an N(0, I) vector
+
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.B = np.eye(n)
+        self.D = np.ones(n)
+        self.C = np.eye(n)
+        self.generation = 0
+
+    def ask(self):
+        z = self.rng.standard_normal((self.batch_size, self.n))
+        self._asked = self.mean + self.sigma * (z * self.D) @ self.B.T
+        return(self._asked.tolist()) # Points outside the cube are clipped when decoded, the update uses them as they are
+
+    def tell(self, points, scores):
+        n = self.n
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:self.mu]
+        x = self._asked[order]
+        old_mean = self.mean
+        self.mean = self.weights @ x
+        y_w = (self.mean - old_mean) / self.sigma
+
+        # Update the evolution paths
+        inv_sqrt_C = self.B @ np.diag(1 / self.D) @ self.B.T
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * inv_sqrt_C @ y_w
+        ps_norm = np.linalg.norm(self.ps)
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs)**(2 * (self.generation + 1))) / self.chi_n < 1.4 + 2/(n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * y_w
+
+        # Update the covariance matrix and the step size
+        steps = (x - old_mean) / self.sigma
+        self.C = ((1 - self.c1 - self.cmu) * self.C
+                  + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.C)
+                  + self.cmu * (steps.T * self.weights) @ steps)
+        self.sigma *= math.exp((self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+        self.C = (self.C + self.C.T) / 2
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+        self.generation += 1
+
+class GeneticAlgorithm():
+    """Tournament selection, uniform crossover and Gaussian mutation, keeping the best n_elite unchanged."""
+    def __init__(self, start, batch_size=16, n_elite=2, mutation=0.1, seed=0):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.n_elite = n_elite
+        self.mutation = mutation
+        self.population = [list(start)] + [[self.rng.random() for _ in start] for _ in range(batch_size - 1)]
+
+    def ask(self):
+        return(self.population)
+
+    def _pick(self, ranked):
+        """Return the better of two random members (ranked is best first)."""
+        return(ranked[min(self.rng.randrange(len(ranked)), self.rng.randrange(len(ranked)))])
+
+    def tell(self, points, scores):
+        ranked = [points[i] for i in sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)]
+        children = [list(point) for point in ranked[:self.n_elite]]
+        while len(children) < self.batch_size:
+            mother, father = self._pick(ranked), self._pick(ranked)
+            child = [m if self.rng.random() < 0.5 else f for m, f in zip(mother, father)]
+            for i in range(len(child)):
+                if self.rng.random() < 1 / len(child):
+                    child[i] = min(max(child[i] + self.rng.gauss(0, self.mutation), 0), 1)
+            children.append(child)
+        self.population = children
+
+def make_optimizer(name, start, batch_size=None, seed=0):
+    if name == "random":
+        return(RandomSearch(start, batch_size=batch_size or 16, seed=seed))
+    if name == "cmaes":
+        return(CMAES(start, batch_size=batch_size, seed=seed))
+    if name == "genetic":
+        return(GeneticAlgorithm(start, batch_size=batch_size or 16, seed=seed))
+    raise ValueError(f"No optimizer called {name} (choose from {', '.join(OPTIMIZERS)})")
+
+def pareto_front(candidates):
+    """Return the candidates no other beats on both win rate and stat budget, cheapest first."""
+    front = []
+    for candidate in sorted(candidates, key=lambda c: (c["budget"], -c["win_rate"])):
+        if not front or candidate["win_rate"] > front[-1]["win_rate"]:
+            front.append(candidate)
+    return(front)
+
+class Search():
+    """Plays the battles candidates need (skipping those already in battles.jsonl) and scores them."""
+    def __init__(self, out_dir, antgorithm, opponents, n_seeds, n_ants, max_ticks, budget_weight, pool):
+        self.antgorithm = antgorithm
+        self.opponents = opponents
+        self.n_seeds = n_seeds
+        self.n_ants = n_ants
+        self.max_ticks = max_ticks
+        self.budget_weight = budget_weight
+        self.pool = pool
+        self.battles_path = os.path.join(out_dir, "battles.jsonl")
+        self.battles = load_battles(self.battles_path)
+        self.candidates = {} # {stats key: the candidate's scores, on the most seeds it has played}
+        self.n_played = 0
+
+    def play(self, stats_list, n_seeds):
+        """Play whatever battles these stats haven't played against every opponent on seeds 0 to n_seeds - 1."""
+        jobs, queued = [], []
+        for stats in stats_list:
+            for opponent in self.opponents:
+                for seed in range(n_seeds):
+                    key = (stats_key(stats), self.antgorithm, opponent, seed)
+                    if key not in self.battles:
+                        self.battles[key] = None # Queued, so the same battle isn't asked for twice
+                        queued.append(key)
+                        jobs.append((stats, self.antgorithm, opponent, seed, self.n_ants, self.max_ticks))
+        try:
+            with open(self.battles_path, "a") as checkpoint:
+                for result in self.pool.imap_unordered(_play_match_job, jobs):
+                    checkpoint.write(json.dumps(result) + "\n")
+                    checkpoint.flush() # Every finished battle survives an interruption
+                    self.battles[battle_key(result)] = result
+        finally:
+            # Battles that never finished go back to unplayed
+            for key in queued:
+                if self.battles[key] is None:
+                    del self.battles[key]
+        self.n_played += len(jobs)
+
+    def score(self, stats, n_seeds):
+        """Return a candidate's results over seeds 0 to n_seeds - 1 (draws count as half a win)."""
+        per_opponent = {}
+        for opponent in self.opponents:
+            results = [self.battles[(stats_key(stats), self.antgorithm, opponent, seed)] for seed in range(n_seeds)]
+            wins = sum(1 if result["winner"] == "challenger" else 0.5 if result["winner"] is None else 0 for result in results)
+            per_opponent[opponent] = wins / n_seeds
+        win_rate = sum(per_opponent.values()) / len(per_opponent)
+        budget = stat_budget(stats)
+        candidate = {"stats": stats, "seeds": n_seeds, "win_rate": win_rate, "budget": budget,
+                     "fitness": win_rate - self.budget_weight * budget, "per_opponent": per_opponent}
+        known = self.candidates.get(stats_key(stats))
+        if known is None or known["seeds"] <= n_seeds:
+            self.candidates[stats_key(stats)] = candidate
+        return(candidate)
+
+    def evaluate(self, points, names, min_seeds, eta):
+        """Score a generation with successive halving and return each point's score for the optimizer.
+
+        A score is (how many rounds the candidate got through, its fitness),
+        so candidates that were stopped early rank below those that weren't.
+        """
+        stats_list = [decode(point, names) for point in points]
+        scores = [None] * len(points)
+        alive = list(range(len(points)))
+        n_seeds = min(min_seeds, self.n_seeds)
+        rung = 0
+        while True:
+            self.play([stats_list[i] for i in alive], n_seeds)
+            fitness = {i: self.score(stats_list[i], n_seeds)["fitness"] for i in alive}
+            for i in alive:
+                scores[i] = (rung, fitness[i])
+            if n_seeds >= self.n_seeds or len(alive) <= 1:
+                break
+            alive = sorted(alive, key=lambda i: fitness[i], reverse=True)[:max(1, math.ceil(len(alive) / eta))]
+            n_seeds = min(n_seeds * eta, self.n_seeds)
+            rung += 1
+        return(scores)
+
+    def finished(self):
+        """Return the candidates that played every seed."""
+        return([candidate for candidate in self.candidates.values() if candidate["seeds"] >= self.n_seeds])
+
+def write_reports(out_dir, search, settings):
+    """Write candidates.csv and pareto.json, returning the overall Pareto front."""
+    candidates = sorted(search.candidates.values(), key=lambda c: (-c["seeds"], -c["fitness"]))
+    with open(os.path.join(out_dir, "candidates.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(STAT_NAMES + ["seeds", "win_rate", "budget", "fitness"] + [f"win_rate_vs_{opponent}" for opponent in search.opponents])
+        for c in candidates:
+            writer.writerow([c["stats"][name] for name in STAT_NAMES] + [c["seeds"], c["win_rate"], c["budget"], c["fitness"]]
+                            + [c["per_opponent"][opponent] for opponent in search.opponents])
+
+    finished = search.finished()
+    front = pareto_front(finished)
+    fronts = {opponent: pareto_front([dict(c, win_rate=c["per_opponent"][opponent]) for c in finished]) for opponent in search.opponents}
+    with open(os.path.join(out_dir, "pareto.json"), "w") as f:
+        json.dump({"settings": settings, "baseline_budget": stat_budget(BASIC_ANT_STATS), "front": front, "fronts_by_opponent": fronts}, f, indent=2)
+    return(front)
+
+def run_search(out_dir, antgorithm, opponents=None, names=None, optimizer="cmaes", generations=10, batch_size=None,
+               n_seeds=16, min_seeds=2, eta=2, n_ants=30, max_ticks=2000, budget_weight=0.5, n_workers=None, seed=0):
+    """Search for stats (of the names given, by default every stat that counts towards the budget) and return the Pareto front."""
+    opponents = opponents or [antgorithm]
+    names = names or BUDGET_STATS
+    unknown = [name for name in [antgorithm] + opponents if name not in registry]
+    if unknown:
+        raise ValueError(f"No antgorithm called {', '.join(unknown)} (found: {', '.join(registry.names())})")
+    unknown = [name for name in names if name not in STAT_RANGES]
+    if unknown:
+        raise ValueError(f"No stat called {', '.join(unknown)} (choose from {', '.join(STAT_RANGES)})")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Battles already played are only reused if they were played with the same settings
+    battle_settings = {"ants": n_ants, "max_ticks": max_ticks, "bounds": list(ARENA_BOUNDS), "opponent_stats": BASIC_ANT_STATS}
+    settings_path = os.path.join(out_dir, "battle_settings.json")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if json.load(f) != json.loads(json.dumps(battle_settings)):
+                raise ValueError(out_dir + " holds battles played with different settings, use another --out")
+    else:
+        with open(settings_path, "w") as f:
+            json.dump(battle_settings, f, indent=2)
+
+    search_optimizer = make_optimizer(optimizer, encode(BASIC_ANT_STATS, names), batch_size=batch_size, seed=seed)
+    with multiprocessing.Pool(processes=n_workers) as pool:
+        search = Search(out_dir, antgorithm, opponents, n_seeds, n_ants, max_ticks, budget_weight, pool)
+        print(f"{len(search.battles)} battles already played")
+        for generation in range(generations):
+            points = search_optimizer.ask()
+            scores = search.evaluate(points, names, min_seeds, eta)
+            search_optimizer.tell(points, scores)
+            best = max(search.finished(), key=lambda c: c["fitness"], default=None)
+            print(f"[{generation+1}/{generations}] {search.n_played} battles played"
+                  + (f", best: {best['win_rate']:.0%} won on a budget of {best['budget']:.2f}" if best else ""))
+
+    settings = dict(battle_settings, antgorithm=antgorithm, opponents=opponents, stats=names, optimizer=optimizer,
+                    seeds=n_seeds, budget_weight=budget_weight)
+    return(write_reports(out_dir, search, settings))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search for balanced ant stats with headless battles.")
+    parser.add_argument("--out", default="balance_results", help="output (and battle cache) directory")
+    parser.add_argument("--antgorithm", default="attacking_ant", help="antgorithm of the team whose stats are searched")
+    parser.add_argument("--opponents", nargs="+", default=None, help="antgorithms it plays, with BASIC_ANT_STATS (default: itself)")
+    parser.add_argument("--stats", nargs="+", default=None, help=f"stats to search (default: {' '.join(BUDGET_STATS)})")
+    parser.add_argument("--optimizer", choices=OPTIMIZERS, default="cmaes")
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=None, help="candidates per generation (default: 16, or CMA-ES's own)")
+    parser.add_argument("--seeds", type=int, default=16, help="battles per opponent for candidates that aren't stopped early")
+    parser.add_argument("--min-seeds", type=int, default=2, help="battles per opponent every candidate plays")
+    parser.add_argument("--eta", type=int, default=2, help="successive halving keeps 1/eta of the candidates each round")
+    parser.add_argument("--ants", type=int, default=30, help="ants per team")
+    parser.add_argument("--max-ticks", type=int, default=2000, help="battles still going after this many ticks are draws")
+    parser.add_argument("--budget-weight", type=float, default=0.5, help="fitness is win rate minus this times the stat budget")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the optimizer")
+    args = parser.parse_args()
+
+    try:
+        front = run_search(args.out, args.antgorithm, opponents=args.opponents, names=args.stats, optimizer=args.optimizer,
+                           generations=args.generations, batch_size=args.batch_size, n_seeds=args.seeds, min_seeds=args.min_seeds,
+                           eta=args.eta, n_ants=args.ants, max_ticks=args.max_ticks, budget_weight=args.budget_weight,
+                           n_workers=args.workers, seed=args.seed)
+    except (ValueError, ImportError) as e:
+        parser.error(str(e))
+    print(f"Pareto front (BASIC_ANT_STATS has a budget of {stat_budget(BASIC_ANT_STATS):.2f}):")
+    for candidate in front:
+        changed = ", ".join(f"{name}={candidate['stats'][name]}" for name in STAT_NAMES if candidate["stats"][name] != BASIC_ANT_STATS[name])
+        print(f"  budget {candidate['budget']:.2f}: {candidate['win_rate']:.0%} won ({changed or 'BASIC_ANT_STATS'})")
@@ -0,0 +1,64 @@
+"""Benchmark the end of tick phase with and without Battle(array_state=True).
+
+Run with `python benchmarks/bench_array_state.py`. Both battles get the same
+ants and the same instructions every tick (taken from the object battle's
+antgorithms), so the timings only cover resolve_instructions, resolve_attacks
+and resolve_messages. The final positions and health of the two battles are
+compared at the end.
+"""
+
+import argparse
+import math
+import random
+import time
+
+from common import make_battle
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+def facing(i, side):
+    """Place red ants on the left half facing right and blue ants on the right half facing left."""
+    if i % 2 == 0:
+        return((random.uniform(0, side/2), random.random() * side, 0))
+    return((random.uniform(side/2, side), random.random() * side, math.pi))
+
+def end_of_tick(battle):
+    """Run the end of tick housekeeping and return its wall time in seconds."""
+    start = time.perf_counter()
+    battle.resolve_instructions()
+    battle.resolve_attacks()
+    battle.resolve_messages()
+    elapsed = time.perf_counter() - start
+    battle.game_tick += 1
+    return(elapsed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ants", type=int, default=10000)
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    object_battle = make_battle(args.ants, TEAMS, place=facing)
+    array_battle = make_battle(args.ants, TEAMS, place=facing, array_state=True)
+    object_time, array_time = 0, 0
+    for _ in range(args.ticks):
+        # Give both battles the instructions from the object battle's antgorithms
+        for ant, array_ant in zip(object_battle.ants, array_battle.ants):
+            instruction = ant.antgorithm(ant)
+            object_battle.instruction_queue[ant.id] = instruction
+            array_battle.instruction_queue[array_ant.id] = instruction
+        object_time += end_of_tick(object_battle)
+        array_time += end_of_tick(array_battle)
+
+    print(f"{args.ants} ants, {args.ticks} ticks")
+    print(f"  objects: {object_time/args.ticks*1000:8.2f} ms/tick end of tick")
+    print(f"  arrays:  {array_time/args.ticks*1000:8.2f} ms/tick end of tick ({object_time/array_time:.1f}x)")
+
+    # Check the two battles still agree
+    object_ants = {ant._order: ant for ant in object_battle.ants}
+    max_error = 0
+    for ant in array_battle.ants:
+        other = object_ants[ant._order]
+        max_error = max(max_error, abs(ant.x - other.x), abs(ant.y - other.y), abs(ant.rotation - other.rotation), abs(ant.health - other.health))
+    print(f"  survivors: {len(object_battle.ants)} vs {len(array_battle.ants)}, max difference {max_error:.3g}")
@@ -0,0 +1,45 @@
+"""Benchmark forking, snapshotting and restoring a battle.
+
+Run from anywhere with `python benchmarks/bench_fork.py`. Each battle is a
+marching_ant vs attacking_ant battle (at the density of bench_spatial.py)
+that has run a few ticks, so ants have used their generators and posted
+messages. "fork" is the time to make a fork and discard it (the way a
+lookahead does with `with battle.fork() as lookahead:`), "fork+tick" adds
+stepping the fork once and "tick" is the difference, for scale. "snapshot"
+and "restore" time Battle.snapshot and Battle.restore, and "bytes" is the
+size of the snapshot.
+"""
+
+import argparse
+
+from common import make_battle, best_of
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+def fork_and_discard(battle):
+    with battle.fork():
+        pass
+
+def fork_and_step(battle):
+    with battle.fork() as lookahead:
+        lookahead.step()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 400, 1600, 6400])
+    parser.add_argument("--warmup", type=int, default=5, help="ticks to run before measuring")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--array-state", action="store_true", help="benchmark array-backed battles")
+    args = parser.parse_args()
+
+    print(f"{'ants':>6} {'fork ms':>8} {'fork+tick ms':>13} {'tick ms':>8} {'snapshot ms':>12} {'restore ms':>11} {'bytes':>10}")
+    for n_ants in args.counts:
+        battle = make_battle(n_ants, TEAMS, array_state=args.array_state)
+        battle.run(max_ticks=args.warmup)
+        fork = best_of(lambda: fork_and_discard(battle), args.repeat)
+        fork_tick = best_of(lambda: fork_and_step(battle), max(args.repeat // 4, 1))
+        blob = battle.snapshot()
+        snapshot = best_of(battle.snapshot, max(args.repeat // 4, 1))
+        restore = best_of(lambda: battle.restore(blob), max(args.repeat // 4, 1))
+        print(f"{n_ants:>6} {fork*1000:>8.2f} {fork_tick*1000:>13.2f} {(fork_tick - fork)*1000:>8.2f} {snapshot*1000:>12.1f} {restore*1000:>11.1f} {len(blob):>10}")
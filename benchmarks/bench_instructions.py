@@ -0,0 +1,88 @@
+"""Benchmark queueing and resolving instructions.
+
+Run from anywhere with `python benchmarks/bench_instructions.py`. Every ant
+runs a trivial antgorithm (so the timings are mostly the instruction
+handling), once returning method tuples into a plain dict resolved with
+getattr (how instructions were handled before instructions.py), once
+returning method tuples into battle.instruction_queue, and once returning
+opcodes into it. "objects" is how many memory blocks a tick's instructions
+hold between the antgorithms and resolve_instructions (with gc off), per
+tick. The three runs end in the same state, which is checked.
+"""
+
+import argparse
+import gc
+import sys
+import time
+
+from common import make_battle, battle_state
+from instructions import WALK, TURN, STRAFE, BITE
+
+def method_tuple_ant(self):
+    r = self.rng.random()
+    if r < 0.6:
+        return("walk", {})
+    if r < 0.8:
+        return("turn", {"rel_angle": r - 0.7})
+    if r < 0.9:
+        return("strafe", {"rel_angle": r})
+    return("bite", {})
+
+def opcode_ant(self):
+    r = self.rng.random()
+    if r < 0.6:
+        return(WALK)
+    if r < 0.8:
+        return(TURN, r - 0.7)
+    if r < 0.9:
+        return(STRAFE, r)
+    return(BITE)
+
+def resolve_dict_queue(battle, queue):
+    """Resolve a {ant id: (method, kwargs)} dict the way Battle used to."""
+    for ant_id, (method, kwargs) in queue.items():
+        getattr(battle.ants.get(ant_id), method)(**kwargs)
+    battle.update_grid()
+
+def time_ticks(battle, n_ticks, dict_queue):
+    """Return the mean wall time of queueing and resolving a tick's instructions, and the blocks they hold."""
+    total, held = 0, 0
+    gc.disable()
+    try:
+        for _ in range(n_ticks):
+            before = sys.getallocatedblocks()
+            start = time.perf_counter()
+            queue = {} if dict_queue else battle.instruction_queue
+            for ant in battle.ants:
+                queue[ant.id] = ant.antgorithm(ant)
+            held += sys.getallocatedblocks() - before
+            if dict_queue:
+                resolve_dict_queue(battle, queue)
+                queue = None # Battle dropped the dict at the end of the tick
+            else:
+                battle.resolve_instructions()
+            total += time.perf_counter() - start
+            battle.resolve_attacks()
+            battle.resolve_messages()
+            battle.game_tick += 1
+    finally:
+        gc.enable()
+    return(total / n_ticks, held / n_ticks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[400, 1600, 5000, 10000])
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    runs = [("dict, tuples", method_tuple_ant, True), ("buffer, tuples", method_tuple_ant, False), ("buffer, opcodes", opcode_ant, False)]
+    print(f"{'ants':>8} " + " ".join(f"{name:>28}" for name, _, _ in runs) + f" {'same':>5}")
+    for n_ants in args.counts:
+        results, states = [], []
+        for name, antgorithm, dict_queue in runs:
+            battle = make_battle(n_ants, [("red", antgorithm), ("blue", antgorithm)])
+            tick, held = time_ticks(battle, args.ticks, dict_queue)
+            results.append(f"{tick*1000:>8.2f} ms {held:>8.0f} objects")
+            states.append(battle_state(battle))
+        same = all(state == states[0] for state in states)
+        print(f"{n_ants:>8} " + " ".join(f"{result:>28}" for result in results) + f" {'yes' if same else 'NO':>5}")
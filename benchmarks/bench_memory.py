@@ -0,0 +1,61 @@
+"""Benchmark how much memory each ant and each message takes.
+
+Run from anywhere with `python benchmarks/bench_memory.py`. Ants are added to
+a battle (at the density of bench_spatial.py) with tracemalloc running, so
+"bytes/ant" covers everything the battle keeps for an ant: the Ant object,
+its memory dict and random number generator, its grid entry and its team's
+bookkeeping. The battle then runs a tick so every ant uses its rng, and
+messages are measured the same way as they're broadcast. "Ant object" is
+sys.getsizeof of one ant on its own (plus its __dict__, if it has one).
+"""
+
+import argparse
+import sys
+import tracemalloc
+
+from common import make_battle, arena_side, scatter
+from models import Ant
+from simulate import BASIC_ANT_STATS
+
+def random_walker(self):
+    if self.rng.random() < 0.1:
+        return("turn", {"rel_angle": self.rng.random() - 0.5})
+    return("walk", {})
+
+def object_size(obj):
+    """Return the size of an object and its __dict__ (if it has one), in bytes."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return(size)
+
+def measure(n_ants, array_state, seed=0):
+    """Return (bytes per ant, bytes per ant once every rng has been used, bytes per message, size of an Ant object)."""
+    side = arena_side(n_ants)
+    battle = make_battle(0, [], side=side, array_state=array_state, seed=seed) # The ants are added with tracemalloc running
+    positions = [scatter(i, side) for i in range(n_ants)]
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for i, init_position in enumerate(positions):
+        Ant(battle, "red" if i % 2 == 0 else "blue", stats_dict=BASIC_ANT_STATS, init_position=init_position, antgorithm=random_walker)
+    added = tracemalloc.get_traced_memory()[0]
+    battle.step()
+    stepped = tracemalloc.get_traced_memory()[0]
+    for ant in battle.ants:
+        ant.broadcast("here", topic="position")
+    broadcast = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    ant_size = object_size(next(iter(battle.ants)))
+    return((added - start) / n_ants, (stepped - start) / n_ants, (broadcast - stepped) / n_ants, ant_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--array-state", action="store_true", help="measure array-backed ants (needs numpy)")
+    args = parser.parse_args()
+
+    print(f"{'ants':>8} {'bytes/ant':>10} {'after a tick':>13} {'bytes/message':>14} {'Ant object':>11} {'total MB':>9}")
+    for n_ants in args.counts:
+        per_ant, per_ant_stepped, per_message, ant_size = measure(n_ants, args.array_state)
+        print(f"{n_ants:>8} {per_ant:>10.0f} {per_ant_stepped:>13.0f} {per_message:>14.0f} {ant_size:>11} {per_ant_stepped * n_ants / 2**20:>9.1f}")
@@ -0,0 +1,32 @@
+"""Benchmark serial against process-pool antgorithm execution.
+
+Run with `python benchmarks/bench_parallel.py --ants 20000 --workers 8 16 32`.
+Each run uses the same battle (marching_ant against attacking_ant at the
+density of the default battle) and reports the mean wall time of a tick.
+"""
+
+import argparse
+import os
+
+from common import make_battle, time_ticks
+from parallel import ParallelExecutor
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ants", type=int, default=20000)
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    serial = time_ticks(make_battle(args.ants, TEAMS), args.ticks, warmup=1)
+    print(f"{args.ants} ants on {os.cpu_count()} cores")
+    print(f"  serial:     {serial*1000:9.1f} ms/tick")
+    for n_workers in args.workers:
+        battle = make_battle(args.ants, TEAMS)
+        with ParallelExecutor(n_workers=n_workers) as executor:
+            battle.executor = executor
+            per_tick = time_ticks(battle, args.ticks, warmup=1)
+        print(f"  {n_workers:>3} workers: {per_tick*1000:9.1f} ms/tick ({serial/per_tick:.1f}x)")
@@ -0,0 +1,79 @@
+"""Benchmark draw_ants against the number of ants on screen.
+
+Run from anywhere with `python benchmarks/bench_renderer.py`. Compares
+rotating every ant's surface each frame (how draw_ants used to work) with
+blitting from the renderer's SpriteAtlas, and with the density map a
+renderer.View draws past its level-of-detail threshold ("density ms", which
+includes pushing the changed area to the display). Without a display it
+uses SDL's dummy video driver, so the times don't include showing the frame.
+Pass --density-only to time just the density map, for counts too big to
+draw as sprites.
+"""
+
+import argparse
+import math
+import os
+import time
+
+from common import make_battle
+
+if "DISPLAY" not in os.environ:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import renderer
+from simulate import BASIC_ANT_STATS
+from antgorithms import marching_ant
+
+TEAMS = [(team, marching_ant.antgorithm) for team in ["red", "blue", "green", "black"]]
+
+def draw_ants_rotating(screen, battle, arena, body_surfs):
+    """Draw the ants by rotating each one's surface every frame."""
+    screen.blit(arena, (0, 0))
+    for ant in battle.ants:
+        if ant.alive:
+            rotated_ant = pygame.transform.rotate(body_surfs[ant.team], -ant.rotation*180/math.pi - 90 % 360)
+            rotated_ant.set_colorkey((255, 255, 255))
+            screen.blit(rotated_ant, (ant.x - rotated_ant.get_width()/2, ant.y - rotated_ant.get_height()/2))
+
+def time_frames(draw, battle, n_frames):
+    """Return the mean wall time of draw() in seconds, turning every ant a little between frames."""
+    total = 0
+    for _ in range(n_frames):
+        for ant in battle.ants:
+            ant.rotation += 0.05
+        start = time.perf_counter()
+        draw()
+        total += time.perf_counter() - start
+    return(total / n_frames)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 400, 1600, 5000])
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--angles", type=int, default=64, help="angle buckets in the atlas")
+    parser.add_argument("--density-only", action="store_true", help="only time the density map")
+    args = parser.parse_args()
+
+    pygame.init()
+    screen = pygame.display.set_mode((800, 800))
+    arena = pygame.Surface((800, 800))
+    arena.fill((255, 255, 255))
+    body_surfs = {team: renderer.load_body_surf(team, BASIC_ANT_STATS["size"]) for team, _ in TEAMS}
+    atlas = renderer.SpriteAtlas(n_angles=args.angles)
+
+    view = renderer.View((800, 800), lod_ants=0)
+
+    print(f"{'ants':>8} {'rotate ms':>10} {'atlas ms':>10} {'speedup':>8} {'density ms':>11}")
+    for n_ants in args.counts:
+        battle = make_battle(n_ants, TEAMS, side=800) # Every count on the same 800x800 screen
+        density = time_frames(lambda: pygame.display.update(renderer.draw_frame(screen, battle, view)), battle, args.frames)
+        if args.density_only:
+            print(f"{n_ants:>8} {'':>10} {'':>10} {'':>8} {density*1000:>11.2f}")
+            continue
+        renderer.draw_ants(screen, battle, arena, atlas=atlas) # Build the atlas outside the timing
+        rotating = time_frames(lambda: draw_ants_rotating(screen, battle, arena, body_surfs), battle, args.frames)
+        cached = time_frames(lambda: renderer.draw_ants(screen, battle, arena, atlas=atlas), battle, args.frames)
+        print(f"{n_ants:>8} {rotating*1000:>10.2f} {cached*1000:>10.2f} {rotating/cached:>7.1f}x {density*1000:>11.2f}")
+    print(f"atlas: {args.angles} angles, {atlas.n_bytes / 2**20:.2f} MiB")
+    pygame.quit()
@@ -0,0 +1,41 @@
+"""Benchmark sharded battles against running the whole arena in one process.
+
+Run from anywhere with `python benchmarks/bench_sharded.py`. Each battle is a
+marching_ant vs attacking_ant battle spread over an arena sized for the ant
+count (at the density of bench_spatial.py), run for a number of ticks in one
+process and then split into tiles with sharded.ShardedBattle (one worker
+process per tile, so it only pays off with that many cores). The two runs
+end in the same state, which is checked.
+"""
+
+import argparse
+import time
+
+from common import make_battle, battle_state
+from sharded import ShardedBattle
+from simulate import parse_tiles
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1600, 6400, 25600])
+    parser.add_argument("--ticks", type=int, default=10)
+    parser.add_argument("--tiles", type=parse_tiles, nargs="+", default=[(2, 2), (4, 4)])
+    args = parser.parse_args()
+
+    print(f"{'ants':>8} {'arena':>7} {'tiles':>6} {'one process ms/tick':>20} {'sharded ms/tick':>16} {'same':>5}")
+    for n_ants in args.counts:
+        battle = make_battle(n_ants, TEAMS)
+        start = time.perf_counter()
+        battle.run(max_ticks=args.ticks)
+        serial = (time.perf_counter() - start) / args.ticks
+        for tiles in args.tiles:
+            sharded_battle = make_battle(n_ants, TEAMS)
+            with ShardedBattle(sharded_battle, tiles=tiles) as sharded:
+                start = time.perf_counter()
+                sharded.run(max_ticks=args.ticks)
+                elapsed = (time.perf_counter() - start) / args.ticks
+            same = battle_state(battle) == battle_state(sharded_battle)
+            print(f"{n_ants:>8} {battle.bounds[0]:>7} {f'{tiles[0]}x{tiles[1]}':>6} {serial*1000:>20.1f} {elapsed*1000:>16.1f} {'yes' if same else 'NO':>5}")
@@ -0,0 +1,27 @@
+"""Benchmark the time per tick against the number of ants.
+
+Run from anywhere with `python benchmarks/bench_spatial.py`. The ants are
+spread over an arena that grows with the ant count (so density stays about the
+same as the 4x100 battle in simulate.py) and run marching_ant and attacking_ant.
+"""
+
+import argparse
+
+from common import make_battle, time_ticks
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 200, 400, 800, 1600, 3200, 5000])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--no-bulk-sensing", action="store_true", help="have every ant query the grid itself")
+    args = parser.parse_args()
+
+    print(f"{'ants':>8} {'ms/tick':>10} {'us/ant':>10}")
+    for n_ants in args.counts:
+        battle = make_battle(n_ants, TEAMS)
+        battle.bulk_sensing = not args.no_bulk_sensing
+        per_tick = time_ticks(battle, args.ticks)
+        print(f"{n_ants:>8} {per_tick*1000:>10.2f} {per_tick*1e6/n_ants:>10.2f}")
@@ -0,0 +1,55 @@
+"""Benchmark team antgorithms against the per-ant antgorithms they port.
+
+Run from anywhere with `python benchmarks/bench_team_antgorithm.py`. Each
+battle is an array-backed marching_ant vs attacking_ant battle (at the density
+of bench_spatial.py), run once with every ant calling its own antgorithm and
+once with team_antgorithm for both teams. The two runs end in the same state,
+which is checked.
+"""
+
+import argparse
+import time
+
+from common import make_battle, battle_state
+from antgorithms import marching_ant, attacking_ant
+
+TEAMS = [("red", marching_ant.antgorithm), ("blue", attacking_ant.antgorithm)]
+
+def make_team_battle(n_ants, team_antgorithms):
+    """Make an array-backed two-team battle with n_ants ants, optionally run by team antgorithms."""
+    battle = make_battle(n_ants, TEAMS, array_state=True)
+    if team_antgorithms:
+        battle.use_team_antgorithm("red", marching_ant.team_antgorithm)
+        battle.use_team_antgorithm("blue", attacking_ant.team_antgorithm)
+    return(battle)
+
+def time_ticks(battle, n_ticks):
+    """Return the mean wall time of a tick and of its antgorithm phase, in seconds."""
+    total, antgorithms = 0, 0
+    for _ in range(n_ticks):
+        start = time.perf_counter()
+        battle.run_antgorithms()
+        middle = time.perf_counter()
+        battle.resolve_instructions()
+        battle.resolve_attacks()
+        battle.resolve_messages()
+        battle.game_tick += 1
+        end = time.perf_counter()
+        total += end - start
+        antgorithms += middle - start
+    return(total / n_ticks, antgorithms / n_ticks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[400, 1600, 5000, 10000])
+    parser.add_argument("--ticks", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'ants':>8} {'per-ant ms/tick':>16} {'team ms/tick':>13} {'per-ant antgorithms':>20} {'team antgorithms':>17} {'same':>5}")
+    for n_ants in args.counts:
+        per_ant_battle = make_team_battle(n_ants, team_antgorithms=False)
+        team_battle = make_team_battle(n_ants, team_antgorithms=True)
+        per_ant_tick, per_ant_antgorithms = time_ticks(per_ant_battle, args.ticks)
+        team_tick, team_antgorithms = time_ticks(team_battle, args.ticks)
+        same = battle_state(per_ant_battle) == battle_state(team_battle)
+        print(f"{n_ants:>8} {per_ant_tick*1000:>16.2f} {team_tick*1000:>13.2f} {per_ant_antgorithms*1000:>17.2f} ms {team_antgorithms*1000:>14.2f} ms {'yes' if same else 'NO':>5}")
@@ -0,0 +1,65 @@
+"""Battle factory and timing helpers shared by the benchmarks.
+
+Importing this puts the repository root on sys.path, so benchmarks can be run
+from anywhere. Benchmark battles are seeded and use BASIC_ANT_STATS, and by
+default spread their ants over an arena that grows with the ant count, so
+density stays about the same as the 4x100 battle in simulate.py.
+"""
+
+import math
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from models import Battle, Ant
+from simulate import BASIC_ANT_STATS
+
+def arena_side(n_ants):
+    """Return the side of a square arena that holds n_ants at the density of the default battle."""
+    return(int(800 * math.sqrt(n_ants / 400)))
+
+def scatter(i, side):
+    """Place an ant anywhere in the arena, facing anywhere."""
+    return((random.random() * side, random.random() * side, random.random() * 2 * math.pi))
+
+def make_battle(n_ants, teams, side=None, place=scatter, array_state=False, seed=0):
+    """Make a battle with n_ants ants, dealt out in turn to teams, a list of (team, antgorithm).
+
+    place(i, side) returns the ith ant's init_position and is called in order
+    with the random module seeded, so a battle made twice is the same battle.
+    """
+    random.seed(seed)
+    battle = Battle(array_state=array_state, seed=seed)
+    side = side or arena_side(n_ants)
+    battle.bounds = (side, side)
+    for i in range(n_ants):
+        team, antgorithm = teams[i % len(teams)]
+        Ant(battle, team, stats_dict=BASIC_ANT_STATS, init_position=place(i, side), antgorithm=antgorithm)
+    return(battle)
+
+def time_ticks(battle, n_ticks, warmup=0):
+    """Return the mean wall time of a tick in seconds (after warmup untimed ticks)."""
+    for _ in range(warmup):
+        battle.step()
+    start = time.perf_counter()
+    for _ in range(n_ticks):
+        battle.step()
+    return((time.perf_counter() - start) / n_ticks)
+
+def best_of(function, repeat):
+    """Return the fastest of repeat calls to function, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best)
+
+def battle_state(battle):
+    """Return every live ant's id, position and health, to check two runs ended the same."""
+    return([(ant.id, ant.x, ant.y, ant.rotation, ant.health) for ant in battle.ants])
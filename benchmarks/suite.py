@@ -0,0 +1,231 @@
+"""Run the regression benchmark suite of canonical battles.
+
+Run from anywhere with `python benchmarks/suite.py`. Each scenario in
+benchmarks/scenarios/ is a battle config (see simulate.py) with a fixed seed
+and the number of ticks to run, set up and run headless three ways: --repeat
+times as it is (the fastest run gives ticks/sec), once with a TickProfiler
+(ms per tick of each phase) and once under tracemalloc (the peak of Python's
+allocations, setting the battle up included). Scenarios with "renderer": true
+also draw every tick with renderer.py (on SDL's dummy driver if there's no
+display) and only run with --renderer. "damage" is the health the ants lost
+to bites, and scenarios with "expect_bites": true fail the suite (exit 1) if
+no ant was bitten, so a fight that never happens doesn't go unnoticed.
+
+Results are written to --out as JSON. --save-baseline keeps them as the
+baseline and --compare checks them against it, exiting with 1 if a scenario's
+ticks/sec fell or its peak memory grew by more than --threshold. Timings only
+compare on the same machine, so save the baseline on the one you'll compare on
+(it isn't checked in).
+
+    python benchmarks/suite.py --save-baseline
+    python benchmarks/suite.py --compare --threshold 0.1
+    python benchmarks/suite.py --scenarios default_4x100 --renderer
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from profiler import TickProfiler
+from simulate import setup_battle_from_config, summarize
+
+BENCHMARKS_DIR = os.path.join(REPO_ROOT, "benchmarks")
+SCENARIOS_DIR = os.path.join(BENCHMARKS_DIR, "scenarios")
+
+def load_scenarios(names=None, renderer=False):
+    """Return {name: config} for the scenarios asked for (all of them by default, renderer ones only with renderer=True)."""
+    available = sorted(file_name[:-5] for file_name in os.listdir(SCENARIOS_DIR) if file_name.endswith(".json"))
+    unknown = [name for name in names or [] if name not in available]
+    if unknown:
+        raise ValueError(f"No scenario called {', '.join(unknown)} (found: {', '.join(available)})")
+    scenarios = {}
+    for name in names or available:
+        with open(os.path.join(SCENARIOS_DIR, name + ".json")) as f:
+            config = json.load(f)
+        if config.get("renderer", False) and not renderer:
+            continue
+        scenarios[name] = config
+    return(scenarios)
+
+class Drawer():
+    """Draws a battle every tick the way the window does (pygame is only imported when a scenario needs it)."""
+    def __init__(self):
+        if "DISPLAY" not in os.environ:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        import pygame
+        import renderer
+        self.pygame = pygame
+        self.renderer = renderer
+        pygame.init()
+        self.screen = None
+        self.view = None
+
+    def __call__(self, battle):
+        if self.view is None or self.view.bounds != tuple(battle.bounds):
+            self.view = self.renderer.View(battle.bounds, scale=self.renderer.fit_scale(battle.bounds))
+            self.screen = self.pygame.display.set_mode(self.view.window_size)
+        self.pygame.display.update(self.renderer.draw_frame(self.screen, battle, self.view, battle.profiler))
+
+    def close(self):
+        self.pygame.quit()
+
+def total_health(battle):
+    return(sum(stats.health for stats in battle.team_stats.values()))
+
+def run_scenario(config, profile=False, draw=None):
+    """Set a scenario's battle up and run it, returning the battle, how many ants it started with, the damage dealt and the seconds spent running it."""
+    battle = setup_battle_from_config(config)
+    n_ants = len(battle.ants)
+    start_health = total_health(battle)
+    if profile:
+        battle.profiler = TickProfiler(keep_history=False)
+    start = time.perf_counter()
+    while battle.game_tick < config["ticks"] and not battle.is_over():
+        battle.step()
+        if draw is not None:
+            draw(battle)
+    elapsed = time.perf_counter() - start
+    if battle.profiler is not None:
+        battle.profiler.close()
+    return(battle, n_ants, start_health - total_health(battle), elapsed)
+
+def measure(config, repeat=3, draw=None):
+    """Run a scenario and return its ticks/sec, ms per tick of each phase and peak memory."""
+    best = None
+    for _ in range(repeat):
+        battle, n_ants, damage, elapsed = run_scenario(config, draw=draw)
+        best = elapsed if best is None else min(best, elapsed)
+    ticks = max(battle.game_tick, 1)
+
+    profiled, _, _, _ = run_scenario(config, profile=True, draw=draw)
+    phases = profiled.profiler.summary()["phase_ms_per_tick"]
+
+    tracemalloc.start()
+    try:
+        run_scenario(config, draw=draw)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return({
+        "description": config.get("description", ""),
+        "ants": n_ants,
+        "ticks": battle.game_tick,
+        "ticks_per_sec": ticks / best,
+        "ms_per_tick": best / ticks * 1000,
+        "phase_ms_per_tick": phases,
+        "peak_memory_mb": peak / 2**20,
+        "damage": damage,
+        "outcome": summarize(battle), # Timings only compare if the battle still plays out the same
+    })
+
+def machine_info():
+    return({
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    })
+
+def git_commit():
+    """Return the repo's current commit, if it's a git checkout."""
+    try:
+        return(subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+
+def compare(results, baseline, threshold):
+    """Return (report lines, whether anything regressed) comparing results with a baseline."""
+    lines = []
+    regressed = False
+    if results["machine"] != baseline["machine"]:
+        lines.append(f"warning: the baseline was saved on another machine ({baseline['machine']['platform']}), timings may not compare")
+    lines.append(f"{'scenario':<22} {'ticks/s':>9} {'baseline':>9} {'change':>7} {'peak MB':>8} {'baseline':>9} {'change':>7}")
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            lines.append(f"{name:<22} {current['ticks_per_sec']:>9.1f} {'(new)':>9}")
+            continue
+        speed_change = current["ticks_per_sec"] / before["ticks_per_sec"] - 1
+        memory_change = current["peak_memory_mb"] / before["peak_memory_mb"] - 1
+        flags = []
+        if speed_change < -threshold:
+            flags.append("SLOWER")
+        if memory_change > threshold:
+            flags.append("BIGGER")
+        if current["outcome"] != before["outcome"]:
+            flags.append("(plays out differently)")
+        regressed = regressed or speed_change < -threshold or memory_change > threshold
+        lines.append(f"{name:<22} {current['ticks_per_sec']:>9.1f} {before['ticks_per_sec']:>9.1f} {speed_change:>+7.0%} "
+                     f"{current['peak_memory_mb']:>8.1f} {before['peak_memory_mb']:>9.1f} {memory_change:>+7.0%} {' '.join(flags)}")
+    return(lines, regressed)
+
+def report(results):
+    """Return the results as a table, with each scenario's slowest phases."""
+    lines = [f"{'scenario':<22} {'ants':>6} {'ticks':>6} {'ticks/s':>9} {'ms/tick':>9} {'peak MB':>8} {'damage':>7}  slowest phases (ms/tick)"]
+    for name, result in results["scenarios"].items():
+        phases = sorted(result["phase_ms_per_tick"].items(), key=lambda item: -item[1])[:3]
+        lines.append(f"{name:<22} {result['ants']:>6} {result['ticks']:>6} {result['ticks_per_sec']:>9.1f} {result['ms_per_tick']:>9.2f} "
+                     f"{result['peak_memory_mb']:>8.1f} {result['damage']:>7.0f}  " + ", ".join(f"{phase} {ms:.2f}" for phase, ms in phases))
+    return("\n".join(lines))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=None, help="scenarios to run (default: all but the renderer ones)")
+    parser.add_argument("--renderer", action="store_true", help="also run the scenarios that draw with pygame")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario (the fastest counts)")
+    parser.add_argument("--out", default=os.path.join(BENCHMARKS_DIR, "results.json"), help="where to write the results")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARKS_DIR, "baseline.json"), help="baseline to save or compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="save these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline, exiting with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=0.1, help="how much slower (or bigger) counts as a regression, as a fraction")
+    args = parser.parse_args()
+
+    try:
+        scenarios = load_scenarios(args.scenarios, renderer=args.renderer)
+    except ValueError as e:
+        parser.error(str(e))
+    drawer = None
+    no_bites = []
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "machine": machine_info(),
+        "scenarios": {},
+    }
+    for name, config in scenarios.items():
+        if config.get("renderer", False) and drawer is None:
+            drawer = Drawer()
+        print(f"{name}: {config.get('description', '')}", file=sys.stderr)
+        results["scenarios"][name] = measure(config, repeat=args.repeat, draw=drawer if config.get("renderer", False) else None)
+        if config.get("expect_bites", False) and results["scenarios"][name]["damage"] <= 0:
+            no_bites.append(name)
+    if drawer is not None:
+        drawer.close()
+
+    print(report(results))
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved the baseline to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressed = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(1)
+    if no_bites:
+        print(f"no ant was bitten in {', '.join(no_bites)}, which should be a fight", file=sys.stderr)
+        sys.exit(1)
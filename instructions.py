@@ -0,0 +1,175 @@
+"""Queue each tick's instructions in reusable per-ant slots.
+
+An antgorithm returns one instruction per tick as a method name and a
+kwargs dict, or, as an optional fast path, as an opcode (with its
+parameters in a tuple):
+
+    ("walk", {})                                           WALK
+    ("walk", {"distance": distance})                       (WALK, distance)
+    ("turn", {"rel_angle": rel_angle})                     (TURN, rel_angle)
+    ("strafe", {"rel_angle": rel_angle})                   (STRAFE, rel_angle)
+    ("strafe", {"rel_angle": rel_angle, "distance": d})    (STRAFE, rel_angle, d)
+    ("bite", {}), ("block", {})                            BITE, BLOCK
+                                                           NOOP
+
+Opcodes don't allocate anything (the kwargs dict of the other form is a new
+dict every call). The InstructionBuffer keeps an opcode, an angle and a
+distance for every ant (indexed by ant id) plus the order they were queued
+in, and is cleared in place at the end of the tick instead of being
+replaced. Method tuples it can't encode (another Ant method, other
+arguments) are kept as they are and called the old way. The slots are a
+bytearray and arrays, and in an array-backed battle the buffer also keeps
+every ant's row of battle.state, so the array path reads a tick's
+instructions as NumPy arrays with one fancy-index each.
+"""
+
+import enum
+import math
+from array import array
+
+class Op(enum.IntEnum):
+    NOOP = 0
+    WALK = 1
+    TURN = 2
+    STRAFE = 3
+    BITE = 4
+    BLOCK = 5
+    CALL = 6 # A method tuple that's called as it is
+
+NOOP, WALK, TURN, STRAFE, BITE, BLOCK, CALL = Op
+
+METHOD_OPS = {"walk": WALK, "turn": TURN, "strafe": STRAFE, "bite": BITE, "block": BLOCK}
+
+def _noop(ant, angle, distance):
+    return(True)
+
+def _walk(ant, angle, distance):
+    return(ant.walk(distance))
+
+def _turn(ant, angle, distance):
+    return(ant.turn(angle))
+
+def _strafe(ant, angle, distance):
+    return(ant.strafe(angle, distance))
+
+def _bite(ant, angle, distance):
+    return(ant.bite())
+
+def _block(ant, angle, distance):
+    return(ant.block())
+
+# What each opcode calls, indexed by opcode
+HANDLERS = [_noop, _walk, _turn, _strafe, _bite, _block]
+
+UNSET = 255 # The opcode slot of an ant without an instruction this tick
+
+class InstructionBuffer():
+    def __init__(self, size=0):
+        # Typed slots, so an array-backed battle can read them as NumPy arrays without copying
+        self.ops = bytearray() # Opcode of each ant (indexed by id), UNSET for ants without an instruction this tick
+        self.angles = array("d") # rel_angle of TURN and STRAFE
+        self.distances = array("d") # distance of WALK and STRAFE (NaN for the default)
+        self.rows = array("q") # battle.state row of each ant, only set in array-backed battles
+        self.ids = array("q") # Ids of the ants with an instruction, in the order they were queued
+        self.calls = {} # {ant id: (method, kwargs)} for CALL
+        self._grow(size)
+
+    def _grow(self, size):
+        extra = size - len(self.ops)
+        if extra > 0:
+            self.ops.extend(bytes([UNSET]) * extra)
+            self.angles.frombytes(bytes(extra * self.angles.itemsize))
+            self.distances.extend([math.nan] * extra)
+            self.rows.frombytes(bytes(extra * self.rows.itemsize))
+
+    def __len__(self):
+        return(len(self.ids))
+
+    def __contains__(self, ant_id):
+        return(ant_id < len(self.ops) and self.ops[ant_id] != UNSET)
+
+    def set_row(self, ant_id, row):
+        """Record the battle.state row of an ant."""
+        if ant_id >= len(self.ops):
+            self._grow(max(ant_id + 1, 2*len(self.ops)))
+        self.rows[ant_id] = row
+
+    def empty_copy(self):
+        """Return a buffer with nothing queued but the same rows (for a fork)."""
+        buffer = InstructionBuffer(len(self.ops))
+        buffer.rows = array("q", self.rows)
+        return(buffer)
+
+    def __setitem__(self, ant_id, instruction):
+        """Queue an ant's instruction (replacing the one it already has this tick, if any)."""
+        ops = self.ops
+        if ant_id >= len(ops):
+            self._grow(max(ant_id + 1, 2*len(ops)))
+        angle, distance = 0.0, None
+
+        if isinstance(instruction, int):
+            op = instruction
+            if not NOOP <= op < CALL:
+                raise ValueError(f"Bad instruction for ant {ant_id}: {instruction!r}")
+        elif not instruction:
+            op = NOOP # None or (), nothing to do
+        elif isinstance(instruction[0], str):
+            method, kwargs = instruction
+            op = METHOD_OPS.get(method, CALL)
+            if not kwargs:
+                if op == TURN or op == STRAFE:
+                    op = CALL # Missing rel_angle, fails the same way it used to
+            elif op == WALK and len(kwargs) == 1 and "distance" in kwargs:
+                distance = kwargs["distance"]
+            elif op == TURN and len(kwargs) == 1 and "rel_angle" in kwargs:
+                angle = kwargs["rel_angle"]
+            elif op == STRAFE and "rel_angle" in kwargs and (len(kwargs) == 1 or (len(kwargs) == 2 and "distance" in kwargs)):
+                angle, distance = kwargs["rel_angle"], kwargs.get("distance")
+            else:
+                op = CALL # Anything else is called as it is
+            if op == CALL:
+                self.calls[ant_id] = instruction
+        else:
+            op = instruction[0]
+            if op == WALK and len(instruction) == 2:
+                distance = instruction[1]
+            elif op == TURN and len(instruction) == 2:
+                angle = instruction[1]
+            elif op == STRAFE and 2 <= len(instruction) <= 3:
+                angle = instruction[1]
+                distance = instruction[2] if len(instruction) == 3 else None
+            elif len(instruction) != 1 or op == TURN or op == STRAFE:
+                raise ValueError(f"Bad instruction for ant {ant_id}: {instruction!r}")
+            if not NOOP <= op < CALL:
+                raise ValueError(f"Bad instruction for ant {ant_id}: {instruction!r}")
+
+        if distance is None:
+            distance = math.nan
+        elif distance != distance:
+            raise ValueError(f"Bad instruction for ant {ant_id}: {instruction!r}") # NaN is the default's slot
+        # The float slots go first, so an angle or distance that isn't a number raises before anything is queued
+        self.angles[ant_id] = angle
+        self.distances[ant_id] = distance
+        if ops[ant_id] == UNSET:
+            self.ids.append(ant_id)
+        ops[ant_id] = op
+
+    def dispatch(self, get_ant):
+        """Carry out every queued instruction (in queue order) on the ant get_ant(id) returns."""
+        ops, angles, distances = self.ops, self.angles, self.distances
+        for ant_id in self.ids:
+            ant = get_ant(ant_id)
+            op = ops[ant_id]
+            if op == CALL:
+                method, kwargs = self.calls[ant_id]
+                getattr(ant, method)(**kwargs)
+            else:
+                distance = distances[ant_id]
+                HANDLERS[op](ant, angles[ant_id], None if distance != distance else distance)
+
+    def clear(self):
+        """Forget this tick's instructions, keeping the slots."""
+        ops = self.ops
+        ops[:] = bytes([UNSET]) * len(ops) # One memset beats resetting the queued slots one by one
+        del self.ids[:]
+        self.calls.clear()
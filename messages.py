@@ -0,0 +1,130 @@
+"""Define the board that holds the battle's live messages.
+
+Messages are kept in a ring buffer with one bucket per game tick, so expiring
+a tick's worth of messages is a single slot overwrite and no message's age
+ever has to be updated (Message.age is worked out from the tick it was sent).
+Each bucket has a spatial grid for range queries and an index by topic
+(which also serves topic prefix queries).
+"""
+
+from spatial import SpatialGrid
+
+MESSAGE_LIFETIME = 10 # Messages can be received for MESSAGE_LIFETIME - 1 ticks after being sent
+
+class MessageBucket():
+    """The messages sent during one game tick."""
+    def __init__(self, tick, cell_size):
+        self.tick = tick
+        self.messages = []
+        self.grid = SpatialGrid(cell_size=cell_size)
+        self.by_topic = {} # {topic: [message, ...]}
+
+    def add(self, message):
+        self.messages.append(message)
+        self.grid.insert(message)
+        if message.topic in self.by_topic:
+            self.by_topic[message.topic].append(message)
+        else:
+            self.by_topic[message.topic] = [message]
+
+    def copy(self, copy_message):
+        """Return a copy of the bucket holding copy_message(message) for each of its messages."""
+        copies = {message: copy_message(message) for message in self.messages}
+        bucket = MessageBucket.__new__(MessageBucket)
+        bucket.tick = self.tick
+        bucket.messages = list(copies.values())
+        bucket.grid = self.grid.copy(copies)
+        bucket.by_topic = {topic: [copies[message] for message in messages] for topic, messages in self.by_topic.items()}
+        return(bucket)
+
+    def with_prefix(self, prefix):
+        """Return the messages filed under topics starting with prefix, in the order they were sent."""
+        matches = [messages for topic, messages in self.by_topic.items() if isinstance(topic, str) and topic.startswith(prefix)]
+        if len(matches) == 1:
+            return(matches[0])
+        return(sorted((message for messages in matches for message in messages), key=lambda message: message._order))
+
+class MessageBoard():
+    def __init__(self, cell_size=100, lifetime=MESSAGE_LIFETIME):
+        self.cell_size = cell_size
+        self.lifetime = lifetime
+        self.buckets = [None] * lifetime # Slot tick % lifetime holds the messages sent during that tick
+        self.borrowed = [False] * lifetime # Slots still holding another board's bucket (see copy)
+        self.copy_message = None
+
+    def post(self, messages, tick):
+        """Add the messages sent during a tick, overwriting the bucket that just expired."""
+        bucket = MessageBucket(tick, self.cell_size)
+        for message in messages:
+            bucket.add(message)
+        self.buckets[tick % self.lifetime] = bucket
+        self.borrowed[tick % self.lifetime] = False
+
+    def load(self, messages):
+        """Replace the board's contents with the given messages (grouped by the tick they were sent)."""
+        self.buckets = [None] * self.lifetime
+        self.borrowed = [False] * self.lifetime
+        by_tick = {}
+        for message in messages:
+            by_tick.setdefault(message.tick, []).append(message)
+        for tick in sorted(by_tick):
+            self.post(by_tick[tick], tick)
+
+    def copy(self, copy_message):
+        """Return a copy of the board holding copy_message(message) for each of its messages.
+
+        Buckets never change once posted, so the copy shares this board's
+        until it first reads one, and only then copies its messages.
+        """
+        board = MessageBoard(self.cell_size, self.lifetime)
+        board.buckets = list(self.buckets)
+        board.borrowed = [bucket is not None for bucket in self.buckets]
+        board.copy_message = copy_message
+        return(board)
+
+    def _bucket(self, tick):
+        """Return the bucket of messages sent during a tick (None if they've expired)."""
+        slot = tick % self.lifetime
+        bucket = self.buckets[slot]
+        if bucket is None or bucket.tick != tick:
+            return(None)
+        if self.borrowed[slot]:
+            bucket = self.buckets[slot] = bucket.copy(self.copy_message)
+            self.borrowed[slot] = False
+        return(bucket)
+
+    def sent_during(self, tick):
+        """Return the messages sent during a tick, if they're still on the board."""
+        bucket = self._bucket(tick)
+        if bucket is None:
+            return([])
+        return(bucket.messages)
+
+    def live_buckets(self, game_tick):
+        """Return the buckets that can be received from during game_tick, oldest first."""
+        buckets = []
+        for tick in range(game_tick - self.lifetime + 1, game_tick):
+            bucket = self._bucket(tick)
+            if bucket is not None:
+                buckets.append(bucket)
+        return(buckets)
+
+    def messages(self, game_tick):
+        """Return every live message, in the order they were sent."""
+        return([message for bucket in self.live_buckets(game_tick) for message in bucket.messages])
+
+    def query(self, x, y, radius, game_tick, topic=None, prefix=None):
+        """Return candidate messages near (x, y) (optionally only those with a topic, or a topic starting with prefix), in the order they were sent.
+
+        Callers still have to do the exact distance check themselves.
+        """
+        candidates = []
+        for bucket in self.live_buckets(game_tick):
+            # Topic lists are short, so skip the grid and let the caller's distance check do the work
+            if topic is not None:
+                candidates.extend(bucket.by_topic.get(topic, []))
+            elif prefix is not None:
+                candidates.extend(bucket.with_prefix(prefix))
+            else:
+                candidates.extend(bucket.grid.query(x, y, radius))
+        return(candidates)
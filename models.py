@@ -1,35 +1,210 @@
 """Define the classes for the battle and the ants.
 
+This module has no pygame dependency so battles can be simulated headless.
+Drawing lives in renderer.py.
 """
 
-import pygame # For drawing the ants
 import math
+import pickle
 import random
-import uuid
-from copy import copy, deepcopy
+import time
+from array import array
+from copy import deepcopy
+from itertools import islice
+from instructions import InstructionBuffer, HANDLERS, WALK, TURN, STRAFE, BITE, BLOCK, CALL
+from spatial import SpatialGrid
+from messages import MessageBoard
+from neighbours import NeighbourTable
+from profiler import TickProfiler
+try:
+    import numpy as np # Only needed for Battle(array_state=True)
+    from state import AntState, FLOAT_COLUMNS
+    import vectorized
+except ImportError:
+    np = None
 
-class Battle():
+STAT_NAMES = ["size", "health", "speed", "block_damage", "bite_damage", "bite_range", "bite_angle", "smell_range"]
+
+SNAPSHOT_VERSION = 1 # Bumped whenever Battle.snapshot's format changes
+
+class AntRegistry():
+    """Live ants keyed by id, iterated in the order they were added."""
+    def __init__(self):
+        self._ants = {} # {ant_id: ant} (dicts keep insertion order)
+
+    def __len__(self):
+        return(len(self._ants))
+
+    def __iter__(self):
+        # Iterate over a copy so ants can die while the battle is being looped over
+        return(iter(list(self._ants.values())))
+
+    def __contains__(self, ant):
+        return(self._ants.get(ant.id) is ant)
+
+    def __getitem__(self, index):
+        """Return the ant at a position in iteration order (O(N), kept for old list-style code)."""
+        if index < 0:
+            index += len(self._ants)
+        if index < 0 or index >= len(self._ants):
+            raise IndexError("AntRegistry index out of range")
+        return(next(islice(self._ants.values(), index, None)))
+
+    def append(self, ant):
+        """Add an ant to the registry."""
+        if ant.id in self._ants:
+            raise ValueError("An ant with id " + str(ant.id) + " is already in the battle")
+        self._ants[ant.id] = ant
+
+    def remove(self, ant):
+        """Remove an ant from the registry."""
+        del self._ants[ant.id]
+
+    def get(self, ant_id, default=None):
+        """Return the ant with the given id (or default if it isn't in the battle)."""
+        return(self._ants.get(ant_id, default))
+
+class TeamStats():
+    """Running totals for one team, kept up to date as its ants are added, hurt and killed."""
     def __init__(self):
-        self.ants = []
+        self.alive = 0 # Living ants
+        self.health = 0 # Total health of the living ants
+        self.kills = 0 # Enemy ants killed
+
+    def __repr__(self):
+        return(f"TeamStats(alive={self.alive}, health={self.health}, kills={self.kills})")
+
+    def copy(self):
+        stats = TeamStats()
+        stats.alive, stats.health, stats.kills = self.alive, self.health, self.kills
+        return(stats)
+
+class Battle():
+    def __init__(self, array_state=False, seed=None, profile=False):
+        self.ants = AntRegistry() # Live ants, keyed by id
         self.bounds = (500, 500)
+        self.team_stats = {} # {team: TeamStats}, in the order teams first appeared
+
+        # Everything random comes from the seed: battle.rng for setting up the battle
+        # and one independent stream per ant (ant.rng) for its antgorithm
+        if seed is None:
+            seed = random.randrange(2**63) # Still recorded, so the battle can be replayed
+        self.seed = seed
+        self.rng = random.Random(f"{seed}-battle")
+        self._next_id = 0 # Ant ids are assigned sequentially
 
         self.game_tick = 0
 
         # Instructions to be resolved at the end of the tick
-        self.instruction_queue = {} # {ant_id: (instruction, kwargs)}
+        self.instruction_queue = InstructionBuffer() # Set with instruction_queue[ant_id] = instruction (see instructions.py)
 
         # Attacks and blocks to be resolved at the end of the tick
         self.attack_queue = {}
         self.damage_queue = {}
         self.block_queue = {}
 
-        # Messages to be added to the list of messages at the end of the tick
+        # Messages to be added to the message board at the end of the tick
         self.message_queue = []
-        self.messages = [] # List of (x, y, team, message, game_tick)
+        self.message_board = MessageBoard()
+
+        # Uniform grid for range queries (cell size is set from the first ant's smell_range)
+        self.ant_grid = None
+        self._next_order = 0 # Insertion counter so grid queries keep list order
+
+        # Neighbour lists shared by every ant's sense and attackable while antgorithms run (see neighbours.py)
+        self.bulk_sensing = True
+        self.neighbours = None
+        self.last_neighbours = None # The antgorithms' table, kept for resolve_attacks
+
+        # Runs the antgorithms each tick (None runs them here, see parallel.ParallelExecutor)
+        self.executor = None
+
+        # Whole-team antgorithms, run instead of their ants' own (see vectorized.py)
+        self.team_antgorithms = {} # {team: team_antgorithm}
+        self.team_memory = {} # {team: dict}
+        self.team_instructions = [] # [(rows, codes, angles, distances)] to resolve at the end of the tick
+
+        # Records where each tick's time goes (see profiler.TickProfiler)
+        self.profiler = TickProfiler() if profile else None
+
+        # Saves every tick to a replay file (see replay.ReplayRecorder)
+        self.recorder = None
+
+        # Optional NumPy store of ant state (ants become ArrayAnt views over its rows)
+        self.state = None
+        if array_state:
+            if np is None:
+                raise ImportError("Battle(array_state=True) requires numpy")
+            self.state = AntState()
+
+    def next_ant_id(self):
+        """Return the id for a new ant."""
+        ant_id = self._next_id
+        self._next_id += 1
+        return(ant_id)
+
+    def ant_rng(self, ant_id):
+        """Return the random number generator for an ant (it only depends on the seed and the ant's id)."""
+        return(random.Random(f"{self.seed}-ant-{ant_id}"))
+
+    def next_order(self):
+        """Return the next insertion number for an ant or message."""
+        self._next_order += 1
+        return(self._next_order)
+
+    def count_ant(self, ant):
+        """Add a new ant to its team's counters."""
+        stats = self.team_stats.get(ant.team)
+        if stats is None:
+            stats = self.team_stats[ant.team] = TeamStats()
+        stats.alive += 1
+        stats.health += ant.health
+
+    @property
+    def alive_counts(self):
+        """{team: living ants} for every team that has been in the battle."""
+        return({team: stats.alive for team, stats in self.team_stats.items()})
+
+    def index_ant(self, ant):
+        """Add a new ant to the spatial grid (creating the grids if needed)."""
+        if self.ant_grid is None:
+            self.ant_grid = SpatialGrid(cell_size=ant.smell_range)
+            self.message_board.cell_size = ant.smell_range
+        self.ant_grid.insert(ant)
+        if self.state is not None:
+            self.state.cell_x[ant._row], self.state.cell_y[ant._row] = self.ant_grid.item_cells[ant]
+            self.instruction_queue.set_row(ant.id, ant._row)
+
+    def update_grid(self):
+        """Move ants between grid cells after they have moved this tick."""
+        if self.ant_grid is None:
+            return()
+        if self.state is not None:
+            # Only touch the ants whose cell changed
+            for row in self.state.rows_with_new_cell(self.ant_grid.cell_size):
+                self.ant_grid.move(self.state.ants[row])
+            return()
+        for ant in self.ants:
+            self.ant_grid.move(ant)
+
+    def ants_near(self, x, y, range):
+        """Return candidate ants (a superset of those within range of (x, y)) in battle order."""
+        if self.ant_grid is None:
+            return([])
+        return(self.ant_grid.query(x, y, range))
 
-    def new_message(self, ant, content):
+    @property
+    def messages(self):
+        """The list of live messages, in the order they were sent."""
+        return(self.message_board.messages(self.game_tick))
+
+    def messages_near(self, x, y, range, topic=None, prefix=None):
+        """Return candidate messages (a superset of those within range of (x, y)) in battle order."""
+        return(self.message_board.query(x, y, range, self.game_tick, topic=topic, prefix=prefix))
+
+    def new_message(self, ant, content, topic=None):
         """Add a message to the message queue."""
-        self.message_queue.append(Message(ant, content))
+        self.message_queue.append(Message(ant, content, topic=topic))
 
     def attack(self, attacker, damage):
         """Add an attack to the attack queue to be resolved at the end of the tick."""
@@ -43,68 +218,524 @@ class Battle():
     
     def resolve_instructions(self):
         """Resolve all instructions."""
+        if self.state is not None:
+            return(self._resolve_instructions_array())
         # Order doesn't really matter -- it's so antgorithms don't run on new tick information
-        for ant_id, instruction in self.instruction_queue.items():
-            ant = Ant.get_ant_by_id(self, ant_id)
-            method, kwargs = instruction
-            callable_method = getattr(ant, method)
-            callable_method(**kwargs)
-        self.instruction_queue = {} # Clear the instruction queue
-    
+        self.instruction_queue.dispatch(self.ants._ants.get)
+        self.instruction_queue.clear() # Clear the instruction queue (keeping its slots)
+        self.update_grid() # Positions are fixed until the next tick's instructions
+
+    def _resolve_instructions_array(self):
+        """Resolve all instructions, applying walk, turn and strafe to every ant at once."""
+        state = self.state
+        queue = self.instruction_queue
+
+        # Gather the queued slots in queue order, one fancy-index into a view of each (see InstructionBuffer)
+        ids = np.frombuffer(queue.ids, dtype=np.int64).copy() # A view would stop the buffer from being cleared
+        rows = np.frombuffer(queue.rows, dtype=np.int64)[ids]
+        codes = np.frombuffer(queue.ops, dtype=np.uint8)[ids]
+        angles = np.frombuffer(queue.angles, dtype=np.float64)[ids]
+        distances = np.frombuffer(queue.distances, dtype=np.float64)[ids] # NaN is "use the default" in both
+
+        # Bites, blocks and other method calls go one ant at a time, in queue order
+        get_ant = self.ants._ants.get
+        for ant_id, code in zip(ids[codes >= BITE].tolist(), codes[codes >= BITE].tolist()):
+            ant = get_ant(ant_id)
+            if code == CALL:
+                method, kwargs = queue.calls[ant_id]
+                getattr(ant, method)(**kwargs)
+            else:
+                # Bite and block only touch this ant or the battle's queues
+                HANDLERS[code](ant, 0.0, None)
+        queue.clear() # Clear the instruction queue (keeping its slots)
+
+        walking, turning, strafing = codes == WALK, codes == TURN, codes == STRAFE
+        walk_rows, walk_distances = rows[walking], distances[walking]
+        turn_rows, turn_angles = rows[turning], angles[turning]
+        strafe_rows, strafe_angles, strafe_distances = rows[strafing], angles[strafing], distances[strafing]
+
+        # Add the team antgorithms' instructions to the batches
+        for rows, codes, angles, distances in self.team_instructions:
+            walking, turning, strafing = codes == WALK, codes == TURN, codes == STRAFE
+            walk_rows, walk_distances = np.concatenate((walk_rows, rows[walking])), np.concatenate((walk_distances, distances[walking]))
+            turn_rows, turn_angles = np.concatenate((turn_rows, rows[turning])), np.concatenate((turn_angles, angles[turning]))
+            strafe_rows = np.concatenate((strafe_rows, rows[strafing]))
+            strafe_angles, strafe_distances = np.concatenate((strafe_angles, angles[strafing])), np.concatenate((strafe_distances, distances[strafing]))
+
+            # Bites and blocks go through the battle's queues, like the per-ant ones
+            fighting = (codes == BITE) | (codes == BLOCK)
+            for row, code in zip(rows[fighting].tolist(), codes[fighting].tolist()):
+                if code == BITE:
+                    state.ants[row].bite()
+                else:
+                    state.ants[row].block()
+        self.team_instructions = []
+
+        if len(walk_rows) > 0:
+            state.walk(walk_rows, walk_distances, self.bounds)
+        if len(turn_rows) > 0:
+            state.turn(turn_rows, turn_angles)
+        if len(strafe_rows) > 0:
+            state.strafe(strafe_rows, strafe_angles, strafe_distances)
+        self.update_grid() # Positions are fixed until the next tick's instructions
+
     def resolve_attacks(self):
         """Resolve attacks and blocks, then deal damage that occurred during this tick."""
+        if self.state is not None:
+            return(self._resolve_attacks_array())
         # Resolve the attacks after all ants have executed their antgorithms
-        for attacker, damage in self.attack_queue.items():
-            ants_in_range = attacker.attackable(return_objects=True)
-            ants_in_range = [ant for ant in ants_in_range if ant.team != attacker.team]
-            if len(ants_in_range) > 0:
-                # # Pick a random ant to attack (prefer opponents)
-                # ant_to_attack = ants_in_range[random.randint(0, len(ants_in_range)-1)]
-                # opponents_in_range = [ant for ant in ants_in_range if ant.team != attacker.team]
-                ant_to_attack = ants_in_range[0] # Just attack the first ant in the list
-                # Add the damage to the damage queue
-                if ant_to_attack in self.damage_queue.keys():
-                    self.damage_queue[ant_to_attack] += damage
-                else:
-                    self.damage_queue[ant_to_attack] = damage
-        self.attack_queue = {} # Clear the attack queue
+        first_biters = {} # {bitten ant: team of the first ant to bite it}, credited with the kill
+        previous, self.last_neighbours = self.last_neighbours, None
+        if previous is not None and self.attack_queue:
+            # Ants have moved, so biters query the grid again, but bearings between ants that haven't moved still hold
+            self.neighbours = NeighbourTable(None, previous=previous)
+        try:
+            for attacker, damage in self.attack_queue.items():
+                ants_in_range = attacker.attackable(return_objects=True)
+                ants_in_range = [ant for ant in ants_in_range if ant.team != attacker.team]
+                if len(ants_in_range) > 0:
+                    # # Pick a random ant to attack (prefer opponents)
+                    # ant_to_attack = ants_in_range[random.randint(0, len(ants_in_range)-1)]
+                    # opponents_in_range = [ant for ant in ants_in_range if ant.team != attacker.team]
+                    ant_to_attack = ants_in_range[0] # Just attack the first ant in the list
+                    # Add the damage to the damage queue
+                    if ant_to_attack in self.damage_queue.keys():
+                        self.damage_queue[ant_to_attack] += damage
+                    else:
+                        self.damage_queue[ant_to_attack] = damage
+                        first_biters[ant_to_attack] = attacker.team
+        finally:
+            self.neighbours = None
+        self.attack_queue.clear() # Clear the attack queue
 
         # Now resolve the damage
         for ant, damage in self.damage_queue.items():
             # Subtract any blocked damage
             blocked_damage = self.block_queue[ant] if ant in self.block_queue.keys() else 0
             damage -= blocked_damage
-            ant.suffer(damage)
-        self.damage_queue = {} # Clear the damage queue
+            ant.suffer(damage, killer_team=first_biters[ant])
+        self.damage_queue.clear() # Clear the damage queue
+
+    def _resolve_attacks_array(self):
+        """Resolve attacks and blocks for every ant at once (same rules as resolve_attacks)."""
+        state = self.state
+        attacks = sorted(self.attack_queue.items(), key=lambda attack: attack[0]._order) # Team antgorithms queue their bites after the per-ant ones
+        self.attack_queue.clear() # Clear the attack queue
+        if len(attacks) == 0:
+            return()
+        attacker_rows = np.array([attacker._row for attacker, _ in attacks], dtype=np.int64)
+        attack_damage = np.array([damage for _, damage in attacks], dtype=np.float64)
+        targets = state.bite_targets(attacker_rows)
+        hit = targets >= 0
+        if not hit.any():
+            return()
+
+        # Sum the damage on each bitten ant, then subtract any blocked damage
+        damage = np.zeros(state.n_rows, dtype=np.float64)
+        np.add.at(damage, targets[hit], attack_damage[hit])
+        bitten_rows = np.unique(targets[hit])
+        blocked = np.zeros(state.n_rows, dtype=np.float64)
+        for blocker, blocked_damage in self.block_queue.items():
+            blocked[blocker._row] = blocked_damage
+        suffered = np.abs(damage[bitten_rows] - blocked[bitten_rows])
+        dead_rows = state.suffer(bitten_rows, suffered)
+        for row, row_damage in zip(bitten_rows.tolist(), suffered.tolist()):
+            self.team_stats[state.ants[row].team].health -= row_damage
+        if len(dead_rows) > 0:
+            # The first ant (in attack order) to bite each dead ant gets the kill
+            first_biters = {}
+            for (attacker, _), target in zip(attacks, targets.tolist()):
+                if target >= 0 and target not in first_biters:
+                    first_biters[target] = attacker.team
+            for row in dead_rows.tolist():
+                state.ants[row].die(killer_team=first_biters[row])
 
     def resolve_messages(self):
-        """Add the message queue to the list of messages and remove old messages."""
-        self.messages += self.message_queue
-        for m in self.messages:
-            m.age += 1
-        self.messages = [m for m in self.messages if m.age < 10]
+        """Post this tick's messages to the board (which drops the ones that are too old)."""
+        self.message_board.post(self.message_queue, self.game_tick)
+        self.message_queue = []
+
+    def use_team_antgorithm(self, team, team_antgorithm):
+        """Run team_antgorithm once per tick for the whole team instead of each ant's antgorithm."""
+        if self.state is None:
+            raise ValueError("Team antgorithms need Battle(array_state=True)")
+        self.team_antgorithms[team] = team_antgorithm
+
+    def _run_team_antgorithms(self):
+        """Run every team antgorithm and queue its instructions."""
+        for team, team_antgorithm in self.team_antgorithms.items():
+            if self.profiler is not None:
+                start = time.perf_counter()
+            instructions = vectorized.run_team_antgorithm(self, team, team_antgorithm)
+            if self.profiler is not None:
+                self.profiler.add_antgorithm_time(team_antgorithm, time.perf_counter() - start)
+            if instructions is not None:
+                self.team_instructions.append(instructions)
+
+    def start_sensing(self, previous=None):
+        """Start sharing neighbour lists between ants (until stop_sensing, ants mustn't move)."""
+        if self.bulk_sensing and self.ant_grid is not None:
+            self.neighbours = NeighbourTable(self.ant_grid, previous=previous)
+
+    def stop_sensing(self):
+        self.last_neighbours, self.neighbours = self.neighbours, None
+
+    def run_antgorithms(self):
+        """Run every live ant's antgorithm and queue its instruction."""
+        if self.team_antgorithms:
+            self._run_team_antgorithms()
+        if self.executor is not None:
+            return(self.executor.run_antgorithms(self))
+        self.start_sensing()
+        try:
+            if self.profiler is not None:
+                return(self._run_antgorithms_profiled())
+            team_antgorithms = self.team_antgorithms
+            for ant in self.ants:
+                if ant.alive and ant.team not in team_antgorithms:
+                    # Execute the ant's antgorithm, update memory, and log the instruction
+                    self.instruction_queue[ant.id] = ant.antgorithm(ant)
+        finally:
+            self.stop_sensing()
+
+    def _run_antgorithms_profiled(self):
+        """Run every live ant's antgorithm, timing each call."""
+        profiler = self.profiler
+        team_antgorithms = self.team_antgorithms
+        for ant in self.ants:
+            if ant.alive and ant.team not in team_antgorithms:
+                start = time.perf_counter()
+                self.instruction_queue[ant.id] = ant.antgorithm(ant)
+                profiler.add_antgorithm_time(ant.antgorithm, time.perf_counter() - start)
+
+    def step(self):
+        """Run one game tick: every ant's antgorithm, then the end of tick housekeeping."""
+        if self.profiler is not None:
+            return(self._step_profiled())
+        self.run_antgorithms()
+
+        # End of tick housekeeping
+        self.resolve_instructions()
+        self.resolve_attacks()
+        self.resolve_messages()
+        self.game_tick += 1
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+    def _step_profiled(self):
+        """Run one game tick, timing each phase."""
+        profiler = self.profiler
+        profiler.start_tick(self.game_tick)
+        with profiler.phase("antgorithms"):
+            self.run_antgorithms()
+        with profiler.phase("resolve_instructions"):
+            self.resolve_instructions()
+        with profiler.phase("resolve_attacks"):
+            self.resolve_attacks()
+        with profiler.phase("resolve_messages"):
+            self.resolve_messages()
+        self.game_tick += 1
+        if self.recorder is not None:
+            with profiler.phase("record"):
+                self.recorder.record(self)
+
+    def teams_alive(self):
+        """Return the set of teams that still have living ants."""
+        return(set([team for team, stats in self.team_stats.items() if stats.alive > 0]))
+
+    def is_over(self):
+        """Return True if at most one team is left."""
+        return(len(self.teams_alive()) <= 1)
+
+    def winner(self):
+        """Return the winning team (or None if the battle isn't over or nobody survived)."""
+        teams = self.teams_alive()
+        if len(teams) == 1:
+            return(teams.pop())
+        return(None)
+
+    def run(self, max_ticks=None):
+        """Step the battle until it's over (or max_ticks more ticks have run) and return the winner."""
+        ticks_run = 0
+        while not self.is_over():
+            if max_ticks is not None and ticks_run >= max_ticks:
+                break
+            self.step()
+            ticks_run += 1
+        return(self.winner())
+
+    def fork(self, deep_memory=False):
+        """Return a copy of the battle to look ahead in, leaving this one as it is.
+
+        The fork gets its own ants, grids, messages and team stats, and shares
+        what never changes (stats, antgorithms, settings). Each ant's memory
+        dict is copied but the values in it aren't (deep_memory=True deep
+        copies them, for antgorithms that change lists or dicts in their memory
+        in place), and an ant's generator is only copied once the fork or the
+        original uses it. Nothing queued for the current tick is copied, so a
+        fork made from inside an antgorithm plays the tick from the start. The
+        fork has no executor, profiler or recorder.
+        """
+        clone = Battle.__new__(Battle)
+        clone.__dict__.update(self.__dict__) # Settings are shared, everything a tick changes is replaced below
+        clone.rng = _copy_rng(self.rng)
+        clone.ants = AntRegistry()
+        clone.team_stats = {team: stats.copy() for team, stats in self.team_stats.items()}
+        clone.instruction_queue = self.instruction_queue.empty_copy() # Twins keep their ids and rows
+        clone.attack_queue = {}
+        clone.damage_queue = {}
+        clone.message_queue = []
+        clone.neighbours = None
+        clone.last_neighbours = None
+        clone.executor = None
+        clone.profiler = None
+        clone.recorder = None
+        clone.team_antgorithms = dict(self.team_antgorithms)
+        clone.team_memory = deepcopy(self.team_memory)
+        clone.team_instructions = []
+        if self.state is not None:
+            clone.state = self.state.copy()
+
+        copy_memory = deepcopy if deep_memory else dict.copy
+        twins = {} # {ant: its copy in the fork}
+        clone_ants = clone.ants._ants
+        for ant in self.ants._ants.values():
+            twin = twins[ant] = ant._fork(clone, copy_memory)
+            clone_ants[twin.id] = twin
+        if clone.state is not None:
+            clone.state.ants = [twins.get(ant, ant) for ant in self.state.ants] # Dead ants' rows are never read
+        if self.ant_grid is not None:
+            clone.ant_grid = self.ant_grid.copy(twins)
+        clone.block_queue = {twins[ant]: damage for ant, damage in self.block_queue.items() if ant in twins}
+        clone.message_board = self.message_board.copy(lambda message: message._copy(clone))
+        return(clone)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.discard()
+
+    def discard(self):
+        """Drop the battle's ants and messages so they're freed straight away instead of by the garbage collector (the battle can't be used afterwards).
+
+        Ants and their battle point at each other, so a finished fork would
+        otherwise wait for a collection. Leaving `with battle.fork() as
+        lookahead:` discards the fork.
+        """
+        self.ants = AntRegistry()
+        self.ant_grid = None
+        self.state = None
+        self.block_queue = {}
+        self.attack_queue = {}
+        self.damage_queue = {}
         self.message_queue = []
+        self.message_board = MessageBoard()
+        self.neighbours = None
+        self.last_neighbours = None
+
+    def snapshot(self):
+        """Return everything that decides how the battle plays out from here as bytes (see restore).
+
+        That's every live ant (memory and generator included), the live
+        messages, team stats, blocks still in effect and the battle's counters.
+        Antgorithms are saved by reference, so they have to be importable
+        functions. Like fork, nothing queued for the current tick is saved.
+        """
+        ants = list(self.ants)
+        stat_sets = {} # {tuple of stats: index}, most ants share a few
+        saved_ants = {
+            "order": array("q", [ant._order for ant in ants]),
+            "id": array("q", [ant.id for ant in ants]),
+            "team": [ant.team for ant in ants],
+            "stats": array("q", [stat_sets.setdefault(tuple([getattr(ant, s) for s in STAT_NAMES]), len(stat_sets)) for ant in ants]),
+            "x": array("d", [ant.x for ant in ants]),
+            "y": array("d", [ant.y for ant in ants]),
+            "rotation": array("d", [ant.rotation for ant in ants]),
+            "memory": [ant.memory for ant in ants],
+            "rng": [_pack_rng_state(ant._rng_state()) for ant in ants],
+            "antgorithm": [ant.antgorithm for ant in ants],
+        }
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "seed": self.seed,
+            "rng": self.rng.getstate(),
+            "game_tick": self.game_tick,
+            "bounds": self.bounds,
+            "next_id": self._next_id,
+            "next_order": self._next_order,
+            "array_state": self.state is not None,
+            "cell_size": self.ant_grid.cell_size if self.ant_grid is not None else None,
+            "board": (self.message_board.cell_size, self.message_board.lifetime),
+            "team_stats": [(team, stats.alive, stats.health, stats.kills) for team, stats in self.team_stats.items()],
+            "stat_sets": list(stat_sets),
+            "ants": saved_ants,
+            "blocks": [(ant._order, damage) for ant, damage in self.block_queue.items() if ant.alive],
+            "messages": [(m._order, m.team, m.x, m.y, m.content, m.topic, m.tick) for m in self.messages],
+            "team_antgorithms": self.team_antgorithms,
+            "team_memory": self.team_memory,
+        }
+        return(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def restore(self, blob):
+        """Put the battle back in the state a snapshot saved (in place, so whatever holds the battle keeps working)."""
+        state = pickle.loads(blob)
+        if not isinstance(state, dict) or state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Not a battle snapshot (or one saved by another version)")
+        if self.executor is not None and getattr(self.executor, "battle", None) is self:
+            raise ValueError("Close battle.executor before restoring, its workers still hold the old ants")
+        if state["array_state"] and np is None:
+            raise ImportError("Restoring an array-backed battle requires numpy")
+
+        self.seed = state["seed"]
+        self.rng.setstate(state["rng"])
+        self.game_tick = state["game_tick"]
+        self.bounds = state["bounds"]
+        self._next_id = state["next_id"]
+        self._next_order = state["next_order"]
+        self.team_stats = {}
+        for team, alive, health, kills in state["team_stats"]:
+            stats = self.team_stats[team] = TeamStats()
+            stats.alive, stats.health, stats.kills = alive, health, kills
+        self.instruction_queue = InstructionBuffer()
+        self.attack_queue = {}
+        self.damage_queue = {}
+        self.message_queue = []
+        self.neighbours = None
+        self.last_neighbours = None
+        self.team_antgorithms = state["team_antgorithms"]
+        self.team_memory = state["team_memory"]
+        self.team_instructions = []
+        self.state = AntState() if state["array_state"] else None
+        if self.state is not None:
+            for team in self.team_stats:
+                self.state.team_code(team) # Codes are handed out in the order teams first appeared
+        self.ant_grid = SpatialGrid(cell_size=state["cell_size"]) if state["cell_size"] is not None else None
+        self.message_board = MessageBoard(*state["board"])
+
+        self.ants = AntRegistry()
+        saved = state["ants"]
+        stat_sets = state["stat_sets"]
+        by_order = {}
+        for i, order in enumerate(saved["order"]):
+            by_order[order] = _restore_ant(self, order, saved["id"][i], saved["team"][i], stat_sets[saved["stats"][i]],
+                                           saved["x"][i], saved["y"][i], saved["rotation"][i],
+                                           saved["memory"][i], saved["rng"][i], saved["antgorithm"][i])
+        self.block_queue = {by_order[order]: damage for order, damage in state["blocks"]}
+        self.message_board.load([_restore_message(self, *m) for m in state["messages"]])
+
+def _copy_rng(rng):
+    """Return a generator in the same state as rng."""
+    twin = random.Random.__new__(random.Random) # Skips seeding from the OS
+    twin.setstate(rng.getstate())
+    return(twin)
+
+class _SharedRng():
+    """An ant's generator, shared by a battle and its forks until they use it (see Battle.fork and Ant.rng)."""
+    __slots__ = ["rng", "holders"]
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.holders = 1 # Ants still pointing at this
+
+    def take(self):
+        """Return a generator in the shared state for one holder (the last one gets the original)."""
+        self.holders -= 1
+        if self.holders == 0:
+            return(self.rng)
+        return(_copy_rng(self.rng))
+
+def _pack_rng_state(state):
+    """Pack a generator's state into bytes (its 625 words take half the room they do pickled as ints)."""
+    if state is None:
+        return(None)
+    version, words, gauss_next = state
+    return((version, array("I", words).tobytes(), gauss_next))
+
+def _unpack_rng_state(packed):
+    version, words, gauss_next = packed
+    return((version, tuple(array("I", words)), gauss_next))
+
+def _restore_ant(battle, order, id, team, stats, x, y, rotation, memory, rng_state, antgorithm):
+    """Add an ant from a snapshot to the battle without assigning it a new id or order."""
+    ant = Ant.__new__(Ant, battle)
+    ant.battle = battle
+    if battle.state is not None:
+        # The row has to exist before any attribute it holds is set
+        ant._row = battle.state.add_row(ant, team)
+        ant._values = battle.state.values
+        battle.state.order[ant._row] = order
+    ant.id = id
+    ant.team = team
+    ant.alive = True
+    for s, value in zip(STAT_NAMES, stats):
+        setattr(ant, s, value)
+    ant.x, ant.y, ant.rotation = x, y, rotation
+    ant.memory = memory
+    ant._rng = None
+    if rng_state is not None:
+        ant._rng = random.Random.__new__(random.Random)
+        ant._rng.setstate(_unpack_rng_state(rng_state))
+    ant.antgorithm = antgorithm
+    ant._order = order
+    battle.ants.append(ant)
+    battle.index_ant(ant)
+    return(ant)
+
+def _restore_message(battle, order, team, x, y, content, topic, tick):
+    message = Message.__new__(Message)
+    message.team = team
+    message.x = x
+    message.y = y
+    message.content = content
+    message.topic = topic
+    message.tick = tick
+    message._battle = battle
+    message._order = order
+    return(message)
 
 class Message():
-    def __init__(self, ant, content):
+    __slots__ = ["team", "x", "y", "content", "topic", "tick", "_battle", "_order"]
+
+    def __init__(self, ant, content, topic=None):
         self.team = ant.team # We don't want the full ant object in the message!
         self.x = ant.x
         self.y = ant.y
         self.content = content
-        self.age = 0
+        self.topic = content if topic is None else topic # Messages sent without a topic are filed under their content
+        self.tick = ant.battle.game_tick # The tick the message was sent
+        self._battle = ant.battle # Only used to work out the age
+        self._order = ant.battle.next_order()
+
+    @property
+    def age(self):
+        """How many ticks ago the message was sent."""
+        return(self._battle.game_tick - self.tick)
+
+    def _copy(self, battle):
+        """Return a copy of the message for a fork of its battle."""
+        return(_restore_message(battle, self._order, self.team, self.x, self.y, self.content, self.topic, self.tick))
 
 class Ant():
+    # No per-ant __dict__: antgorithms keep what they need in memory
+    __slots__ = ["id", "team", "alive"] + STAT_NAMES + ["x", "y", "rotation", "memory", "_rng", "antgorithm", "battle", "_order"]
+
+    def __new__(cls, battle, *args, **kwargs):
+        # Ants in an array-backed battle are views over a row of battle.state
+        if cls is Ant and battle.state is not None:
+            cls = ArrayAnt
+        return(super().__new__(cls))
+
     def __init__(self, battle, team, 
                  stats_dict, init_position, antgorithm):
         
         # Basic ant info
-        self.id = uuid.uuid4()
+        self.id = battle.next_ant_id()
         self.team = team # blue or red
         self.alive = True
 
         # Combat and movement stats
-        required_stats = ["size", "health", "speed", "block_damage", "bite_damage", "bite_range", "bite_angle", "smell_range"]
-        for s in required_stats:
+        for s in STAT_NAMES:
             if s not in stats_dict:
                 raise ValueError("Ant stats must include " + s)
             setattr(self, s, stats_dict[s])
@@ -114,35 +745,79 @@ class Ant():
         self.y = init_position[1]
         self.rotation = init_position[2]
 
-        # Memory
+        # Memory and this ant's own random number generator (use it instead of the random module)
         self.memory = {}
+        self._rng = None # Made the first time it's used (see rng)
 
         # Attach the antgorithm
         self.antgorithm = antgorithm
 
         # Add the ant to the battle
         self.battle = battle
+        self._order = battle.next_order()
         battle.ants.append(self)
+        battle.index_ant(self)
+        battle.count_ant(self)
+
+    @property
+    def rng(self):
+        """The ant's own random number generator (it only depends on the battle's seed and the ant's id)."""
+        rng = self._rng
+        if rng is None:
+            rng = self._rng = self.battle.ant_rng(self.id) # Most of an ant's memory, so only made when needed
+        elif rng.__class__ is _SharedRng:
+            rng = self._rng = rng.take() # First use since the battle was forked
+        return(rng)
+
+    @rng.setter
+    def rng(self, rng):
+        self._rng = rng
+
+    def _rng_state(self):
+        """Return the state of the ant's generator (None if it hasn't been made yet)."""
+        rng = self._rng
+        if rng is None:
+            return(None)
+        if rng.__class__ is _SharedRng:
+            rng = rng.rng
+        return(rng.getstate())
 
-        # Now let's deal with pygame stuff
-        # super(Ant, self).__init__()
+    def _share_rng(self):
+        """Return the ant's generator (or None) for a fork to share until one of them uses it."""
+        rng = self._rng
+        if rng is not None:
+            if rng.__class__ is not _SharedRng:
+                rng = self._rng = _SharedRng(rng)
+            rng.holders += 1
+        return(rng)
 
-        # Import and display the ant's body
-        image_path = "./assets/" + team + "_ant.png"
-        self.body_surf = pygame.image.load(image_path).convert_alpha()
-        # Scale the ant to the hitbox size (maintain 3:5 aspect ratio)
-        _hitbox_angle = math.atan(3/5)
-        _surf_height = int(self.size * math.cos(_hitbox_angle)) * 2
-        _surf_width = int(self.size * math.sin(_hitbox_angle)) * 2
-        self.body_surf = pygame.transform.scale(self.body_surf, (_surf_width, _surf_height))
+    def _fork(self, battle, copy_memory):
+        """Return a copy of the ant for a fork of its battle (see Battle.fork)."""
+        twin = object.__new__(Ant)
+        twin.id = self.id
+        twin.team = self.team
+        twin.alive = self.alive
+        twin.size = self.size
+        twin.health = self.health
+        twin.speed = self.speed
+        twin.block_damage = self.block_damage
+        twin.bite_damage = self.bite_damage
+        twin.bite_range = self.bite_range
+        twin.bite_angle = self.bite_angle
+        twin.smell_range = self.smell_range
+        twin.x = self.x
+        twin.y = self.y
+        twin.rotation = self.rotation
+        twin.memory = copy_memory(self.memory)
+        twin._rng = self._share_rng()
+        twin.antgorithm = self.antgorithm
+        twin.battle = battle
+        twin._order = self._order
+        return(twin)
 
     @classmethod
     def get_ant_by_id(self, battle, id):
-        this_ant = [ant for ant in battle.ants if ant.id == id]
-        if len(this_ant) == 0:
-            return(None)
-        else:
-            return(this_ant[0])
+        return(battle.ants.get(id))
         
     def _replace(self, **kwargs):
         """Replace each attribute with the given value."""
@@ -152,19 +827,22 @@ class Ant():
 
     def attackable(self, include_teammates=False, include_enemies=True, return_objects=False):
         """Return a list of all ants that can be attacked (within bite_range and bite_angle)."""
+        if self.battle.profiler is not None:
+            self.battle.profiler.count("attackable")
         ants_attackable = []
-        for ant in self.battle.ants:
-            # Make sure the ant isn't this ant...
-            if ant == self:
-                continue
-            if (ant.x - self.x)**2 + (ant.y - self.y)**2 < self.bite_range**2:
-                # Check if the ant is in front of this ant
-                angle_to_ant = math.atan2(self.x - ant.x, self.y - ant.y) % (2*math.pi)
-                if abs(angle_to_ant - self.rotation) < self.bite_angle/2: # Divide by 2 b/c it's centered on the ant's rotation
-                    ants_attackable.append(ant)
-                # Give a tiny circle around the ant's center as a buffer (doesn't work well otherwise...)
-                elif (ant.x - self.x)**2 + (ant.y - self.y)**2 < 1:
-                    ants_attackable.append(ant)
+        x, y, rotation, half_angle = self.x, self.y, self.rotation, self.bite_angle/2 # Divide by 2 b/c it's centered on the ant's rotation
+        table = self.battle.neighbours
+        bearings = table.bearings_from(self) if table is not None else {} # Each bearing is worked out once a tick (see neighbours.py)
+        for ant, distance_sq in self._neighbour_pairs(self.bite_range):
+            # Check if the ant is in front of this ant
+            angle_to_ant = bearings.get(ant)
+            if angle_to_ant is None:
+                angle_to_ant = bearings[ant] = math.atan2(x - ant.x, y - ant.y) % (2*math.pi)
+            if abs(angle_to_ant - rotation) < half_angle:
+                ants_attackable.append(ant)
+            # Give a tiny circle around the ant's center as a buffer (doesn't work well otherwise...)
+            elif distance_sq < 1:
+                ants_attackable.append(ant)
 
         # Remove teammates or enemies if specified
         if not include_teammates:
@@ -175,44 +853,72 @@ class Ant():
         # Return list of Ant objects or (x, y, team) tuples
         if (return_objects):
             return(ants_attackable)
+        elif table is not None:
+            return([table.position(ant) for ant in ants_attackable])
         else:
             return([(ant.x, ant.y, ant.team) for ant in ants_attackable])
 
     def sense(self, range=None, include_teammates=True, include_enemies=True, return_objects=False):
         """Return the position of all ants within a range (defaults to smell_range)."""
-        
+        if self.battle.profiler is not None:
+            self.battle.profiler.count("sense")
+
         # Default to sensing the full smell range
         if range is None:
             range = self.smell_range
         if range > self.smell_range:
             range = self.smell_range
 
-        ants_nearby = []
-        for ant in self.battle.ants:
-            # Make sure the ant isn't this ant...
-            if ant == self:
-                continue
-            if (ant.x - self.x)**2 + (ant.y - self.y)**2 < range**2:
-                ants_nearby.append(ant)
-
-        # Remove teammates or enemies if specified
-        if not include_teammates:
-            ants_nearby = [ant for ant in ants_nearby if ant.team != self.team]
-        if not include_enemies:
-            ants_nearby = [ant for ant in ants_nearby if ant.team == self.team]
+        # Keep teammates and/or enemies as specified
+        team = self.team
+        pairs = self._neighbour_pairs(range)
+        if include_teammates and include_enemies:
+            ants_nearby = [ant for ant, _ in pairs]
+        elif include_teammates:
+            ants_nearby = [ant for ant, _ in pairs if ant.team == team]
+        elif include_enemies:
+            ants_nearby = [ant for ant, _ in pairs if ant.team != team]
+        else:
+            ants_nearby = []
 
         # Return list of Ant objects or (x, y, team) tuples
         if (return_objects):
             return(ants_nearby)
-        else:
-            return([(ant.x, ant.y, ant.team) for ant in ants_nearby])
+        table = self.battle.neighbours
+        if table is not None and self in table.pairs:
+            coords = table.coords # Made once this tick for every ant near this one
+            return([coords[ant] for ant in ants_nearby])
+        return([(ant.x, ant.y, ant.team) for ant in ants_nearby])
     
-    def broadcast(self, message):
-        """Broadcast a message to all nearby ants."""
-        self.battle.new_message(ant=self, content=message)
+    def _neighbour_pairs(self, range):
+        """Return [(ant, squared distance)] for every other ant within range, in battle order."""
+        x, y, range_sq = self.x, self.y, range**2 # Hoisted, these are properties for array-backed ants
+        table = self.battle.neighbours
+        if table is not None and range <= self.smell_range:
+            pairs = table.neighbours(self)
+            if pairs is not None:
+                if range == self.smell_range:
+                    return(pairs)
+                return([(ant, distance_sq) for ant, distance_sq in pairs if distance_sq < range_sq])
+
+        pairs = []
+        for ant in self.battle.ants_near(x, y, range):
+            # Make sure the ant isn't this ant...
+            if ant == self:
+                continue
+            distance_sq = (ant.x - x)**2 + (ant.y - y)**2
+            if distance_sq < range_sq:
+                pairs.append((ant, distance_sq))
+        return(pairs)
+
+    def broadcast(self, message, topic=None):
+        """Broadcast a message to all nearby ants (filed under topic, or under the message itself)."""
+        self.battle.new_message(ant=self, content=message, topic=topic)
 
-    def receive(self, range=None):
-        """Receive all messages within range."""
+    def receive(self, range=None, topic=None, prefix=None):
+        """Receive all messages within range (only those filed under topic, or under a topic starting with prefix, if given)."""
+        if self.battle.profiler is not None:
+            self.battle.profiler.count("receive")
 
         # Default to receiving in the full smell range
         if range is None:
@@ -221,7 +927,8 @@ class Ant():
             range = self.smell_range
 
         # I don't like this because you can cheat, but who cares!
-        messages = [m for m in self.battle.messages if self.distance_to((m.x, m.y)) < range]
+        x, y = self.x, self.y
+        messages = [m for m in self.battle.messages_near(x, y, range, topic=topic, prefix=prefix) if math.sqrt((x - m.x)**2 + (y - m.y)**2) < range] # Same distance as distance_to
         return(messages)
 
     def walk(self, distance=None):
@@ -279,11 +986,12 @@ class Ant():
         self.battle.block(self, self.block_damage)
         return(True)
     
-    def suffer(self, damage):
+    def suffer(self, damage, killer_team=None):
         """Take damage from an attack."""
         self.health -= abs(damage) # Just in case damage is negative
+        self.battle.team_stats[self.team].health -= abs(damage)
         if self.health <= 0:
-            self.die()
+            self.die(killer_team=killer_team)
 
         # # Knock the ant back (unless it is already at the edge of the screen)
         # new_x = self.x + 2 * (self.x - attacker_x)
@@ -298,34 +1006,61 @@ class Ant():
 
         return(True)
     
-    def die(self):
-        """Kill the ant."""
+    def die(self, killer_team=None):
+        """Kill the ant (crediting the kill to killer_team, if given)."""
         self.alive = False
         self.battle.ants.remove(self)
+        self.battle.ant_grid.remove(self)
+        stats = self.battle.team_stats[self.team]
+        stats.alive -= 1
+        stats.health -= self.health # Whatever health is left (zero or less when killed in combat)
+        if killer_team is not None and killer_team != self.team:
+            self.battle.team_stats[killer_team].kills += 1
         return(True)
     
-    def antgorithm(self):
-        """The ant's antgorithm to be attached to the ant and run every tick."""
-        return()
-                
     # Helper functions to make writng antgorithms easier!
+    def _toward(self, target):
+        """Return this tick's cached [squared distance, distance, angle] to a target, or None while ants can move."""
+        table = self.battle.neighbours
+        if table is None:
+            return(None)
+        return(table.toward(self, target))
+
     def nearest(self, list_of_coords):
         """Return the coordinates of the nearest ant from a list of coordinates (output of self.sense())."""
-        nearest_ant = min(list_of_coords, key=lambda x: (x[0] - self.x)**2 + (x[1] - self.y)**2)
+        x, y = self.x, self.y
+        nearest_ant = min(list_of_coords, key=lambda coords: (coords[0] - x)**2 + (coords[1] - y)**2)
+        cached = self._toward(nearest_ant)
+        if cached is not None and cached[0] is None:
+            cached[0] = (nearest_ant[0] - x)**2 + (nearest_ant[1] - y)**2 # So distance_to(nearest_ant) only takes the square root
         return(nearest_ant)
     
     def distance_to(self, target):
         """Return the distance to the given target (x,y)."""
+        cached = self._toward(target)
+        if cached is not None:
+            if cached[1] is not None:
+                return(cached[1])
+            if cached[0] is not None:
+                cached[1] = math.sqrt(cached[0])
+                return(cached[1])
         dx = self.x - target[0]
         dy = self.y - target[1]
         distance = math.sqrt(dx**2 + dy**2)
+        if cached is not None:
+            cached[0], cached[1] = dx**2 + dy**2, distance
         return(distance) 
 
     def angle_toward(self, target):
         """Return the absulte angle toward the given target (x,y)."""
+        cached = self._toward(target)
+        if cached is not None and cached[2] is not None:
+            return(cached[2])
         dx = self.x - target[0]
         dy = self.y - target[1]
         angle = math.atan2(dy, dx) + math.pi % (2*math.pi) # Weird pygame coordinate system stuff...
+        if cached is not None:
+            cached[2] = angle
         return(angle)
     
     def near_bounds(self, buffer=None):
@@ -333,3 +1068,42 @@ class Ant():
         if buffer is None:
             buffer = self.size
         return(self.x < buffer or self.x > self.battle.bounds[0] - buffer or self.y < buffer or self.y > self.battle.bounds[1] - buffer)
+
+class ArrayAnt(Ant):
+    """An Ant whose position, rotation, health, stats and alive flag live in a row of battle.state."""
+    __slots__ = ["_row", "_values"]
+
+    def __init__(self, battle, team, 
+                 stats_dict, init_position, antgorithm):
+        # The row has to exist before Ant.__init__ sets any attributes
+        self.battle = battle
+        self._row = battle.state.add_row(self, team)
+        self._values = battle.state.values
+        super().__init__(battle, team, stats_dict, init_position, antgorithm)
+        battle.state.order[self._row] = self._order
+
+    def _fork(self, battle, copy_memory):
+        """Return a view of the same row in a fork's copy of the state (see Battle.fork)."""
+        twin = object.__new__(ArrayAnt)
+        twin.battle = battle
+        twin._row = self._row
+        twin._values = battle.state.values
+        twin.id = self.id
+        twin.team = self.team
+        twin.memory = copy_memory(self.memory)
+        twin._rng = self._share_rng()
+        twin.antgorithm = self.antgorithm
+        twin._order = self._order
+        return(twin)
+
+def _state_column(name):
+    """Make a property that reads and writes one column of the battle's AntState."""
+    def fget(self):
+        return(self._values[name][self._row])
+    def fset(self, value):
+        self.battle.state.set_value(self._row, name, value)
+    return(property(fget, fset, doc=f"The ant's {name} (stored in battle.state.{name})."))
+
+if np is not None:
+    for _name in FLOAT_COLUMNS + ["alive"]:
+        setattr(ArrayAnt, _name, _state_column(_name))
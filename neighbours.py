@@ -0,0 +1,149 @@
+"""Share the work of sensing between the ants of a tick.
+
+While antgorithms run, ants can't move, so who is near whom is fixed for the
+whole antgorithm phase. A NeighbourTable works it out one grid cell at a
+time: the first time an ant in a cell senses, every ant in that cell gets
+the list of ants within its smell_range (with their squared distances, in
+battle order) from a single pass over the cell and its eight neighbours.
+Ant.sense and Ant.attackable filter those lists instead of querying the grid
+themselves, so antgorithms get the same answers without changing.
+
+Ants whose smell_range is larger than the grid's cells (the grid is sized
+from the first ant's smell_range) aren't in the table, and sense for them
+the usual way.
+
+The table is the tick's geometry cache. With NumPy, a crowded cell's squared
+distances are worked out in one batch (every ant of the cell against every
+ant of the block) instead of pair by pair, which is most of the cost of
+sensing in a dense fight (NumPy squares can differ from Python's `**2` in the
+last bit, as in state.py, which only matters for an ant exactly on the edge
+of another's range). Each ant's (x, y, team) tuple is also made once per
+tick and shared by every sense result it appears in.
+
+The table also keeps the geometry ants ask for: each ant's bearings to the
+ants it checks in attackable, and its distance and angle to the targets it
+passes to nearest, distance_to and angle_toward, so asking again costs a
+lookup instead of a trig call. The table is dropped before ants move
+(Battle.stop_sensing), so nothing in it goes stale. Once ants have moved,
+resolve_attacks gives the biters a table without a grid (they query the
+grid themselves, which is cheaper for a few ants) that takes the bearings
+it can from the antgorithms' table: those between ants that are still where
+they were (a biting, blocking or turning ant doesn't move).
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH_PAIRS = 256 # Cells with fewer (member, block ant) pairs than this are worked out in Python, a batch's overhead isn't worth it
+
+def _order(ant):
+    return(ant._order)
+
+class NeighbourTable():
+    def __init__(self, grid, previous=None):
+        self.grid = grid
+        self.pairs = {} # {ant: [(other ant, squared distance), ...]} for the cells worked out so far
+        self.coords = {} # {ant: (x, y, team)} for every ant in the blocks worked out so far
+        self.bearings = {} # {ant: {other ant: bearing, as attackable measures it}} for the ants that have asked
+        self.targets = {} # {ant: {(x, y): [squared distance, distance, angle_toward]}}, each None until worked out
+        self.previous = previous # An earlier table of the same tick, whose bearings still hold for ants that haven't moved
+
+    def position(self, ant):
+        """Return the ant's (x, y, team), made once for the table."""
+        position = self.coords.get(ant)
+        if position is None:
+            position = self.coords[ant] = (ant.x, ant.y, ant.team)
+        return(position)
+
+    def bearings_from(self, ant):
+        """Return the ant's {other ant: bearing} cache, to fill in as bearings are worked out."""
+        bearings = self.bearings.get(ant)
+        if bearings is None:
+            bearings = self.bearings[ant] = {}
+            previous = self.previous
+            if previous is not None:
+                earlier = previous.bearings.get(ant)
+                if earlier and previous.coords.get(ant) == self.position(ant):
+                    for other, bearing in earlier.items():
+                        if previous.coords.get(other) == self.position(other):
+                            bearings[other] = bearing
+        return(bearings)
+
+    def toward(self, ant, target):
+        """Return the ant's [squared distance, distance, angle_toward] entry for a target (x, y), to fill in as they're worked out."""
+        targets = self.targets.get(ant)
+        if targets is None:
+            targets = self.targets[ant] = {}
+        key = (target[0], target[1])
+        entry = targets.get(key)
+        if entry is None:
+            entry = targets[key] = [None, None, None]
+        return(entry)
+
+    def neighbours(self, ant):
+        """Return [(ant, squared distance)] for every other ant within the ant's smell_range, in battle order.
+
+        Returns None if the table can't answer for this ant. The list is
+        shared, so callers mustn't change it.
+        """
+        pairs = self.pairs.get(ant)
+        if pairs is None:
+            self._add_cell(ant)
+            pairs = self.pairs.get(ant)
+        return(pairs)
+
+    def _add_cell(self, ant):
+        """Work out the neighbours of every ant in the same cell as this one."""
+        grid = self.grid
+        if grid is None: # A table only keeping geometry (see Battle.resolve_attacks)
+            return()
+        cell = grid.item_cells.get(ant)
+        if cell is None:
+            return()
+        cell_x, cell_y = cell
+        block = []
+        for cx in (cell_x - 1, cell_x, cell_x + 1):
+            for cy in (cell_y - 1, cell_y, cell_y + 1):
+                block.extend(grid.cells.get((cx, cy), ()))
+        block.sort(key=_order)
+        coords = self.coords
+        positions = []
+        for other in block: # Read each position once (they're properties for array-backed ants)
+            position = coords.get(other)
+            if position is None:
+                position = coords[other] = (other.x, other.y, other.team)
+            positions.append(position)
+
+        members = [member for member in grid.cells[cell] if member.smell_range <= grid.cell_size] # Others' neighbours could be outside the block
+        if np is not None and len(members) * len(block) >= BATCH_PAIRS:
+            return(self._add_batch(members, block, positions))
+        for member in members:
+            x, y, _ = coords[member]
+            range_sq = member.smell_range**2
+            pairs = []
+            for other, (other_x, other_y, _) in zip(block, positions):
+                if other is member:
+                    continue
+                distance_sq = (other_x - x)**2 + (other_y - y)**2
+                if distance_sq < range_sq:
+                    pairs.append((other, distance_sq))
+            self.pairs[member] = pairs
+
+    def _add_batch(self, members, block, positions):
+        """Work out the neighbours of members (ants of the block's center cell) with one NumPy pass."""
+        index = {other: i for i, other in enumerate(block)}
+        member_index = np.array([index[member] for member in members], dtype=np.int64)
+        block_x = np.array([x for x, _, _ in positions], dtype=np.float64)
+        block_y = np.array([y for _, y, _ in positions], dtype=np.float64)
+        distance_sq = (block_x - block_x[member_index, None])**2 + (block_y - block_y[member_index, None])**2
+        range_sq = np.array([member.smell_range for member in members], dtype=np.float64)**2
+        within = distance_sq < range_sq[:, None]
+        within[np.arange(len(members)), member_index] = False # Not itself
+        member_rows, block_columns = np.nonzero(within) # Row by row, so each member's neighbours stay in battle order
+        pairs = list(zip([block[i] for i in block_columns.tolist()], distance_sq[member_rows, block_columns].tolist()))
+        start = 0
+        for member, count in zip(members, within.sum(axis=1).tolist()):
+            self.pairs[member] = pairs[start:start + count]
+            start += count
@@ -0,0 +1,236 @@
+"""Run antgorithms in long-lived worker processes.
+
+Ants and the Battle can't be sent to other processes (they point at each other
+and at the renderer's world), so workers never see them. Instead, each tick
+the main process sends every worker the same compact snapshot of the world,
+and each worker keeps a mirror Battle up to date from it. A worker runs the
+antgorithms of its shard of ants against the mirror and sends back their
+instructions, broadcasts and memory changes. Those are applied in battle
+order, so the tick comes out the same as running the antgorithms serially.
+
+Each worker owns the memory and random number generator of the ants in its
+shard. The main process gets a copy of every memory change each tick, and the
+generators' states when the executor is closed. Antgorithms should only
+affect the battle through their returned instruction, broadcast(),
+self.memory and self.rng.
+
+    battle.executor = ParallelExecutor(n_workers=8)
+    battle.run()
+    battle.executor.close()
+"""
+
+import copy
+import multiprocessing
+import pickle
+import traceback
+from array import array
+from models import Battle, Ant, Message, STAT_NAMES
+
+def make_snapshot(battle, ants, new_ants):
+    """Return the per-tick world state the workers need (static ant info only for new ants)."""
+    snapshot = {
+        "game_tick": battle.game_tick,
+        "bounds": battle.bounds,
+        # (order, id, team, stats, antgorithm, memory, rng) for ants the workers haven't seen
+        "new_ants": [(ant._order, ant.id, ant.team, {s: getattr(ant, s) for s in STAT_NAMES}, ant.antgorithm, ant.memory, ant.rng) for ant in new_ants],
+        "orders": array("q", [ant._order for ant in ants]),
+        "x": array("d", [ant.x for ant in ants]),
+        "y": array("d", [ant.y for ant in ants]),
+        "rotation": array("d", [ant.rotation for ant in ants]),
+        "health": array("d", [ant.health for ant in ants]),
+        "messages": [(m._order, m.team, m.x, m.y, m.content, m.topic, m.tick) for m in battle.messages],
+        "team_antgorithm_teams": list(battle.team_antgorithms), # Their ants are run by the main process
+    }
+    return(snapshot)
+
+def _add_mirror_ant(mirror, order, id, team, stats, antgorithm, memory, rng):
+    """Add an ant to a worker's mirror battle without assigning it a new id or order."""
+    ant = Ant.__new__(Ant, mirror)
+    ant.id = id
+    ant.team = team
+    ant.alive = True
+    for s, value in stats.items():
+        setattr(ant, s, value)
+    ant.x, ant.y, ant.rotation = 0, 0, 0 # Set from the snapshot straight after
+    ant.memory = memory
+    ant.rng = rng
+    ant.antgorithm = antgorithm
+    ant.battle = mirror
+    ant._order = order
+    mirror.ants.append(ant)
+    mirror.index_ant(ant)
+    mirror.count_ant(ant)
+    return(ant)
+
+def _make_mirror_message(mirror, order, team, x, y, content, topic, tick):
+    """Rebuild a Message from a snapshot."""
+    message = Message.__new__(Message)
+    message.team = team
+    message.x = x
+    message.y = y
+    message.content = content
+    message.topic = topic
+    message.tick = tick
+    message._battle = mirror
+    message._order = order
+    return(message)
+
+def update_mirror(mirror, mirror_ants, snapshot):
+    """Bring a worker's mirror battle up to date with a snapshot."""
+    mirror.game_tick = snapshot["game_tick"]
+    mirror.bounds = snapshot["bounds"]
+    for order, id, team, stats, antgorithm, memory, rng in snapshot["new_ants"]:
+        mirror_ants[order] = _add_mirror_ant(mirror, order, id, team, stats, antgorithm, memory, rng)
+
+    # Ants missing from the snapshot have died
+    live_orders = set(snapshot["orders"])
+    for order in [order for order in mirror_ants if order not in live_orders]:
+        mirror_ants.pop(order).die()
+
+    for order, x, y, rotation, health in zip(snapshot["orders"], snapshot["x"], snapshot["y"], snapshot["rotation"], snapshot["health"]):
+        ant = mirror_ants[order]
+        ant.x = x
+        ant.y = y
+        ant.rotation = rotation
+        ant.health = health
+    mirror.update_grid()
+
+    mirror.message_board.load([_make_mirror_message(mirror, *m) for m in snapshot["messages"]])
+
+def run_shard(mirror, worker_index, n_workers, skip_teams=(), run_antgorithm=None):
+    """Run the antgorithms of this worker's ants (except those in skip_teams) and return (order, instruction, memory changes, memory removals, broadcasts).
+
+    run_antgorithm(ant), if given, runs each antgorithm instead and returns
+    (instruction, extra), extra being added to the end of the ant's result.
+    """
+    results = []
+    mirror.start_sensing()
+    for ant in mirror.ants:
+        if ant._order % n_workers != worker_index or ant.team in skip_teams:
+            continue
+        memory_before = copy.deepcopy(ant.memory)
+        mirror.message_queue = []
+        if run_antgorithm is None:
+            instruction, extra = ant.antgorithm(ant), ()
+        else:
+            instruction, extra = run_antgorithm(ant)
+        broadcasts = [(m.content, m.topic) for m in mirror.message_queue]
+        changed = {k: v for k, v in ant.memory.items() if k not in memory_before or memory_before[k] != v}
+        removed = [k for k in memory_before if k not in ant.memory]
+        results.append((ant._order, instruction, changed, removed, broadcasts) + extra)
+    mirror.stop_sensing()
+    mirror.message_queue = []
+    return(results)
+
+def shard_rng_states(mirror, worker_index, n_workers, skip_teams=()):
+    """Return {order: rng state} for this worker's ants (the main process owns the rngs of skip_teams)."""
+    return({ant._order: ant.rng.getstate() for ant in mirror.ants if ant._order % n_workers == worker_index and ant.team not in skip_teams})
+
+def _worker_main(connection, worker_index, n_workers):
+    """Serve ticks until told to stop (sending back the shard's rng states)."""
+    mirror = Battle(seed=0) # Only a mirror, its ants bring their own generators
+    mirror_ants = {} # {order: Ant}
+    skip_teams = set() # Teams run by team antgorithms in the main process
+    while True:
+        command, payload = pickle.loads(connection.recv_bytes())
+        if command == "stop":
+            connection.send_bytes(pickle.dumps(shard_rng_states(mirror, worker_index, n_workers, skip_teams), protocol=pickle.HIGHEST_PROTOCOL))
+            break
+        try:
+            update_mirror(mirror, mirror_ants, payload)
+            skip_teams = set(payload["team_antgorithm_teams"])
+            reply = ("ok", run_shard(mirror, worker_index, n_workers, skip_teams))
+        except Exception:
+            reply = ("error", traceback.format_exc())
+        connection.send_bytes(pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL))
+    connection.close()
+
+class ParallelExecutor():
+    """Runs a battle's antgorithms across worker processes (set it as battle.executor)."""
+    worker_main = staticmethod(_worker_main) # What each worker process runs
+
+    def __init__(self, n_workers=None):
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        self.battle = None # An executor's workers mirror one battle
+        self._sent_orders = set() # Ants whose static info the workers already have
+
+        self.connections = [None] * n_workers
+        self.processes = [None] * n_workers
+        for worker_index in range(n_workers):
+            self._start_worker(worker_index)
+
+    def _worker_args(self, worker_index):
+        """Return the arguments worker_main gets after its connection."""
+        return((worker_index, self.n_workers))
+
+    def _start_worker(self, worker_index):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=self.worker_main, args=(child_connection,) + self._worker_args(worker_index), daemon=True)
+        process.start()
+        child_connection.close()
+        self.connections[worker_index] = parent_connection
+        self.processes[worker_index] = process
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run_antgorithms(self, battle):
+        """Run every live ant's antgorithm in the workers and queue the instructions (in battle order)."""
+        if self.battle is None:
+            self.battle = battle
+        elif self.battle is not battle:
+            raise ValueError("A ParallelExecutor can only run one battle")
+
+        ants = [ant for ant in battle.ants if ant.alive]
+        new_ants = [ant for ant in ants if ant._order not in self._sent_orders]
+        payload = pickle.dumps(("tick", make_snapshot(battle, ants, new_ants)), protocol=pickle.HIGHEST_PROTOCOL)
+        self._sent_orders.update(ant._order for ant in new_ants)
+        for connection in self.connections:
+            connection.send_bytes(payload)
+
+        results = {}
+        errors = []
+        for connection in self.connections:
+            status, reply = pickle.loads(connection.recv_bytes())
+            if status == "error":
+                errors.append(reply)
+                continue
+            for result in reply:
+                results[result[0]] = result
+        if len(errors) > 0:
+            raise RuntimeError("An antgorithm failed in a worker process:\n" + errors[0])
+
+        for ant in ants:
+            if ant.team in battle.team_antgorithms:
+                continue
+            _, instruction, changed, removed, broadcasts = results[ant._order]
+            for content, topic in broadcasts:
+                ant.broadcast(content, topic=topic)
+            ant.memory.update(changed)
+            for k in removed:
+                del ant.memory[k]
+            battle.instruction_queue[ant.id] = instruction
+
+    def close(self):
+        """Stop the worker processes and copy their ants' rng states back to the battle."""
+        rng_states = {}
+        for connection in self.connections:
+            try:
+                connection.send_bytes(pickle.dumps(("stop", None)))
+                rng_states.update(pickle.loads(connection.recv_bytes()))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            connection.close()
+        if self.battle is not None:
+            for ant in self.battle.ants:
+                if ant._order in rng_states:
+                    ant.rng.setstate(rng_states[ant._order])
+        for process in self.processes:
+            process.join(timeout=5)
+        self.connections = []
+        self.processes = []
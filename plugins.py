@@ -0,0 +1,86 @@
+"""Find antgorithms by name and only import the ones that are used.
+
+The registry knows every module in ./antgorithms (from the file names) and
+every antgorithm other packages register under the "ant_game.antgorithms"
+entry point group, without importing any of them:
+
+    [project.entry-points."ant_game.antgorithms"]
+    sneaky_ant = "my_ants.sneaky"
+
+A module is imported the first time one of its functions is asked for and
+kept after that. Local modules win over entry points with the same name.
+"""
+
+import importlib
+import os
+from importlib import metadata
+
+ANTGORITHMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "antgorithms")
+ENTRY_POINT_GROUP = "ant_game.antgorithms"
+
+class AntgorithmRegistry():
+    def __init__(self, directory=ANTGORITHMS_DIR, package="antgorithms", entry_point_group=ENTRY_POINT_GROUP):
+        self.directory = directory
+        self.package = package
+        self.entry_point_group = entry_point_group
+        self._sources = None # {name: module path or entry point}, found on first use
+        self._modules = {} # {name: imported module (or object an entry point pointed at)}
+
+    def _discover(self):
+        """Find every antgorithm's name without importing anything."""
+        sources = {}
+        if self.entry_point_group is not None:
+            for entry_point in metadata.entry_points(group=self.entry_point_group):
+                sources.setdefault(entry_point.name, entry_point)
+        if os.path.isdir(self.directory):
+            for file_name in sorted(os.listdir(self.directory)):
+                name, extension = os.path.splitext(file_name)
+                if extension == ".py" and not name.startswith("_"):
+                    sources[name] = self.package + "." + name
+        return(sources)
+
+    @property
+    def sources(self):
+        if self._sources is None:
+            self._sources = self._discover()
+        return(self._sources)
+
+    def names(self):
+        """Return the names of every antgorithm, sorted."""
+        return(sorted(self.sources))
+
+    def __contains__(self, name):
+        return(name in self.sources)
+
+    def module(self, name):
+        """Return an antgorithm's module, importing it the first time."""
+        module = self._modules.get(name)
+        if module is None:
+            source = self.sources.get(name)
+            if source is None:
+                raise ValueError(f"No antgorithm called {name} (found: {', '.join(self.names())})")
+            if isinstance(source, str):
+                module = importlib.import_module(source)
+            else:
+                module = source.load()
+            self._modules[name] = module
+        return(module)
+
+    def antgorithm(self, name):
+        """Return an antgorithm's per-ant function (an entry point can also point straight at the function)."""
+        module = self.module(name)
+        if hasattr(module, "antgorithm"):
+            return(module.antgorithm)
+        if callable(module):
+            return(module)
+        raise ValueError(f"{name} doesn't define antgorithm(self)")
+
+    def team_antgorithm(self, name):
+        """Return an antgorithm's team_antgorithm function (None if it doesn't have one)."""
+        return(getattr(self.module(name), "team_antgorithm", None))
+
+    def loaded(self):
+        """Return the names of the antgorithms imported so far."""
+        return(sorted(self._modules))
+
+registry = AntgorithmRegistry()
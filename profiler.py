@@ -0,0 +1,122 @@
+"""Measure where a battle's ticks go.
+
+A TickProfiler attached to a battle (Battle(profile=True), or assign
+battle.profiler yourself) records the wall time of each phase of every tick
+(antgorithms, resolve_instructions, resolve_attacks, resolve_messages,
+record when a replay is being recorded, and draw_ants / draw_stats when the
+renderer is used), the time spent in each
+antgorithm, and how often sense, attackable and receive are called. Give it a
+path and it also writes one JSON line per tick. With no profiler attached the
+battle only pays for an `is None` check.
+
+When antgorithms run in worker processes (parallel.ParallelExecutor) only
+the antgorithms phase as a whole is timed, and calls made in the workers
+aren't counted.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+class TickProfiler():
+    def __init__(self, jsonl_path=None, keep_history=True):
+        self.phase_totals = {} # {phase: seconds}
+        self.antgorithm_totals = {} # {antgorithm name: seconds}
+        self.antgorithm_calls = {} # {antgorithm name: calls}
+        self.call_counts = {} # {"sense" / "attackable" / "receive": calls}
+        self.n_ticks = 0
+
+        self.keep_history = keep_history
+        self.history = [] # One record per tick (see end_tick)
+
+        self.jsonl_file = open(jsonl_path, "w") if jsonl_path is not None else None
+
+        self._tick = None # Record for the tick being measured
+        self._antgorithm_names = {} # {antgorithm function: name}
+
+    def start_tick(self, game_tick):
+        """Start recording a tick (finishing the previous one, which may have had drawing phases added)."""
+        self.end_tick()
+        self._tick = {"tick": game_tick, "phases": {}, "calls": {}}
+
+    def end_tick(self):
+        """Finish the current tick's record, keep it and stream it."""
+        if self._tick is None:
+            return()
+        self.n_ticks += 1
+        if self.keep_history:
+            self.history.append(self._tick)
+        if self.jsonl_file is not None:
+            self.jsonl_file.write(json.dumps(self._tick) + "\n")
+        self._tick = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of code as one phase of the current tick."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(name, time.perf_counter() - start)
+
+    def add_phase_time(self, name, seconds):
+        self.phase_totals[name] = self.phase_totals.get(name, 0) + seconds
+        if self._tick is not None:
+            phases = self._tick["phases"]
+            phases[name] = phases.get(name, 0) + seconds
+
+    def antgorithm_name(self, antgorithm):
+        """Return a readable name for an antgorithm function (module.function)."""
+        name = self._antgorithm_names.get(antgorithm)
+        if name is None:
+            name = getattr(antgorithm, "__module__", "?") + "." + getattr(antgorithm, "__qualname__", repr(antgorithm))
+            self._antgorithm_names[antgorithm] = name
+        return(name)
+
+    def add_antgorithm_time(self, antgorithm, seconds):
+        name = self.antgorithm_name(antgorithm)
+        self.antgorithm_totals[name] = self.antgorithm_totals.get(name, 0) + seconds
+        self.antgorithm_calls[name] = self.antgorithm_calls.get(name, 0) + 1
+
+    def count(self, method):
+        """Count a call to one of the Ant query methods."""
+        self.call_counts[method] = self.call_counts.get(method, 0) + 1
+        if self._tick is not None:
+            calls = self._tick["calls"]
+            calls[method] = calls.get(method, 0) + 1
+
+    def summary(self):
+        """Return the totals (and per tick means) as a dict."""
+        n_ticks = max(self.n_ticks + (self._tick is not None), 1)
+        return({
+            "ticks": self.n_ticks + (self._tick is not None),
+            "phase_seconds": dict(self.phase_totals),
+            "phase_ms_per_tick": {phase: seconds / n_ticks * 1000 for phase, seconds in self.phase_totals.items()},
+            "antgorithm_seconds": dict(self.antgorithm_totals),
+            "antgorithm_us_per_call": {name: self.antgorithm_totals[name] / calls * 1e6 for name, calls in self.antgorithm_calls.items()},
+            "call_counts": dict(self.call_counts),
+        })
+
+    def report(self):
+        """Return the summary as a readable table."""
+        summary = self.summary()
+        lines = [f"{summary['ticks']} ticks"]
+        lines.append(f"{'phase':<40} {'ms/tick':>9}")
+        for phase, ms in sorted(summary["phase_ms_per_tick"].items(), key=lambda item: -item[1]):
+            lines.append(f"  {phase:<38} {ms:>9.2f}")
+        if summary["antgorithm_seconds"]:
+            lines.append(f"{'antgorithm':<40} {'total s':>9} {'us/call':>9}")
+            for name, seconds in sorted(summary["antgorithm_seconds"].items(), key=lambda item: -item[1]):
+                lines.append(f"  {name:<38} {seconds:>9.2f} {summary['antgorithm_us_per_call'][name]:>9.1f}")
+        if summary["call_counts"]:
+            lines.append("calls")
+            for method, calls in sorted(summary["call_counts"].items()):
+                lines.append(f"  {method:<38} {calls:>9}")
+        return("\n".join(lines))
+
+    def close(self):
+        """Finish the last tick and close the JSONL file."""
+        self.end_tick()
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+            self.jsonl_file = None
@@ -0,0 +1,459 @@
+"""Draw a battle in a pygame window.
+
+This is the only module that imports pygame. The models know nothing about
+sprites: each team's image is loaded once per ant size, the first time such
+an ant is drawn, and pre-rotated into a SpriteAtlas.
+
+A View draws the arena at a scale (shrunk to fit the window for big arenas)
+and only pushes the parts of the screen that changed to the display. Past
+LOD_ANTS ants, or once ants would be drawn smaller than MIN_SPRITE_PX, it
+draws a density map instead of sprites: the ants are counted per team in a
+grid of DENSITY_CELL_PX cells with NumPy and the map goes to the screen in a
+single surfarray blit, so a frame costs about the same for 100,000 ants as
+for 10,000.
+"""
+
+import contextlib
+import math
+import os
+from collections import OrderedDict
+import pygame
+try:
+    import numpy as np # Only needed for density maps
+except ImportError:
+    np = None
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+FAST_FORWARD_KEY = pygame.K_f
+PAUSE_KEY = pygame.K_SPACE
+FAST_FORWARD_FPS = 20 # Frames drawn per second while fast-forwarding
+
+LOD_ANTS = 5000 # More ants than this are drawn as a density map
+MIN_SPRITE_PX = 4 # So are ants that would be drawn smaller than this
+DENSITY_CELL_PX = 4 # Side of a density map cell, in screen pixels
+MAX_DIRTY_RECTS = 500 # With more changed areas than this the whole arena is updated
+PANEL_WIDTH = 400 # The stats to the right of the arena
+MAX_WINDOW = (1800, 1000) # Bigger arenas are shrunk to fit
+
+def load_body_surf(team, size):
+    """Load a team's ant image and scale it to the hitbox size (maintain 3:5 aspect ratio)."""
+    image_path = os.path.join(ASSETS_DIR, team + "_ant.png")
+    body_surf = pygame.image.load(image_path).convert_alpha()
+    _hitbox_angle = math.atan(3/5)
+    _surf_height = int(size * math.cos(_hitbox_angle)) * 2
+    _surf_width = int(size * math.sin(_hitbox_angle)) * 2
+    return(pygame.transform.scale(body_surf, (_surf_width, _surf_height)))
+
+class SpriteAtlas():
+    """Each team's body image, loaded once per ant size and pre-rotated into angle buckets.
+
+    The rotations of a (team, size) are made together the first time one is
+    needed. Least recently used sets are dropped once they take up more than
+    max_bytes (each is n_angles surfaces).
+    """
+    def __init__(self, n_angles=64, max_bytes=64 * 2**20):
+        self.n_angles = n_angles
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._sets = OrderedDict() # {(team, size): (rotated surfaces, half sizes, bytes)}
+
+    def _make_set(self, team, size):
+        """Load a team's image at a size and rotate it into every angle bucket."""
+        body_surf = load_body_surf(team, size)
+        rotated_surfs, half_sizes = [], []
+        n_bytes = 0
+        for bucket in range(self.n_angles):
+            # Same angle convention as the ant's rotation (0 is facing right, the image faces up)
+            rotated = pygame.transform.rotate(body_surf, -bucket * 360 / self.n_angles - 90)
+            # Flatten onto white and key white out again: looks the same on the arena, blits much faster
+            flat = pygame.Surface(rotated.get_size())
+            flat.fill((255, 255, 255))
+            flat.blit(rotated, (0, 0))
+            rotated = flat.convert()
+            rotated.set_colorkey((255, 255, 255), pygame.RLEACCEL)
+            rotated_surfs.append(rotated)
+            half_sizes.append((rotated.get_width() / 2, rotated.get_height() / 2))
+            n_bytes += rotated.get_width() * rotated.get_height() * rotated.get_bytesize()
+        return(rotated_surfs, half_sizes, n_bytes)
+
+    def get_set(self, team, size):
+        """Return the (rotated surfaces, half sizes) of a team at a size, making them if needed."""
+        key = (team, size)
+        sprite_set = self._sets.get(key)
+        if sprite_set is None:
+            sprite_set = self._make_set(team, size)
+            self._sets[key] = sprite_set
+            self.n_bytes += sprite_set[2]
+            # Keep at least the set that's being drawn, even if it alone is over budget
+            while self.n_bytes > self.max_bytes and len(self._sets) > 1:
+                _, evicted = self._sets.popitem(last=False)
+                self.n_bytes -= evicted[2]
+        else:
+            self._sets.move_to_end(key)
+        return(sprite_set[0], sprite_set[1])
+
+_atlas = SpriteAtlas()
+
+def sprite_blits(ants, atlas, scale=1):
+    """Return the (surface, position) of every living ant's sprite, centered at its position (both scaled by scale)."""
+    n_angles = atlas.n_angles
+    angle_scale = n_angles / (2 * math.pi)
+    blits = []
+    for ant in ants:
+        if ant.alive:
+            rotated_surfs, half_sizes = atlas.get_set(ant.team, ant.size * scale)
+            bucket = round(ant.rotation * angle_scale) % n_angles
+            half_width, half_height = half_sizes[bucket]
+            blits.append((rotated_surfs[bucket], (ant.x * scale - half_width, ant.y * scale - half_height)))
+    return(blits)
+
+def draw_ants(screen, battle, arena, atlas=None):
+    """Draw the ants on the screen."""
+    if atlas is None:
+        atlas = _atlas
+
+    # Draw the arena and a border around it
+    screen.blit(arena, (0, 0))
+    pygame.draw.rect(screen, (0, 0, 0), (0, 0, battle.bounds[0], battle.bounds[1]), 1)
+
+    # Draw the ants (their surfaces centered at their positions), all in one blits call
+    screen.blits(sprite_blits(battle.ants, atlas), doreturn=False)
+
+def ant_positions(frame):
+    """Return arrays of the x, y and team of every living ant, and the list of teams the team numbers index."""
+    state = getattr(frame, "state", None)
+    if state is not None:
+        # Array-backed battle, the columns are already there
+        n = state.n_rows
+        alive = state.alive[:n]
+        teams = sorted(state.team_codes, key=state.team_codes.get)
+        return(state.x[:n][alive], state.y[:n][alive], state.team[:n][alive].astype(np.int64), teams)
+    ants = [ant for ant in frame.ants if ant.alive]
+    index = {} # {team: number}
+    team_numbers = [index.setdefault(ant.team, len(index)) for ant in ants]
+    x = np.array([ant.x for ant in ants], dtype=np.float64)
+    y = np.array([ant.y for ant in ants], dtype=np.float64)
+    return(x, y, np.array(team_numbers, dtype=np.int64), list(index))
+
+def fit_scale(bounds, max_size=MAX_WINDOW):
+    """Return the largest scale (up to 1) at which the arena and the stats fit in a window of max_size."""
+    return(min(1, (max_size[0] - PANEL_WIDTH) / bounds[0], max_size[1] / bounds[1]))
+
+class View():
+    """Draws a battle's frames at a scale, remembering what it drew so each frame only updates what changed.
+
+    Ants are drawn as sprites (erasing last frame's) until there are more
+    than lod_ants of them or they'd be smaller than min_sprite_px, then as a
+    density map (if NumPy is installed): each cell takes the colors of the
+    teams in it, mixed by head count, and gets darker the more ants it holds.
+    """
+    def __init__(self, bounds, scale=1, lod_ants=None, min_sprite_px=MIN_SPRITE_PX, atlas=None):
+        self.bounds = tuple(bounds)
+        self.scale = scale
+        self.lod_ants = lod_ants if lod_ants is not None else LOD_ANTS
+        self.min_sprite_px = min_sprite_px
+        self.atlas = atlas if atlas is not None else _atlas
+        self.arena_rect = pygame.Rect(0, 0, math.ceil(bounds[0] * scale), math.ceil(bounds[1] * scale))
+        self.arena = pygame.Surface(self.arena_rect.size) # What's behind the ants
+        self.arena.fill((255, 255, 255))
+        self.mode = None # "sprites" or "density", whichever was drawn last frame (None until the first)
+        self.sprite_rects = [] # Where last frame's sprites were, to be erased
+        self.stats_rect = None # Where last frame's stats were
+        self.density = None # One pixel per density map cell
+        self.scaled_density = None # The same, scaled up to the arena
+
+    @property
+    def window_size(self):
+        return((self.arena_rect.width + PANEL_WIDTH, self.arena_rect.height))
+
+    def uses_density(self, frame):
+        """Return whether a frame is drawn as a density map."""
+        if np is None:
+            return(False)
+        if len(frame.ants) > self.lod_ants:
+            return(True)
+        first_ant = next(iter(frame.ants), None)
+        return(first_ant is not None and first_ant.size * self.scale < self.min_sprite_px)
+
+    def draw(self, screen, frame, profiler=None):
+        """Draw a battle (or a runner.Frame of one) and return the areas of the screen that changed."""
+        dirty = []
+        if self.mode is None:
+            screen.fill((255, 255, 255))
+            dirty.append(screen.get_rect())
+        mode = "density" if self.uses_density(frame) else "sprites"
+        if self.mode == "density" and mode == "sprites":
+            self.sprite_rects = [self.arena_rect] # Erase the whole map
+        self.mode = mode
+        with _phase(profiler, "draw_ants"):
+            screen.set_clip(self.arena_rect) # Ants at the edge don't spill onto the stats
+            if mode == "density":
+                dirty.extend(self.draw_density(screen, frame))
+            else:
+                dirty.extend(self.draw_sprites(screen, frame))
+            screen.set_clip(None)
+        with _phase(profiler, "draw_stats"):
+            dirty.extend(self.draw_stats(screen, frame))
+        return(dirty)
+
+    def draw_sprites(self, screen, frame):
+        erased = self.sprite_rects
+        for rect in erased:
+            screen.blit(self.arena, rect, rect)
+        pygame.draw.rect(screen, (0, 0, 0), self.arena_rect, 1) # Erasing may have cut into the border
+        self.sprite_rects = screen.blits(sprite_blits(frame.ants, self.atlas, self.scale), doreturn=True)
+        if len(erased) + len(self.sprite_rects) > MAX_DIRTY_RECTS:
+            return([self.arena_rect])
+        return(erased + self.sprite_rects)
+
+    def draw_density(self, screen, frame):
+        cell_px = DENSITY_CELL_PX
+        width, height = -(-self.arena_rect.width // cell_px), -(-self.arena_rect.height // cell_px)
+        x, y, team_numbers, teams = ant_positions(frame)
+
+        # Count each team's ants in every cell ([team, cell x, cell y], the way surfarray indexes pixels)
+        cell_x = np.clip((x * (self.scale / cell_px)).astype(np.int64), 0, width - 1)
+        cell_y = np.clip((y * (self.scale / cell_px)).astype(np.int64), 0, height - 1)
+        counts = np.bincount((team_numbers * width + cell_x) * height + cell_y, minlength=len(teams) * width * height)
+        counts = counts.reshape(len(teams), width, height).astype(np.float64)
+        total = counts.sum(axis=0)
+
+        # Mix the teams' colors by head count, then fade from white by how crowded the cell is (log scale)
+        colors = np.array([team_color(team) for team in teams], dtype=np.float64).reshape(-1, 3)
+        mixed = np.tensordot(counts, colors, axes=(0, 0)) / np.maximum(total, 1)[:, :, None]
+        shade = np.where(total > 0, 0.3 + 0.7 * np.log1p(total) / math.log1p(max(total.max(), 1)), 0)
+        pixels = 255 - shade[:, :, None] * (255 - mixed)
+
+        if self.density is None or self.density.get_size() != (width, height):
+            self.density = pygame.Surface((width, height))
+            self.scaled_density = pygame.Surface((width * cell_px, height * cell_px))
+        pygame.surfarray.blit_array(self.density, pixels.astype(np.uint8))
+        pygame.transform.scale(self.density, self.scaled_density.get_size(), self.scaled_density)
+        screen.blit(self.scaled_density, self.arena_rect.topleft)
+        pygame.draw.rect(screen, (0, 0, 0), self.arena_rect, 1)
+        self.sprite_rects = []
+        return([self.arena_rect])
+
+    def draw_stats(self, screen, frame):
+        dirty = []
+        if self.stats_rect is not None:
+            screen.fill((255, 255, 255), self.stats_rect)
+            dirty.append(self.stats_rect)
+        self.stats_rect = draw_stats(screen, frame, left=self.arena_rect.right)
+        dirty.append(self.stats_rect)
+        return(dirty)
+
+def _phase(profiler, name):
+    """Time a phase of drawing with the profiler, if there is one."""
+    if profiler is None:
+        return(contextlib.nullcontext())
+    return(profiler.phase(name))
+
+# Fonts and rendered text are cached, text is only rendered again when it changes
+_fonts = {} # {size: pygame.font.Font}
+_text_surfs = {} # {(text, color, size): pygame.Surface}
+MAX_CACHED_TEXTS = 256
+
+def get_font(size):
+    """Return the HUD font at a size, loading it on first use."""
+    font = _fonts.get(size)
+    if font is None:
+        font = pygame.font.SysFont("Comic Sans", size)
+        _fonts[size] = font
+    return(font)
+
+def text_surf(text, color=(0, 0, 0), size=24):
+    """Return a rendered line of text, reusing the surface if it has been rendered before."""
+    key = (text, color, size)
+    surf = _text_surfs.get(key)
+    if surf is None:
+        if len(_text_surfs) >= MAX_CACHED_TEXTS:
+            _text_surfs.clear() # Old counts aren't coming back
+        surf = get_font(size).render(text, True, color)
+        _text_surfs[key] = surf
+    return(surf)
+
+def team_color(team):
+    """Return the color to write a team's name in (black if pygame doesn't know the name)."""
+    try:
+        return(tuple(pygame.Color(team))[:3])
+    except ValueError:
+        return((0, 0, 0))
+
+def draw_stats(screen, battle, left=None):
+    """Draw each team's population count and the tick (battle can be a runner.Frame), returning the area drawn on.
+
+    They're drawn right of x=left (the right edge of the arena by default).
+    """
+    if left is None:
+        left = battle.bounds[0]
+    rects = []
+    y = 10
+    for team, count in battle.alive_counts.items():
+        rects.append(screen.blit(text_surf(f"{team.capitalize()}: {count}", team_color(team)), (left + 10, y)))
+        y += 30
+
+    # Draw the tick, the battle may be running more than one per frame
+    rects.append(screen.blit(text_surf(f"Tick: {battle.game_tick}"), (left + 10, y + 20)))
+    return(rects[0].unionall(rects[1:]))
+
+def draw_game_over(screen, bounds, winner):
+    """Draw the winner over the arena."""
+    message = text_surf(f"{winner} team wins!", size=100)
+    screen.blit(message, (bounds[0]/2 - message.get_width()/2, bounds[1]/2 - message.get_height()/2))
+
+def draw_frame(screen, frame, view, profiler=None):
+    """Draw a battle (or a runner.Frame of one) with a View, returning the areas to pass to pygame.display.update."""
+    return(view.draw(screen, frame, profiler))
+
+def wait_for_key():
+    """Wait until a key is pressed or the window is closed."""
+    while True:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT or event.type == pygame.KEYDOWN:
+            return()
+
+def run_window(battle, max_ticks=None, ticks_per_frame=1, fps=None, fast_forward=False, threaded=False, scale=None, lod_ants=None):
+    """Simulate the battle in a pygame window.
+
+    Each frame runs ticks_per_frame ticks and then draws the battle, so only
+    every ticks_per_frame'th tick is drawn. fps caps the frame rate (None runs
+    as fast as possible). F toggles fast-forward, which keeps simulating for
+    most of each frame (at least FAST_FORWARD_FPS frames are drawn a second),
+    and space pauses. With threaded=True the battle steps in a background
+    thread (runner.BattleRunner) and the window draws the frames it publishes.
+    The arena is drawn at scale (by default, shrunk to fit MAX_WINDOW) and as
+    a density map past lod_ants ants (LOD_ANTS by default, see View).
+    """
+
+    # Initialize pygame
+    pygame.init()
+    clock = pygame.time.Clock()
+
+    # Draw the screen
+    view = View(battle.bounds, scale=scale if scale is not None else fit_scale(battle.bounds), lod_ants=lod_ants)
+    screen = pygame.display.set_mode(view.window_size)
+
+    if threaded:
+        from runner import BattleRunner
+        runner = BattleRunner(battle, max_ticks=max_ticks, ticks_per_frame=ticks_per_frame)
+        runner.fast_forward = fast_forward
+        runner.start()
+    paused = False
+
+    # Start the pygame loop
+    ticks_run = 0
+    running = True
+    while running:
+
+        # Quit if the window is closed, handle the hotkeys
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key == FAST_FORWARD_KEY:
+                fast_forward = not fast_forward
+            elif event.type == pygame.KEYDOWN and event.key == PAUSE_KEY:
+                paused = not paused
+        if not running:
+            break
+
+        if threaded:
+            runner.fast_forward = fast_forward
+            runner.paused = paused
+            finished = runner.finished
+            frame = runner.take_frame()
+            over, winner = frame.over, frame.winner
+            # Profiling the drawing from here would race with the battle's thread starting ticks
+            dirty = draw_frame(screen, frame, view)
+        else:
+            # Run this frame's ticks
+            frame_start = pygame.time.get_ticks()
+            ticks_this_frame = 0
+            while not paused and not battle.is_over():
+                if max_ticks is not None and ticks_run >= max_ticks:
+                    break
+                if fast_forward:
+                    if pygame.time.get_ticks() - frame_start >= 1000 / FAST_FORWARD_FPS:
+                        break
+                elif ticks_this_frame >= ticks_per_frame:
+                    break
+                battle.step()
+                ticks_run += 1
+                ticks_this_frame += 1
+            over, winner = battle.is_over(), battle.winner()
+            finished = over or (max_ticks is not None and ticks_run >= max_ticks)
+            dirty = draw_frame(screen, battle, view, battle.profiler)
+
+        # Show the winner and wait for input once the battle is over
+        if finished and over:
+            draw_game_over(screen, view.arena_rect.size, winner)
+            pygame.display.flip()
+            wait_for_key()
+            break
+        pygame.display.update(dirty)
+        if finished:
+            break
+
+        # Cap the frame rate (don't spin while paused)
+        if paused:
+            clock.tick(fps or 60)
+        elif fps is not None and not fast_forward:
+            clock.tick(fps)
+
+    if threaded:
+        runner.stop()
+    pygame.quit()
+    return(battle.winner())
+
+def play_replay(replay, ticks_per_frame=1, fps=60, scale=None, lod_ants=None):
+    """Play a replay.Replay in a pygame window.
+
+    Space pauses, F toggles fast-forward (ten times ticks_per_frame), the left
+    and right arrows jump back and forward by one keyframe interval, and
+    home goes back to the start. scale and lod_ants are as for run_window.
+    """
+    pygame.init()
+    clock = pygame.time.Clock()
+    view = View(replay.bounds, scale=scale if scale is not None else fit_scale(replay.bounds), lod_ants=lod_ants)
+    screen = pygame.display.set_mode(view.window_size)
+
+    tick = replay.first_tick
+    paused = False
+    fast_forward = False
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == PAUSE_KEY:
+                    paused = not paused
+                elif event.key == FAST_FORWARD_KEY:
+                    fast_forward = not fast_forward
+                elif event.key == pygame.K_RIGHT:
+                    tick += replay.keyframe_interval
+                elif event.key == pygame.K_LEFT:
+                    tick -= replay.keyframe_interval
+                elif event.key == pygame.K_HOME:
+                    tick = replay.first_tick
+        if not running:
+            break
+        tick = min(max(tick, replay.first_tick), replay.last_tick)
+
+        frame = replay.frame(tick)
+        dirty = draw_frame(screen, frame, view)
+        if frame.over:
+            draw_game_over(screen, view.arena_rect.size, frame.winner)
+            dirty.append(view.arena_rect)
+            view.sprite_rects = [view.arena_rect] # So the next frame erases the message too
+        pygame.display.update(dirty)
+
+        if not paused:
+            tick += ticks_per_frame * (10 if fast_forward else 1)
+            if tick > replay.last_tick:
+                tick = replay.last_tick
+                paused = True # Stay on the last tick until the window is closed
+        clock.tick(fps)
+
+    pygame.quit()
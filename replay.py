@@ -0,0 +1,317 @@
+"""Record battles to compact binary replay files and play them back.
+
+A ReplayRecorder attached to a battle (battle.recorder) is called at the end
+of every tick and appends one record: every living ant's x, y, rotation and
+health, and the messages posted that tick. Values are stored in fixed point
+(1/64 px, 1/65536 of a turn, 1/256 health point), so positions in a replay
+are within 1/128 px of the battle's. Every keyframe_interval ticks the record is
+a keyframe with the absolute values; the records in between only hold what
+changed (ants that died or were added, and per ant deltas from the previous
+tick). Positions are predicted to keep moving as they did the tick before, so
+an ant walking in a straight line stores zeros. Each record's columns are
+byte-shuffled and zlib-compressed.
+
+The file ends with an index of record offsets, so a Replay can memory-map
+the file and jump to any tick by decoding the keyframe before it and at most
+keyframe_interval - 1 deltas. Playing forward one tick only decodes one
+delta. A file whose recording was cut short (no index) is scanned instead.
+
+    battle.recorder = ReplayRecorder("battle.replay")
+    battle.recorder.record(battle) # The starting positions
+    battle.run()
+    battle.recorder.close()
+
+    replay = Replay("battle.replay")
+    frame = replay.frame(1200)
+"""
+
+import json
+import math
+import mmap
+import struct
+import zlib
+from array import array
+from runner import Frame
+
+MAGIC = b"ANTRPLY1"
+INDEX_MAGIC = b"ANTINDEX"
+RECORD_HEADER = struct.Struct("<BqI") # Record kind, tick, compressed payload length
+FOOTER = struct.Struct("<qq8s") # Index offset, number of records, INDEX_MAGIC
+KEYFRAME, DELTA = 0, 1
+
+POSITION_SCALE = 64 # Fixed point steps per pixel
+ROTATION_STEPS = 65536 # Fixed point steps per turn
+HEALTH_SCALE = 256 # Fixed point steps per health point
+
+def quantize(ant):
+    """Return an ant's (x, y, rotation, health) in fixed point."""
+    return((round(ant.x * POSITION_SCALE), round(ant.y * POSITION_SCALE),
+            round(ant.rotation / (2 * math.pi) * ROTATION_STEPS) % ROTATION_STEPS,
+            round(ant.health * HEALTH_SCALE)))
+
+def _wrap_rotation(delta):
+    """Return the shortest signed difference between two fixed point rotations."""
+    return((delta + ROTATION_STEPS // 2) % ROTATION_STEPS - ROTATION_STEPS // 2)
+
+def _shuffle(column):
+    """Return an int32 array's bytes grouped by significance (small deltas compress far better)."""
+    data = column.tobytes()
+    return(b"".join(data[i::4] for i in range(4)))
+
+def _unshuffle(data):
+    """Return the int32 array whose bytes _shuffle grouped."""
+    n = len(data) // 4
+    interleaved = bytearray(len(data))
+    for i in range(4):
+        interleaved[i::4] = data[i * n:(i + 1) * n]
+    return(array("i", bytes(interleaved)))
+
+def _pack_sections(sections):
+    """Join byte strings into one payload, prefixed by their lengths."""
+    header = array("I", [len(sections)] + [len(section) for section in sections]).tobytes()
+    return(header + b"".join(sections))
+
+def _unpack_sections(payload):
+    """Split a payload made by _pack_sections back into its byte strings."""
+    n = array("I", payload[:4])[0]
+    lengths = array("I", payload[4:4 + 4 * n])
+    sections = []
+    offset = 4 + 4 * n
+    for length in lengths:
+        sections.append(payload[offset:offset + length])
+        offset += length
+    return(sections)
+
+def _message_rows(messages):
+    return([[m.team, m.x, m.y, m.content, m.topic] for m in messages])
+
+class ReplayRecorder():
+    """Writes a battle's ticks to a replay file (see the module docstring)."""
+    def __init__(self, path, keyframe_interval=100):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.file = None # Opened when the first tick is recorded
+        self.offsets = array("q") # File offset of every record
+        self.first_tick = None
+
+        self._teams = [] # Team names, ants store their index
+        self._team_codes = {}
+        self._previous = {} # {ant_id: quantized values} as of the last record
+        self._velocities = {} # {ant_id: (dx, dy)} between the last two records (reset at keyframes)
+
+    def _team_code(self, team):
+        if team not in self._team_codes:
+            self._team_codes[team] = len(self._teams)
+            self._teams.append(team)
+        return(self._team_codes[team])
+
+    def _write_header(self, battle):
+        self.file = open(self.path, "wb")
+        header = json.dumps({"seed": battle.seed, "bounds": list(battle.bounds), "keyframe_interval": self.keyframe_interval}).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.first_tick = battle.game_tick
+
+    def record(self, battle):
+        """Append the battle's current tick (and the messages posted at the end of the previous one)."""
+        if self.file is None:
+            self._write_header(battle)
+        ants = [ant for ant in battle.ants if ant.alive]
+        current = {ant.id: quantize(ant) for ant in ants}
+        messages = _message_rows(battle.message_board.sent_during(battle.game_tick - 1))
+        messages_json = json.dumps(messages, default=repr).encode()
+
+        keyframe = len(self.offsets) % self.keyframe_interval == 0
+        if keyframe:
+            # Absolute values, and enough about every ant (and team) to start decoding here
+            ids = array("i", current.keys())
+            team_codes = array("i", [self._team_code(ant.team) for ant in ants])
+            infos = json.dumps({"teams": self._teams, "sizes": [ant.size for ant in ants]}).encode()
+            columns = [array("i", [values[i] for values in current.values()]) for i in range(4)]
+            sections = [ids.tobytes(), team_codes.tobytes(), infos] + [_shuffle(column) for column in columns]
+            velocities = {}
+        else:
+            died = array("i", [ant_id for ant_id in self._previous if ant_id not in current])
+            new_ants = [ant for ant in ants if ant.id not in self._previous]
+            n_teams = len(self._teams)
+            new_team_codes = array("i", [self._team_code(ant.team) for ant in new_ants])
+            infos = json.dumps({"teams": self._teams[n_teams:], "sizes": [ant.size for ant in new_ants]}).encode()
+            previous, previous_velocities = self._previous, self._velocities
+            velocities = {}
+            zero = (0, 0, 0, 0)
+            columns = [array("i"), array("i"), array("i"), array("i")]
+            for ant_id, values in current.items():
+                before = previous.get(ant_id, zero)
+                dx, dy = values[0] - before[0], values[1] - before[1]
+                velocities[ant_id] = (dx, dy)
+                predicted_dx, predicted_dy = previous_velocities.get(ant_id, (0, 0))
+                columns[0].append(dx - predicted_dx)
+                columns[1].append(dy - predicted_dy)
+                columns[2].append(_wrap_rotation(values[2] - before[2]))
+                columns[3].append(values[3] - before[3])
+            new_ids = array("i", [ant.id for ant in new_ants])
+            sections = [died.tobytes(), new_ids.tobytes(), new_team_codes.tobytes(), infos] + [_shuffle(column) for column in columns]
+        sections.append(messages_json)
+
+        payload = zlib.compress(_pack_sections(sections), 6)
+        self.offsets.append(self.file.tell())
+        self.file.write(RECORD_HEADER.pack(KEYFRAME if keyframe else DELTA, battle.game_tick, len(payload)) + payload)
+        self._previous = current
+        self._velocities = velocities
+
+    def close(self):
+        """Write the index and close the file."""
+        if self.file is None:
+            return()
+        index_offset = self.file.tell()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(FOOTER.pack(index_offset, len(self.offsets), INDEX_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ReplayAnt():
+    """An ant as it was at one tick of a replay."""
+    __slots__ = ["id", "team", "size", "x", "y", "rotation", "health", "alive"]
+
+    def __init__(self, id, team, size, x, y, rotation, health):
+        self.id = id
+        self.team = team
+        self.size = size
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.health = health
+        self.alive = True
+
+class Replay():
+    """A memory-mapped replay file that can be read at any tick."""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " isn't a replay file")
+        header_length = struct.unpack_from("<I", self.data, len(MAGIC))[0]
+        header_start = len(MAGIC) + 4
+        header = json.loads(self.data[header_start:header_start + header_length])
+        self.seed = header["seed"]
+        self.bounds = tuple(header["bounds"])
+        self.keyframe_interval = header["keyframe_interval"]
+        self.offsets = self._read_index(header_start + header_length)
+        self.first_tick = RECORD_HEADER.unpack_from(self.data, self.offsets[0])[1] if len(self.offsets) > 0 else 0
+        self.last_tick = self.first_tick + len(self.offsets) - 1
+
+        # The last decoded tick, so playing forward only decodes one delta per tick
+        self._tick = None
+        self._state = None
+
+    def _read_index(self, records_start):
+        """Return the record offsets from the index, or by scanning the records if there is none."""
+        if len(self.data) >= records_start + FOOTER.size:
+            index_offset, n_records, magic = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+            if magic == INDEX_MAGIC:
+                return(array("q", self.data[index_offset:index_offset + 8 * n_records]))
+        offsets = array("q")
+        offset = records_start
+        while offset + RECORD_HEADER.size <= len(self.data):
+            length = RECORD_HEADER.unpack_from(self.data, offset)[2]
+            if offset + RECORD_HEADER.size + length > len(self.data):
+                break # Cut off mid-record
+            offsets.append(offset)
+            offset += RECORD_HEADER.size + length
+        return(offsets)
+
+    def __len__(self):
+        return(len(self.offsets))
+
+    def _read_record(self, i):
+        """Return (kind, tick, sections) of the i'th record."""
+        kind, tick, length = RECORD_HEADER.unpack_from(self.data, self.offsets[i])
+        start = self.offsets[i] + RECORD_HEADER.size
+        return(kind, tick, _unpack_sections(zlib.decompress(self.data[start:start + length])))
+
+    def _apply(self, state, i):
+        """Decode record i on top of the state of the record before it (state is None for a keyframe)."""
+        kind, tick, sections = self._read_record(i)
+        if kind == KEYFRAME:
+            ids = array("i", sections[0])
+            team_codes = array("i", sections[1])
+            infos = json.loads(sections[2])
+            teams = infos["teams"]
+            ants = {ant_id: [teams[code], size] for ant_id, code, size in zip(ids, team_codes, infos["sizes"])}
+            columns = [_unshuffle(section) for section in sections[3:7]]
+            values = {ant_id: list(ant_values) for ant_id, ant_values in zip(ids, zip(*columns))}
+            velocities = {}
+        else:
+            teams, ants, values = state["teams"], dict(state["ants"]), dict(state["values"])
+            previous_velocities = state["velocities"]
+            for ant_id in array("i", sections[0]):
+                del ants[ant_id]
+                del values[ant_id]
+            infos = json.loads(sections[3])
+            teams = teams + infos["teams"]
+            for ant_id, code, size in zip(array("i", sections[1]), array("i", sections[2]), infos["sizes"]):
+                ants[ant_id] = [teams[code], size]
+            columns = [_unshuffle(section) for section in sections[4:8]]
+            new_values, velocities = {}, {}
+            for ant_id, ddx, ddy, drotation, dhealth in zip(ants, *columns):
+                x, y, rotation, health = values.get(ant_id, (0, 0, 0, 0))
+                predicted_dx, predicted_dy = previous_velocities.get(ant_id, (0, 0))
+                dx, dy = predicted_dx + ddx, predicted_dy + ddy
+                velocities[ant_id] = (dx, dy)
+                new_values[ant_id] = [x + dx, y + dy, (rotation + drotation) % ROTATION_STEPS, health + dhealth]
+            values = new_values
+        return({"tick": tick, "teams": teams, "ants": ants, "values": values, "velocities": velocities, "messages": sections[-1]})
+
+    def _state_at(self, tick):
+        """Return the decoded state of a tick, starting from its keyframe unless the cached tick is on the way."""
+        if tick < self.first_tick or tick > self.last_tick:
+            raise IndexError(f"tick {tick} isn't in this replay ({self.first_tick} to {self.last_tick})")
+        i = tick - self.first_tick
+        keyframe = i - i % self.keyframe_interval
+        if self._tick is not None and keyframe <= self._tick - self.first_tick <= i:
+            start, state = self._tick - self.first_tick + 1, self._state
+        else:
+            start, state = keyframe, None
+        for j in range(start, i + 1):
+            state = self._apply(state, j)
+        self._tick, self._state = tick, state
+        return(state)
+
+    def ants(self, tick):
+        """Return the ants alive at a tick as ReplayAnts, in battle order."""
+        state = self._state_at(tick)
+        ants = []
+        for ant_id, (team, size) in state["ants"].items():
+            x, y, rotation, health = state["values"][ant_id]
+            ants.append(ReplayAnt(ant_id, team, size, x / POSITION_SCALE, y / POSITION_SCALE,
+                                  rotation / ROTATION_STEPS * 2 * math.pi, health / HEALTH_SCALE))
+        return(ants)
+
+    def messages(self, tick):
+        """Return the messages posted at the end of the tick before, as [team, x, y, content, topic] lists."""
+        return(json.loads(self._state_at(tick)["messages"]))
+
+    def frame(self, tick):
+        """Return a runner.Frame of a tick (for renderer.draw_frame)."""
+        ants = tuple(self.ants(tick))
+        alive_counts = {team: 0 for team in self._state_at(tick)["teams"]}
+        for ant in ants:
+            alive_counts[ant.team] += 1
+        teams = [team for team, count in alive_counts.items() if count > 0]
+        over = len(teams) <= 1
+        return(Frame(tick, self.bounds, ants, over, teams[0] if len(teams) == 1 else None, alive_counts))
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,80 @@
+"""Run a battle in a background thread that publishes frames for the renderer.
+
+A Frame is an immutable copy of what the renderer draws (where every living
+ant is, whether the battle is over), so the window can draw the latest one
+while the battle carries on stepping. The renderer takes a frame when it's
+ready to draw. Normally the runner waits for that before publishing the next
+one, so the battle advances ticks_per_frame ticks per drawn frame. In
+fast-forward it doesn't wait: it keeps stepping and only publishes a frame
+when the previous one has been taken.
+
+    runner = BattleRunner(battle, ticks_per_frame=10)
+    runner.start()
+    frame = runner.take_frame()
+"""
+
+import threading
+from collections import namedtuple
+
+AntSprite = namedtuple("AntSprite", ["team", "size", "x", "y", "rotation", "alive"])
+Frame = namedtuple("Frame", ["game_tick", "bounds", "ants", "over", "winner", "alive_counts"])
+
+def take_frame(battle):
+    """Return a Frame of the battle as it is now."""
+    ants = tuple(AntSprite(ant.team, ant.size, ant.x, ant.y, ant.rotation, True) for ant in battle.ants if ant.alive)
+    over = battle.is_over()
+    return(Frame(battle.game_tick, battle.bounds, ants, over, battle.winner() if over else None, battle.alive_counts))
+
+class BattleRunner(threading.Thread):
+    """Steps a battle in a background thread (see the module docstring)."""
+    def __init__(self, battle, max_ticks=None, ticks_per_frame=1):
+        super().__init__(daemon=True)
+        self.battle = battle
+        self.max_ticks = max_ticks
+        self.ticks_per_frame = ticks_per_frame
+        self.fast_forward = False
+        self.paused = False
+        self.finished = False # Set once the battle is over or max_ticks have run
+
+        self.frame = take_frame(battle)
+        self._frame_taken = threading.Event()
+        self._stopping = threading.Event()
+
+    def take_frame(self):
+        """Return the latest frame and let the runner publish the next one."""
+        frame = self.frame
+        self._frame_taken.set()
+        return(frame)
+
+    def publish(self):
+        self._frame_taken.clear()
+        self.frame = take_frame(self.battle)
+
+    def stop(self):
+        """Stop stepping (after the current tick) and wait for the thread to finish."""
+        self._stopping.set()
+        self._frame_taken.set()
+        self.join()
+
+    def run(self):
+        ticks_run = 0
+        while not self._stopping.is_set():
+            if self.paused:
+                self._stopping.wait(0.01)
+                continue
+            if self.battle.is_over() or (self.max_ticks is not None and ticks_run >= self.max_ticks):
+                break
+            self.battle.step()
+            ticks_run += 1
+
+            if self.fast_forward:
+                if self._frame_taken.is_set():
+                    self.publish()
+            elif ticks_run % self.ticks_per_frame == 0:
+                # Wait for the renderer, checking every so often whether we've been stopped or fast-forwarded
+                while not self._frame_taken.wait(0.05):
+                    if self._stopping.is_set() or self.fast_forward:
+                        break
+                self.publish()
+        self.publish()
+        self.finished = True
@@ -0,0 +1,384 @@
+"""Run antgorithms within a CPU time budget, so slow or stuck ones can't stall a battle.
+
+A BudgetExecutor (set it as battle.executor) times every antgorithm call
+with time.thread_time(). An ant whose antgorithm uses more than ant_budget
+seconds of CPU does nothing that tick: its instruction and broadcasts are
+dropped (memory changes are kept). Once a team's ants have used team_budget
+seconds in a tick, the rest of them do nothing without being run. An
+antgorithm still running after hard_limit seconds is interrupted, which
+needs a SIGVTALRM timer, so only happens on Unix when the battle runs in the
+main thread. Antgorithms that raise or return a bad instruction (anything but
+walk, turn, strafe, bite and block, or an angle or distance that isn't a
+finite number) also do nothing that tick, the battle carries on.
+
+A SandboxExecutor does the same in worker processes (see parallel.py), each
+worker getting an equal share of every team's budget. A worker that doesn't
+answer within tick_timeout seconds (stuck somewhere the timer can't
+interrupt, or crashed) is killed and started again, and the ants it was
+running do nothing that tick. The restarted worker gets its ants' memory
+from the main process, but their rngs go back to the state they were in
+when the main process last saw them (when they were first sent).
+
+Both keep a BudgetStats for every team in executor.team_stats, with counts
+of overruns, skipped ants, timeouts, errors and worker restarts and a
+histogram of antgorithm latencies.
+
+    battle.executor = BudgetExecutor(ant_budget=0.001, team_budget=0.05)
+    battle.run()
+    print(battle.executor.report())
+
+Budgets are CPU time, so they're fairer than wall time on a busy machine,
+but a battle where ants overrun can still come out differently from run to
+run.
+"""
+
+import bisect
+import math
+import multiprocessing
+import pickle
+import signal
+import threading
+import time
+import traceback
+from models import Battle
+from instructions import NOOP, InstructionBuffer
+from parallel import ParallelExecutor, make_snapshot, update_mirror, run_shard, shard_rng_states
+
+# What happened to an ant's antgorithm call
+OK = "ok"
+OVERRUN = "overrun" # Used more than ant_budget, instruction dropped
+SKIPPED = "skipped" # Not run, the team budget was spent
+TIMEOUT = "timeout" # Interrupted at hard_limit
+ERROR = "error" # Raised an exception or returned a bad instruction
+
+# Upper bounds of the latency histogram's buckets, in seconds
+LATENCY_BUCKETS = [1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0]
+
+class AntgorithmTimeout(BaseException):
+    """Raised in an antgorithm that's still running at the hard limit (a BaseException, so `except Exception` doesn't swallow it)."""
+
+def _raise_timeout(signum, frame):
+    raise AntgorithmTimeout()
+
+class LatencyHistogram():
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # The last bucket is everything slower
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.n += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket holding the q-th percentile (the max for the last bucket)."""
+        if self.n == 0:
+            return(0.0)
+        rank = q / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return(min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max)
+        return(self.max)
+
+    def mean(self):
+        return(self.total / self.n if self.n else 0.0)
+
+class BudgetStats():
+    """What happened to one team's antgorithm calls."""
+    def __init__(self):
+        self.calls = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.restarts = 0 # Workers killed while running one of the team's ants
+        self.latency = LatencyHistogram() # CPU time of every call that ran
+
+    def record(self, seconds, outcome):
+        if outcome == SKIPPED:
+            self.skipped += 1
+            return
+        self.calls += 1
+        self.latency.add(seconds)
+        if outcome == OVERRUN:
+            self.overruns += 1
+        elif outcome == TIMEOUT:
+            self.timeouts += 1
+        elif outcome == ERROR:
+            self.errors += 1
+
+    def summary(self):
+        return({
+            "calls": self.calls,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "restarts": self.restarts,
+            "mean_us": self.latency.mean() * 1e6,
+            "p50_us": self.latency.percentile(50) * 1e6,
+            "p99_us": self.latency.percentile(99) * 1e6,
+            "max_us": self.latency.max * 1e6,
+            "latency_buckets": self.latency.counts,
+        })
+
+class Budget():
+    """Runs antgorithms within a CPU time budget (see the module docstring), in whichever process it's in."""
+    def __init__(self, ant_budget=0.005, team_budget=None, hard_limit=0.1):
+        self.ant_budget = ant_budget
+        self.team_budget = team_budget
+        self.hard_limit = hard_limit
+        self.spent = {} # {team: CPU seconds used this tick}
+        self._previous_handler = None
+        self.preempt = False # Whether the hard limit is enforced
+
+    def install(self):
+        """Set up the hard limit timer's signal handler, if this thread can."""
+        can_preempt = hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+        if self.hard_limit is not None and can_preempt and not self.preempt:
+            self._previous_handler = signal.signal(signal.SIGVTALRM, _raise_timeout)
+            self.preempt = True
+
+    def uninstall(self):
+        if self.preempt:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            signal.signal(signal.SIGVTALRM, self._previous_handler)
+            self.preempt = False
+
+    def start_tick(self):
+        self.spent.clear()
+
+    def run(self, ant):
+        """Run an ant's antgorithm and return (instruction, CPU seconds, outcome), the instruction being NOOP unless the outcome is OK."""
+        team = ant.team
+        if self.team_budget is not None and self.spent.get(team, 0.0) >= self.team_budget:
+            return(NOOP, 0.0, SKIPPED)
+        queue = ant.battle.message_queue
+        sent = len(queue)
+        start = time.thread_time()
+        try:
+            try:
+                if self.preempt:
+                    # Keeps firing every hard_limit in case the antgorithm catches the first one
+                    signal.setitimer(signal.ITIMER_VIRTUAL, self.hard_limit, self.hard_limit)
+                instruction = ant.antgorithm(ant)
+            finally:
+                if self.preempt:
+                    signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+            outcome = OK
+        except AntgorithmTimeout:
+            instruction, outcome = NOOP, TIMEOUT
+        except Exception:
+            instruction, outcome = NOOP, ERROR
+        seconds = time.thread_time() - start
+        self.spent[team] = self.spent.get(team, 0.0) + seconds
+        if outcome == OK and seconds > self.ant_budget:
+            instruction, outcome = NOOP, OVERRUN
+        if outcome == OK and not _good_instruction(instruction):
+            instruction, outcome = NOOP, ERROR
+        if outcome != OK:
+            del queue[sent:] # Drop its broadcasts
+        return(instruction, seconds, outcome)
+
+def _good_slots(queue, ant_id):
+    """Whether an ant's queued angle is finite and its distance finite or the default (the buffer only takes numbers, see instructions.py)."""
+    return(math.isfinite(queue.angles[ant_id]) and not math.isinf(queue.distances[ant_id]))
+
+_check_buffer = InstructionBuffer(1)
+
+def _good_instruction(instruction):
+    """Whether an instruction would queue without being turned into NOOP (tried in a scratch buffer)."""
+    try:
+        _check_buffer[0] = instruction
+        return(_check_buffer.calls.pop(0, None) is None and _good_slots(_check_buffer, 0))
+    except Exception:
+        return(False)
+    finally:
+        _check_buffer.clear()
+
+def _queue_instruction(battle, ant, instruction, outcome):
+    """Queue an ant's instruction, turning a bad one into NOOP, and return the outcome.
+
+    Only walk, turn, strafe, bite and block with finite numbers for their
+    angle and distance are allowed, a method tuple that would call anything
+    else on the ant (see instructions.py) is bad too.
+    """
+    queue = battle.instruction_queue
+    try:
+        queue[ant.id] = instruction
+        if queue.calls.pop(ant.id, None) is None and _good_slots(queue, ant.id):
+            return(outcome)
+    except (ValueError, TypeError, IndexError, KeyError):
+        pass
+    queue[ant.id] = NOOP
+    return(ERROR)
+
+class _BudgetReports():
+    """Team stats and reports shared by both executors."""
+    def team(self, team):
+        stats = self.team_stats.get(team)
+        if stats is None:
+            stats = self.team_stats[team] = BudgetStats()
+        return(stats)
+
+    def summary(self):
+        """Return {team: counts and latencies} as plain data."""
+        return({team: stats.summary() for team, stats in self.team_stats.items()})
+
+    def report(self):
+        """Return a table of every team's overruns and antgorithm latencies."""
+        lines = [f"{'team':>16} {'calls':>9} {'p50 us':>8} {'p99 us':>8} {'max us':>9} {'overruns':>9} {'skipped':>8} {'timeouts':>9} {'errors':>7} {'restarts':>9}"]
+        for team, stats in self.team_stats.items():
+            s = stats.summary()
+            lines.append(f"{str(team):>16} {s['calls']:>9} {s['p50_us']:>8.0f} {s['p99_us']:>8.0f} {s['max_us']:>9.0f} "
+                         f"{s['overruns']:>9} {s['skipped']:>8} {s['timeouts']:>9} {s['errors']:>7} {s['restarts']:>9}")
+        return("\n".join(lines))
+
+class BudgetExecutor(_BudgetReports):
+    """Runs a battle's antgorithms in this process within a CPU time budget (set it as battle.executor)."""
+    def __init__(self, ant_budget=0.005, team_budget=None, hard_limit=0.1):
+        self.budget = Budget(ant_budget, team_budget, hard_limit)
+        self.team_stats = {} # {team: BudgetStats}
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run_antgorithms(self, battle):
+        """Run every live ant's antgorithm within the budget and queue the instructions."""
+        budget = self.budget
+        budget.install() # Only does something the first time
+        budget.start_tick()
+        team_antgorithms = battle.team_antgorithms
+        battle.start_sensing()
+        try:
+            for ant in battle.ants:
+                if ant.alive and ant.team not in team_antgorithms:
+                    instruction, seconds, outcome = budget.run(ant)
+                    outcome = _queue_instruction(battle, ant, instruction, outcome)
+                    self.team(ant.team).record(seconds, outcome)
+        finally:
+            battle.stop_sensing()
+
+    def close(self):
+        self.budget.uninstall()
+
+def _sandbox_worker_main(connection, worker_index, n_workers, ant_budget, team_budget, hard_limit, current):
+    """Serve ticks like parallel._worker_main, running antgorithms within the budget (current.value is the order of the ant running)."""
+    mirror = Battle(seed=0)
+    mirror_ants = {} # {order: Ant}
+    skip_teams = set()
+    budget = Budget(ant_budget, team_budget, hard_limit)
+    budget.install() # A worker is its process's main thread
+
+    def run_antgorithm(ant):
+        current.value = ant._order
+        instruction, seconds, outcome = budget.run(ant)
+        return(instruction, (seconds, outcome))
+
+    while True:
+        command, payload = pickle.loads(connection.recv_bytes())
+        if command == "stop":
+            connection.send_bytes(pickle.dumps(shard_rng_states(mirror, worker_index, n_workers, skip_teams), protocol=pickle.HIGHEST_PROTOCOL))
+            break
+        try:
+            update_mirror(mirror, mirror_ants, payload)
+            skip_teams = set(payload["team_antgorithm_teams"])
+            budget.start_tick()
+            reply = ("ok", run_shard(mirror, worker_index, n_workers, skip_teams, run_antgorithm=run_antgorithm))
+            current.value = -1
+        except Exception:
+            reply = ("error", traceback.format_exc())
+        connection.send_bytes(pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL))
+    connection.close()
+
+class SandboxExecutor(ParallelExecutor, _BudgetReports):
+    """Runs a battle's antgorithms within a CPU time budget in worker processes, restarting any that get stuck (set it as battle.executor)."""
+    worker_main = staticmethod(_sandbox_worker_main)
+
+    def __init__(self, n_workers=None, ant_budget=0.005, team_budget=None, hard_limit=0.1, tick_timeout=2.0):
+        self.ant_budget = ant_budget
+        self.team_budget = team_budget
+        self.hard_limit = hard_limit
+        self.tick_timeout = tick_timeout
+        self.team_stats = {} # {team: BudgetStats}
+        self._current = {} # {worker index: shared order of the ant it's running}
+        self._restarted = set() # Workers that need every ant in their next snapshot
+        super().__init__(n_workers)
+
+    def _worker_args(self, worker_index):
+        team_budget = self.team_budget / self.n_workers if self.team_budget is not None else None
+        self._current[worker_index] = multiprocessing.Value("q", -1, lock=False)
+        return((worker_index, self.n_workers, self.ant_budget, team_budget, self.hard_limit, self._current[worker_index]))
+
+    def _restart_worker(self, worker_index, ants_by_order):
+        """Kill a stuck (or dead) worker, blame the team of the ant it was running and start a new one."""
+        ant = ants_by_order.get(self._current[worker_index].value)
+        if ant is not None:
+            self.team(ant.team).restarts += 1
+        self.processes[worker_index].kill()
+        self.processes[worker_index].join()
+        self.connections[worker_index].close()
+        self._start_worker(worker_index)
+        self._restarted.add(worker_index)
+
+    def run_antgorithms(self, battle):
+        """Run every live ant's antgorithm in the workers within the budget and queue the instructions (in battle order)."""
+        if self.battle is None:
+            self.battle = battle
+        elif self.battle is not battle:
+            raise ValueError("A SandboxExecutor can only run one battle")
+
+        ants = [ant for ant in battle.ants if ant.alive]
+        new_ants = [ant for ant in ants if ant._order not in self._sent_orders]
+        payload = pickle.dumps(("tick", make_snapshot(battle, ants, new_ants)), protocol=pickle.HIGHEST_PROTOCOL)
+        if self._restarted:
+            # Restarted workers haven't seen any ants yet
+            full_payload = pickle.dumps(("tick", make_snapshot(battle, ants, ants)), protocol=pickle.HIGHEST_PROTOCOL)
+        self._sent_orders.update(ant._order for ant in new_ants)
+        for worker_index, connection in enumerate(self.connections):
+            connection.send_bytes(full_payload if worker_index in self._restarted else payload)
+        self._restarted.clear()
+
+        ants_by_order = {ant._order: ant for ant in ants}
+        results = {}
+        errors = []
+        deadline = time.perf_counter() + self.tick_timeout
+        for worker_index, connection in enumerate(self.connections):
+            try:
+                if not connection.poll(max(deadline - time.perf_counter(), 0)):
+                    raise TimeoutError()
+                status, reply = pickle.loads(connection.recv_bytes())
+            except (TimeoutError, EOFError, OSError):
+                self._restart_worker(worker_index, ants_by_order)
+                continue
+            if status == "error":
+                errors.append(reply)
+                continue
+            for result in reply:
+                results[result[0]] = result
+        if len(errors) > 0:
+            raise RuntimeError("A sandbox worker process failed:\n" + errors[0])
+
+        for ant in ants:
+            if ant.team in battle.team_antgorithms:
+                continue
+            if ant._order not in results:
+                battle.instruction_queue[ant.id] = NOOP # Its worker was restarted
+                continue
+            _, instruction, changed, removed, broadcasts, seconds, outcome = results[ant._order]
+            for content, topic in broadcasts:
+                ant.broadcast(content, topic=topic)
+            ant.memory.update(changed)
+            for k in removed:
+                del ant.memory[k]
+            outcome = _queue_instruction(battle, ant, instruction, outcome)
+            self.team(ant.team).record(seconds, outcome)
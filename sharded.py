@@ -0,0 +1,458 @@
+"""Run a big battle across worker processes, one per tile of the arena.
+
+The arena is cut into a grid of tiles and each worker process owns the ants
+on its tile. A worker also keeps ghosts: copies of the ants on other tiles
+that are within the halo (the largest smell_range or bite_range) of its own,
+which its ants can sense and bite but which it never moves. Every tick takes
+four rounds, with the main process passing packets between the workers:
+
+    1. sense: run the antgorithms and move. Ants that left the tile are
+       sent to their new one, and broadcasts to every tile within the halo.
+    2. arrive: take in the ants that arrived and send ghosts of the ants
+       near the border to the tiles next to it.
+    3. bite: resolve bites against the new ghosts and send each hit to the
+       tile that owns the bitten ant.
+    4. hurt: deal the damage, post the tick's messages and send the ghosts
+       for the next tick.
+
+Everything that depends on order (what sense returns, which ant gets bitten,
+who gets the kill, what receive returns) goes by battle order, so a seeded
+battle plays out exactly as it does in one process. Team health totals are
+added up tile by tile, so they can differ in the last few bits.
+
+    with ShardedBattle(battle, tiles=(4, 4)) as sharded:
+        sharded.run(max_ticks=1000)
+    print(battle.winner()) # Closing copies everything back to the battle
+
+Like with parallel.ParallelExecutor, antgorithms should only affect the
+battle through their returned instruction, broadcast(), self.memory and
+self.rng, and only look at what's around them (plus battle.bounds and
+battle.game_tick). Array-backed battles, team antgorithms, executors,
+profilers and recorders aren't supported.
+"""
+
+import math
+import multiprocessing
+import pickle
+import traceback
+from models import Battle, Ant, TeamStats, STAT_NAMES
+from parallel import _make_mirror_message
+from spatial import SpatialGrid
+
+HEALTH = STAT_NAMES.index("health")
+
+class Tiling():
+    """Cuts the arena into nx by ny tiles (ants outside the arena belong to the nearest tile)."""
+    def __init__(self, bounds, tiles, halo):
+        self.nx, self.ny = tiles
+        self.tile_width = bounds[0] / self.nx
+        self.tile_height = bounds[1] / self.ny
+        self.halo = halo
+
+    def __len__(self):
+        return(self.nx * self.ny)
+
+    def _column(self, x):
+        return(min(max(math.floor(x / self.tile_width), 0), self.nx - 1))
+
+    def _row(self, y):
+        return(min(max(math.floor(y / self.tile_height), 0), self.ny - 1))
+
+    def tile_of(self, x, y):
+        """Return the index of the tile that owns the point (x, y)."""
+        return(self._row(y) * self.nx + self._column(x))
+
+    def interior(self, index):
+        """Return (min_x, min_y, max_x, max_y) of the part of a tile that's outside every other tile's halo."""
+        column, row = index % self.nx, index // self.nx
+        min_x = -math.inf if column == 0 else column * self.tile_width + self.halo
+        max_x = math.inf if column == self.nx - 1 else (column + 1) * self.tile_width - self.halo
+        min_y = -math.inf if row == 0 else row * self.tile_height + self.halo
+        max_y = math.inf if row == self.ny - 1 else (row + 1) * self.tile_height - self.halo
+        return((min_x, min_y, max_x, max_y))
+
+    def tiles_near(self, x, y):
+        """Return the index of every tile within the halo of the point (x, y), its own included."""
+        halo = self.halo
+        columns = range(self._column(x - halo), self._column(x + halo) + 1)
+        return([row * self.nx + column for row in range(self._row(y - halo), self._row(y + halo) + 1) for column in columns])
+
+def _pack_ant(ant, battle):
+    """Return everything a tile needs to take over an ant (including a bite or block it has queued)."""
+    return((ant._order, ant.id, ant.team, tuple(getattr(ant, s) for s in STAT_NAMES), ant.x, ant.y, ant.rotation,
+            ant.memory, ant._rng, ant.antgorithm, battle.attack_queue.get(ant), battle.block_queue.get(ant)))
+
+def _pack_ghost(ant):
+    return((ant._order, ant.id, ant.team, tuple(getattr(ant, s) for s in STAT_NAMES), ant.x, ant.y, ant.rotation))
+
+def _pack_message(message):
+    return((message._order, message.team, message.x, message.y, message.content, message.topic, message.tick))
+
+def _new_ant(battle, order, id, team, stats, x, y, rotation):
+    """Make an Ant without adding it to the battle or assigning it a new id or order."""
+    ant = Ant.__new__(Ant, battle)
+    ant.id = id
+    ant.team = team
+    ant.alive = True
+    for s, value in zip(STAT_NAMES, stats):
+        setattr(ant, s, value)
+    ant.x, ant.y, ant.rotation = x, y, rotation
+    ant.memory = {}
+    ant._rng = None
+    ant.antgorithm = None
+    ant.battle = battle
+    ant._order = order
+    return(ant)
+
+class Tile():
+    """A worker's tile: a Battle of the ants it owns, plus ghosts of the ones near it."""
+    def __init__(self, index, tiling, seed, bounds, game_tick, teams, cell_size):
+        self.index = index
+        self.tiling = tiling
+        self.battle = Battle(seed=seed) # The same seed, so the ants' generators come out the same
+        self.battle.bounds = bounds
+        self.battle.game_tick = game_tick
+        self.battle.ant_grid = SpatialGrid(cell_size=cell_size)
+        self.battle.message_board.cell_size = cell_size
+        for team in teams:
+            self.battle.team_stats[team] = TeamStats() # Kills can be credited to a team with no ants here
+        self.interior = tiling.interior(index) # Ants in here aren't anyone else's ghosts
+        self.owned = {} # {order: Ant} for the living ants on this tile
+        self.ghosts = {} # {order: Ant} for the other tiles' ants within the halo
+        self.messages = [] # Records of this tick's messages within the halo, posted at the end of the tick
+
+    def add_ant(self, record):
+        order, id, team, stats, x, y, rotation, memory, rng, antgorithm, attack, block = record
+        battle = self.battle
+        if order in self.ghosts:
+            battle.ant_grid.remove(self.ghosts.pop(order))
+        ant = _new_ant(battle, order, id, team, stats, x, y, rotation)
+        ant.memory = memory
+        ant._rng = rng
+        ant.antgorithm = antgorithm
+        battle.ants.append(ant)
+        battle.ant_grid.insert(ant)
+        battle.count_ant(ant)
+        if attack is not None:
+            battle.attack_queue[ant] = attack
+        if block is not None:
+            battle.block_queue[ant] = block
+        self.owned[order] = ant
+
+    def remove_ant(self, ant):
+        """Take an ant that has left the tile out of the battle (without killing it)."""
+        battle = self.battle
+        battle.ants.remove(ant)
+        battle.ant_grid.remove(ant)
+        battle.attack_queue.pop(ant, None)
+        battle.block_queue.pop(ant, None)
+        stats = battle.team_stats[ant.team]
+        stats.alive -= 1
+        stats.health -= ant.health
+        del self.owned[ant._order]
+
+    def set_ghosts(self, records):
+        """Replace the ghosts with the latest ones from the other tiles."""
+        grid = self.battle.ant_grid
+        ghosts = self.ghosts
+        seen = set()
+        for order, id, team, stats, x, y, rotation in records:
+            ghost = ghosts.get(order)
+            if ghost is None:
+                ghost = ghosts[order] = _new_ant(self.battle, order, id, team, stats, x, y, rotation)
+                grid.insert(ghost)
+            else:
+                ghost.x, ghost.y, ghost.rotation, ghost.health = x, y, rotation, stats[HEALTH]
+                grid.move(ghost)
+            seen.add(order)
+        for order in [order for order in ghosts if order not in seen]:
+            grid.remove(ghosts.pop(order))
+
+    def ghost_packets(self):
+        """Return {tile: [ghost records]} for the owned ants within the halo of other tiles."""
+        packets = {}
+        min_x, min_y, max_x, max_y = self.interior
+        for ant in self.battle.ants:
+            x, y = ant.x, ant.y
+            if min_x <= x < max_x and min_y <= y < max_y:
+                continue
+            for tile in self.tiling.tiles_near(x, y):
+                if tile != self.index:
+                    packets.setdefault(tile, []).append(_pack_ghost(ant))
+        return(packets)
+
+    def setup(self, payload):
+        ants, messages = payload
+        self.battle.message_board.load([_make_mirror_message(self.battle, *record) for record in messages])
+        for record in ants:
+            self.add_ant(record)
+        return(self.ghost_packets())
+
+    def sense(self, ghosts):
+        """Round 1: run the antgorithms and move, then return (emigrants, messages) packets."""
+        battle = self.battle
+        self.set_ghosts(ghosts)
+        queue = battle.message_queue
+        battle.start_sensing()
+        try:
+            for ant in battle.ants:
+                start = len(queue)
+                battle.instruction_queue[ant.id] = ant.antgorithm(ant)
+                for seq in range(start, len(queue)):
+                    queue[seq]._order = (ant._order, seq - start) # The order they'd have been sent in one process
+        finally:
+            battle.stop_sensing()
+        battle.resolve_instructions()
+
+        emigrants = {}
+        for ant in [ant for ant in battle.ants if self.tiling.tile_of(ant.x, ant.y) != self.index]:
+            emigrants.setdefault(self.tiling.tile_of(ant.x, ant.y), []).append(_pack_ant(ant, battle))
+            self.remove_ant(ant)
+        messages = {}
+        for message in queue:
+            record = _pack_message(message)
+            for tile in self.tiling.tiles_near(message.x, message.y):
+                messages.setdefault(tile, []).append(record)
+        battle.message_queue = []
+        return((emigrants, messages))
+
+    def arrive(self, payload):
+        """Round 2: take in the ants that moved here and return ghost packets."""
+        immigrants, messages = payload
+        for record in immigrants:
+            self.add_ant(record)
+        self.messages = messages
+        return(self.ghost_packets())
+
+    def bite(self, ghosts):
+        """Round 3: resolve the owned ants' bites and return {tile: [(target order, damage, attacker order, attacker team)]}."""
+        battle = self.battle
+        self.set_ghosts(ghosts)
+        hits = {}
+        for attacker, damage in battle.attack_queue.items():
+            targets = [ant for ant in attacker.attackable(return_objects=True) if ant.team != attacker.team]
+            if len(targets) > 0:
+                target = targets[0] # Like Battle.resolve_attacks, the first in battle order
+                hits.setdefault(self.tiling.tile_of(target.x, target.y), []).append((target._order, damage, attacker._order, attacker.team))
+        battle.attack_queue.clear()
+        return(hits)
+
+    def hurt(self, hits):
+        """Round 4: deal the damage, post the messages and return (team stats, ghost packets)."""
+        battle = self.battle
+        hits.sort(key=lambda hit: hit[2]) # Attack order, which decides who gets the kill
+        damage, first_biters = {}, {}
+        for target, amount, _, team in hits:
+            if target in damage:
+                damage[target] += amount
+            else:
+                damage[target] = amount
+                first_biters[target] = team
+        for target, amount in damage.items():
+            ant = self.owned[target]
+            ant.suffer(amount - battle.block_queue.get(ant, 0), killer_team=first_biters[target])
+            if not ant.alive:
+                del self.owned[target]
+
+        messages = [_make_mirror_message(battle, *record) for record in self.messages]
+        messages.sort(key=lambda message: message._order)
+        battle.message_board.post(messages, battle.game_tick)
+        self.messages = []
+        battle.game_tick += 1
+        stats = {team: (stats.alive, stats.health, stats.kills) for team, stats in battle.team_stats.items()}
+        return((stats, self.ghost_packets()))
+
+    def collect(self, payload):
+        """Return (ant records, message records) for everything owned by this tile."""
+        battle = self.battle
+        ants = [_pack_ant(ant, battle) for ant in battle.ants]
+        messages = [_pack_message(message) for message in battle.messages if self.tiling.tile_of(message.x, message.y) == self.index]
+        return((ants, messages))
+
+def _worker_main(connection):
+    """Serve rounds for one tile until told to stop."""
+    tile = None
+    while True:
+        command, payload = pickle.loads(connection.recv_bytes())
+        if command == "stop":
+            break
+        try:
+            if command == "setup":
+                tile = Tile(**payload["tile"])
+                reply = ("ok", tile.setup(payload["contents"]))
+            else:
+                reply = ("ok", getattr(tile, command)(payload))
+        except Exception:
+            reply = ("error", traceback.format_exc())
+        connection.send_bytes(pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL))
+    connection.close()
+
+def _route(packets_per_tile, n_tiles):
+    """Turn every tile's {destination: [items]} into one list of items per destination."""
+    routed = [[] for _ in range(n_tiles)]
+    for packets in packets_per_tile:
+        for tile, items in packets.items():
+            routed[tile].extend(items)
+    return(routed)
+
+class ShardedBattle():
+    """Steps a battle in worker processes, one per tile (see the module docstring)."""
+    def __init__(self, battle, tiles=(2, 2)):
+        if battle.state is not None or battle.team_antgorithms:
+            raise ValueError("Sharded battles don't support array_state or team antgorithms")
+        if battle.executor is not None or battle.profiler is not None or battle.recorder is not None:
+            raise ValueError("Sharded battles don't support executors, profilers or recorders")
+        self.battle = battle
+        self.seed = battle.seed
+        self.game_tick = battle.game_tick
+        self.team_stats = {}
+        for team, stats in battle.team_stats.items():
+            self.team_stats[team] = TeamStats()
+            self.team_stats[team].alive, self.team_stats[team].health, self.team_stats[team].kills = stats.alive, stats.health, stats.kills
+
+        ants = list(battle.ants)
+        halo = max([max(ant.smell_range, ant.bite_range) for ant in ants], default=0)
+        self.tiling = Tiling(battle.bounds, tiles, halo)
+        n_tiles = len(self.tiling)
+        tile_ants = [[] for _ in range(n_tiles)]
+        for ant in ants:
+            tile_ants[self.tiling.tile_of(ant.x, ant.y)].append(_pack_ant(ant, battle))
+        tile_messages = [[] for _ in range(n_tiles)]
+        for message in battle.messages:
+            for tile in self.tiling.tiles_near(message.x, message.y):
+                tile_messages[tile].append(_pack_message(message))
+
+        self.connections = []
+        self.processes = []
+        for _ in range(n_tiles):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker_main, args=(child_connection,), daemon=True)
+            process.start()
+            child_connection.close()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+        cell_size = battle.ant_grid.cell_size if battle.ant_grid is not None else 100
+        setups = [{"tile": {"index": index, "tiling": self.tiling, "seed": battle.seed, "bounds": battle.bounds,
+                            "game_tick": battle.game_tick, "teams": list(battle.team_stats), "cell_size": cell_size},
+                   "contents": (tile_ants[index], tile_messages[index])} for index in range(n_tiles)]
+        self._ghosts = _route(self._round("setup", setups), n_tiles) # For the first tick
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _round(self, command, payloads):
+        """Send each tile its payload and return their replies (in tile order)."""
+        for connection, payload in zip(self.connections, payloads):
+            connection.send_bytes(pickle.dumps((command, payload), protocol=pickle.HIGHEST_PROTOCOL))
+        replies, errors = [], []
+        for connection in self.connections:
+            status, reply = pickle.loads(connection.recv_bytes())
+            if status == "error":
+                errors.append(reply)
+            replies.append(reply)
+        if len(errors) > 0:
+            raise RuntimeError("A tile failed in a worker process:\n" + errors[0])
+        return(replies)
+
+    def _update_stats(self, stats_per_tile):
+        for stats in self.team_stats.values():
+            stats.alive, stats.health, stats.kills = 0, 0, 0
+        for tile_stats in stats_per_tile:
+            for team, (alive, health, kills) in tile_stats.items():
+                stats = self.team_stats.setdefault(team, TeamStats())
+                stats.alive += alive
+                stats.health += health
+                stats.kills += kills
+
+    def step(self):
+        """Run one game tick across the tiles."""
+        n_tiles = len(self.tiling)
+        replies = self._round("sense", self._ghosts)
+        immigrants = _route([emigrants for emigrants, _ in replies], n_tiles)
+        messages = _route([messages for _, messages in replies], n_tiles)
+        ghosts = _route(self._round("arrive", list(zip(immigrants, messages))), n_tiles)
+        hits = _route(self._round("bite", ghosts), n_tiles)
+        replies = self._round("hurt", hits)
+        self._update_stats([stats for stats, _ in replies])
+        self._ghosts = _route([ghosts for _, ghosts in replies], n_tiles)
+        self.game_tick += 1
+
+    @property
+    def alive_counts(self):
+        """{team: living ants} for every team that has been in the battle."""
+        return({team: stats.alive for team, stats in self.team_stats.items()})
+
+    def teams_alive(self):
+        """Return the set of teams that still have living ants."""
+        return(set([team for team, stats in self.team_stats.items() if stats.alive > 0]))
+
+    def is_over(self):
+        """Return True if at most one team is left."""
+        return(len(self.teams_alive()) <= 1)
+
+    def winner(self):
+        """Return the winning team (or None if the battle isn't over or nobody survived)."""
+        teams = self.teams_alive()
+        if len(teams) == 1:
+            return(teams.pop())
+        return(None)
+
+    def run(self, max_ticks=None):
+        """Step the battle until it's over (or max_ticks more ticks have run) and return the winner."""
+        ticks_run = 0
+        while not self.is_over():
+            if max_ticks is not None and ticks_run >= max_ticks:
+                break
+            self.step()
+            ticks_run += 1
+        return(self.winner())
+
+    def close(self):
+        """Copy the tiles' ants and messages back into the battle and stop the worker processes."""
+        if len(self.connections) == 0:
+            return()
+        try:
+            replies = self._round("collect", [None] * len(self.tiling))
+        finally:
+            for connection in self.connections:
+                try:
+                    connection.send_bytes(pickle.dumps(("stop", None)))
+                except (BrokenPipeError, OSError):
+                    pass
+                connection.close()
+            for process in self.processes:
+                process.join(timeout=5)
+            self.connections = []
+            self.processes = []
+
+        battle = self.battle
+        ants = {ant._order: ant for ant in battle.ants}
+        battle.block_queue.clear()
+        living = set()
+        for tile_ants, _ in replies:
+            for order, _, _, stats, x, y, rotation, memory, rng, _, _, block in tile_ants:
+                ant = ants[order]
+                ant.x, ant.y, ant.rotation, ant.health = x, y, rotation, stats[HEALTH]
+                ant.memory = memory
+                ant._rng = rng
+                if block is not None:
+                    battle.block_queue[ant] = block
+                living.add(order)
+        for order, ant in ants.items():
+            if order not in living:
+                ant.alive = False
+                battle.ants.remove(ant)
+                battle.ant_grid.remove(ant)
+        battle.update_grid()
+
+        for team, stats in self.team_stats.items():
+            battle_stats = battle.team_stats.setdefault(team, TeamStats())
+            battle_stats.alive, battle_stats.health, battle_stats.kills = stats.alive, stats.health, stats.kills
+        battle.game_tick = self.game_tick
+        messages = [_make_mirror_message(battle, *record) for _, tile_messages in replies for record in tile_messages]
+        messages.sort(key=lambda message: (message.tick, message._order)) # Back in the order they were sent
+        battle.message_board.load(messages)
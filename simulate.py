@@ -1,19 +1,31 @@
-"""Run the battle simulation using a pygame window.
+"""Run the battle simulation, either in a pygame window or headless.
 
-This is the main file to be run to simulate a battle. 
+This is the main file to be run to simulate a battle.
 It instantiates the ants and manages them using provided pre-programmed .py files.
-It also manages the pygame window and displays the ants on the screen.
+By default the battle is shown in a pygame window (see renderer.py); with
+--headless pygame is never imported and the result is printed instead.
+
+    python simulate.py
+    python simulate.py --ticks-per-frame 10 --fps 60
+    python simulate.py --headless --ticks 5000 --progress
+    python simulate.py --headless --workers 8
+    python simulate.py --headless --seed 1 --record battle.replay
+    python simulate.py --replay battle.replay
+    python simulate.py --config battles/default.json
+    python simulate.py --headless --config big.json --shards 4x4
+
+A config file is JSON naming each team's antgorithm (see battles/default.json);
+only the antgorithms it names are imported (see plugins.py).
 """
 
-import multiprocessing
+import argparse
+import json
 import math
-import pygame
-import random
+import sys
+import time
 from models import Battle, Ant
-
-# Import the antgorithms form ./antgorithms .py files
-from antgorithms import wandering_ant, attacking_ant, scared_ant, circle_ant, test_ant, marching_ant, squadron_ant, super_squad_ant
-
+from plugins import registry
+from profiler import TickProfiler
 
 BASIC_ANT_STATS = {
     "size": 10,
@@ -28,141 +40,187 @@ BASIC_ANT_STATS = {
 
 N_ANTS = 100
 
-def add_ants(battle, team, center, n_ants, antgorithm, stats=BASIC_ANT_STATS, rotation=None):
-    """Add a number of ants to the Battle object."""
+# The default four-team battle, by antgorithm name (imported only when a battle is set up)
+DEFAULT_TEAMS = [
+    {"team": "red", "antgorithm": "squadron_ant", "center": [400, 50]},
+    {"team": "blue", "antgorithm": "marching_ant", "center": [400, 750]},
+    {"team": "green", "antgorithm": "attacking_ant", "center": [50, 400]},
+    {"team": "black", "antgorithm": "scared_ant", "center": [750, 400]}
+]
+
+def add_ants(battle, team, center, n_ants, antgorithm, stats=BASIC_ANT_STATS, rotation=None, spread=40):
+    """Add a number of ants to the Battle object, up to spread away from center on each axis."""
     for _ in range(n_ants):
-        x = center[0] + random.randint(-40, 40)
-        y = center[1] + random.randint(-40, 40)
-        rot = random.random() * 2 * math.pi if rotation is None else rotation
+        x = center[0] + battle.rng.randint(-spread, spread)
+        y = center[1] + battle.rng.randint(-spread, spread)
+        rot = battle.rng.random() * 2 * math.pi if rotation is None else rotation
         ant = Ant(battle, team, stats_dict=stats,
                     init_position=(x,y,rot),
                     antgorithm=antgorithm)
 
-# Draw the ants
-def draw_ants(screen, battle):
-    """Draw the ants on the screen."""
-
-    # Draw the arena and a border around it
-    screen.blit(arena, (0, 0))
-    pygame.draw.rect(screen, (0, 0, 0), (0, 0, battle.bounds[0], battle.bounds[1]), 1)
-
-    # Draw the ants
-    for ant in battle.ants:
-        if ant.alive:
-            # Rotate the ant's surface to match its rotation
-            rotated_ant = pygame.transform.rotate(ant.body_surf, -ant.rotation*180/math.pi - 90 % 360)
-            rotated_ant.set_colorkey((255, 255, 255))
-            # Draw the ant's surface (centered at the ant's position)
-            screen.blit(rotated_ant, (ant.x - rotated_ant.get_width()/2, ant.y - rotated_ant.get_height()/2))
-
-def draw_stats(screen, battle):
-    # List the population counts
-    red_count = len([ant for ant in battle.ants if ant.alive and ant.team == "red"])
-    blue_count = len([ant for ant in battle.ants if ant.alive and ant.team == "blue"])
-    green_count = len([ant for ant in battle.ants if ant.alive and ant.team == "green"])
-    black_count = len([ant for ant in battle.ants if ant.alive and ant.team == "black"])
-
-    # Draw the population counts
-    font = pygame.font.SysFont("Comic Sans", 24)
-    red_count_surf = font.render(f"Red: {red_count}", True, (255, 0, 0))
-    blue_count_surf = font.render(f"Blue: {blue_count}", True, (0, 0, 255))
-    green_count_surf = font.render(f"Green: {green_count}", True, (0, 255, 0))
-    black_count_surf = font.render(f"Black: {black_count}", True, (0, 0, 0))
-    screen.blit(red_count_surf, (battle.bounds[0] + 10, 10))
-    screen.blit(blue_count_surf, (battle.bounds[0] + 10, 40))
-    screen.blit(green_count_surf, (battle.bounds[0] + 10, 70))
-    screen.blit(black_count_surf, (battle.bounds[0] + 10, 100))
-
-def execute_antgorithm(ant):
-    """Wrapper to execute the ant's antgorithm."""
-    return(ant.antgorithm(ant))
-
-if __name__ == "__main__":
-
-    # Initialize pygame
-    pygame.init()
-    running = True
-
-    # Set up the battle
-    battle = Battle()
-    battle.bounds = (800, 800)
-
-    # Draw the screen
-    screen = pygame.display.set_mode([battle.bounds[0] + 400, battle.bounds[1]])
-    screen.fill((255, 255, 255))
-
-    # Draw the arena
-    arena = pygame.Surface(battle.bounds)
-    arena.fill((255, 255, 255))
-    screen.blit(arena, (0, 0))
+def setup_battle(n_ants=N_ANTS, seed=None, team_antgorithms=False):
+    """Set up the default four-team battle (with team_antgorithms, teams whose module has one use it)."""
+    return(setup_battle_from_config({"teams": DEFAULT_TEAMS}, n_ants, seed=seed, team_antgorithms=team_antgorithms))
+
+def load_battle_config(path):
+    """Read a battle config file (JSON)."""
+    with open(path) as f:
+        config = json.load(f)
+    if not config.get("teams"):
+        raise ValueError(path + " doesn't list any teams")
+    return(config)
+
+def setup_battle_from_config(config, n_ants=N_ANTS, seed=None, team_antgorithms=False):
+    """Set up a battle from a config dict, looking each team's antgorithm up by name.
+
+    config has "teams": [{"team", "antgorithm", "center", and optionally "ants",
+    "stats" (overriding BASIC_ANT_STATS), "spread" (how far from center ants
+    start, default 40) and "rotation" (default random)}], and optionally
+    "bounds", "seed" and "ants" (the default ants per team, otherwise n_ants).
+    seed, if given, wins over the config's.
+    """
+    if seed is None:
+        seed = config.get("seed")
+    battle = Battle(seed=seed, array_state=team_antgorithms)
+    battle.bounds = tuple(config.get("bounds", (800, 800)))
 
     # Add the ants to the battle
-    add_ants(battle, "red", (400, 50), 100, squadron_ant.antgorithm)
-    add_ants(battle, "blue", (400, 750), 100, super_squad_ant.antgorithm)
-    add_ants(battle, "green", (50, 400), 100, attacking_ant.antgorithm)
-    add_ants(battle, "black", (750, 400), 100, scared_ant.antgorithm)
-
-    # Draw a border around the arena
-    pygame.draw.rect(screen, (0, 0, 0), (0, 0, battle.bounds[0], battle.bounds[1]), 1)
-
-    # Start the pygame loop
-    while running:
-
-        # Quit if the window is closed
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        # # Save and remove the ants' surfaces (to avoid pickling errors)
-        # ant_surfaces = [a.body_surf for a in battle.ants]
-        # battle.ants = [a._replace(body_surf=None) for a in battle.ants]
-
-        # # Execute the ants' programs (using multiprocessing)
-        # with multiprocessing.Pool() as pool:
-        #     instructions = pool.map(execute_antgorithm, battle.ants)
-        #     for ant, instruction in zip(battle.ants, instructions):
-        #         battle.instruction_queue[ant.id] = instruction
-
-        # # Restore the ants' surfaces
-        # battle.ants = [a._replace(body_surf=surf) for a, surf in zip(battle.ants, ant_surfaces)]
-
-        for ant in battle.ants:
-            if ant.alive:
-                # Execute the ant's antgorithm, update memory, and log the instruction
-                method_name, kwargs_dict = execute_antgorithm(ant)
-                battle.instruction_queue[ant.id] = (method_name, kwargs_dict)
-
-        # End of tick housekeeping
-        battle.resolve_instructions()
-        battle.resolve_attacks()
-        battle.resolve_messages()
-        battle.game_tick += 1
-
-        # Check if the battle is over
-        if (len(set([ant.team for ant in battle.ants if ant.alive])) == 1):
-            font = pygame.font.SysFont("Comic Sans", 100)
-            message = font.render(f"{battle.ants[0].team} team wins!", True, (0, 0, 0))
-            screen.blit(message, (battle.bounds[0]/2 - message.get_width()/2, battle.bounds[1]/2 - message.get_height()/2))
-            pygame.display.flip()
-
-            # Wait for input
-            while True:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        running = False
-                        break
-                    if event.type == pygame.KEYDOWN:
-                        running = False
-                        break
-                if not running:
-                    break
-
-        # Update the screen
-        screen.fill((255, 255, 255))
-        draw_ants(screen, battle)
-        draw_stats(screen, battle)
-        pygame.display.flip()
-
-        # Wait 10 ms
-        # pygame.time.wait(10)
+    for team in config["teams"]:
+        stats = dict(BASIC_ANT_STATS, **team.get("stats", {}))
+        add_ants(battle, team["team"], team["center"], team.get("ants", config.get("ants", n_ants)),
+                 registry.antgorithm(team["antgorithm"]), stats=stats, rotation=team.get("rotation"), spread=team.get("spread", 40))
+        if team_antgorithms:
+            team_antgorithm = registry.team_antgorithm(team["antgorithm"])
+            if team_antgorithm is not None:
+                battle.use_team_antgorithm(team["team"], team_antgorithm)
+    return(battle)
+
+def summarize(battle):
+    """Return a one-line summary of the battle's state."""
+    survivors = ", ".join(f"{team}: {count}" for team, count in sorted(battle.alive_counts.items()) if count > 0)
+    return(f"seed {battle.seed}, tick {battle.game_tick}, winner: {battle.winner()}, survivors: {survivors or 'none'}")
+
+def parse_tiles(text):
+    """Parse a tiling like 4x4 into (4, 4)."""
+    try:
+        nx, ny = (int(n) for n in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected tiles like 4x4, got {text}")
+    if nx < 1 or ny < 1:
+        raise argparse.ArgumentTypeError(f"expected tiles like 4x4, got {text}")
+    return((nx, ny))
+
+def run_headless(battle, max_ticks=None, progress_every=None):
+    """Run the battle (or a sharded.ShardedBattle) without a window, printing a progress line every progress_every seconds (if given)."""
+    if progress_every is None:
+        return(battle.run(max_ticks=max_ticks))
+    last_progress = time.perf_counter()
+    ticks_run = 0
+    while not battle.is_over():
+        if max_ticks is not None and ticks_run >= max_ticks:
+            break
+        battle.step()
+        ticks_run += 1
+        if time.perf_counter() - last_progress >= progress_every:
+            last_progress = time.perf_counter()
+            print(summarize(battle), file=sys.stderr)
+    return(battle.winner())
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate an ant battle.")
+    parser.add_argument("--headless", action="store_true", help="run without a window (pygame is never imported)")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this many ticks (default: run until one team is left)")
+    parser.add_argument("--ants", type=int, default=N_ANTS, help="ants per team (unless the config says otherwise)")
+    parser.add_argument("--config", default=None, metavar="JSON", help="set the battle up from a config file instead of the default four teams")
+    parser.add_argument("--list-antgorithms", action="store_true", help="print the antgorithms that can be named in a config and exit")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the battle (default: random, printed at the end)")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="JSONL",
+                        help="print where each tick's time goes (and write per tick records to JSONL, if given)")
+    parser.add_argument("--workers", type=int, default=0, help="run antgorithms in this many worker processes")
+    parser.add_argument("--ant-budget", type=float, default=None, metavar="MS",
+                        help="ants whose antgorithm takes more CPU time than this in a tick do nothing (see sandbox.py)")
+    parser.add_argument("--team-budget", type=float, default=None, metavar="MS",
+                        help="CPU time a team's antgorithms get per tick, the rest of its ants do nothing (needs --ant-budget)")
+    parser.add_argument("--shards", type=parse_tiles, default=None, metavar="NXxNY",
+                        help="split the arena into NX by NY tiles, each simulated by its own worker process (headless)")
+    parser.add_argument("--team-antgorithms", action="store_true", help="run teams whose antgorithm module has a team_antgorithm with it (needs numpy)")
+    parser.add_argument("--progress", action="store_true", help="print a progress line every second (headless)")
+    parser.add_argument("--ticks-per-frame", type=int, default=1, help="ticks simulated per drawn frame, so only every Nth tick is drawn")
+    parser.add_argument("--fps", type=int, default=None, help="cap the frame rate (default: as fast as possible)")
+    parser.add_argument("--fast-forward", action="store_true", help="start in fast-forward (toggle with F, pause with space)")
+    parser.add_argument("--scale", type=float, default=None, help="screen pixels per arena pixel (default: fit the arena on screen)")
+    parser.add_argument("--lod-ants", type=int, default=None, metavar="N", help="draw more ants than this as a density map (default: 5000)")
+    parser.add_argument("--threaded", action="store_true", help="step the battle in a background thread, the window draws its latest frame")
+    parser.add_argument("--record", default=None, metavar="REPLAY", help="save every tick to a replay file")
+    parser.add_argument("--replay", default=None, metavar="REPLAY", help="play a replay file back instead of simulating")
+    args = parser.parse_args()
+
+    if args.list_antgorithms:
+        print("\n".join(registry.names()))
+        sys.exit()
+
+    if args.replay is not None:
+        import renderer
+        from replay import Replay
+        with Replay(args.replay) as replay:
+            renderer.play_replay(replay, ticks_per_frame=args.ticks_per_frame, fps=args.fps or 60, scale=args.scale,
+                                 lod_ants=args.lod_ants)
+        sys.exit()
+
+    if args.shards is not None:
+        # Check before any worker process is started or replay file written
+        if not args.headless:
+            parser.error("--shards needs --headless")
+        sharding_conflicts = {"--ant-budget": args.ant_budget is not None, "--workers": args.workers > 0, "--profile": args.profile is not None,
+                              "--record": args.record is not None, "--team-antgorithms": args.team_antgorithms}
+        for flag, used in sharding_conflicts.items():
+            if used:
+                parser.error(f"{flag} can't be used with --shards")
+
+    if args.config is not None:
+        battle = setup_battle_from_config(load_battle_config(args.config), args.ants, seed=args.seed,
+                                          team_antgorithms=args.team_antgorithms)
+    else:
+        battle = setup_battle(args.ants, seed=args.seed, team_antgorithms=args.team_antgorithms)
+    if args.team_budget is not None and args.ant_budget is None:
+        parser.error("--team-budget needs --ant-budget")
+    if args.ant_budget is not None:
+        from sandbox import BudgetExecutor, SandboxExecutor
+        team_budget = args.team_budget / 1000 if args.team_budget is not None else None
+        if args.workers > 0:
+            battle.executor = SandboxExecutor(n_workers=args.workers, ant_budget=args.ant_budget / 1000, team_budget=team_budget)
+        else:
+            battle.executor = BudgetExecutor(ant_budget=args.ant_budget / 1000, team_budget=team_budget)
+    elif args.workers > 0:
+        from parallel import ParallelExecutor
+        battle.executor = ParallelExecutor(n_workers=args.workers)
+    if args.profile is not None:
+        battle.profiler = TickProfiler(jsonl_path=args.profile or None)
+    if args.record is not None:
+        from replay import ReplayRecorder
+        battle.recorder = ReplayRecorder(args.record)
+        battle.recorder.record(battle) # The starting positions
+
+    if args.shards is not None:
+        from sharded import ShardedBattle
+        with ShardedBattle(battle, tiles=args.shards) as sharded:
+            run_headless(sharded, max_ticks=args.ticks, progress_every=1.0 if args.progress else None)
+    elif args.headless:
+        run_headless(battle, max_ticks=args.ticks, progress_every=1.0 if args.progress else None)
+    else:
+        import renderer # Only import pygame when there is a window to draw
+        renderer.run_window(battle, max_ticks=args.ticks, ticks_per_frame=args.ticks_per_frame, fps=args.fps,
+                            fast_forward=args.fast_forward, threaded=args.threaded, scale=args.scale,
+                            lod_ants=args.lod_ants)
+
+    if battle.executor is not None:
+        battle.executor.close()
+    if battle.recorder is not None:
+        battle.recorder.close()
+
+    print(summarize(battle))
+    if args.ant_budget is not None:
+        print(battle.executor.report())
+    if battle.profiler is not None:
+        battle.profiler.close()
+        print(battle.profiler.report())
@@ -0,0 +1,86 @@
+"""Define a uniform grid for fast range queries over ants and messages.
+
+"""
+
+import math
+
+class SpatialGrid():
+    def __init__(self, cell_size=100):
+        self.cell_size = cell_size
+        self.cells = {} # {(cell_x, cell_y): [item, ...]}
+        self.item_cells = {} # {item: (cell_x, cell_y)}
+
+    def __len__(self):
+        return(len(self.item_cells))
+
+    def cell_of(self, x, y):
+        """Return the (cell_x, cell_y) key of the cell containing the point (x, y)."""
+        return((math.floor(x / self.cell_size), math.floor(y / self.cell_size)))
+
+    def clear(self):
+        """Remove every item from the grid."""
+        self.cells = {}
+        self.item_cells = {}
+
+    def insert(self, item):
+        """Add an item (anything with x and y attributes) to the grid."""
+        key = self.cell_of(item.x, item.y)
+        if key in self.cells:
+            self.cells[key].append(item)
+        else:
+            self.cells[key] = [item]
+        self.item_cells[item] = key
+
+    def remove(self, item):
+        """Remove an item from the grid (does nothing if it isn't there)."""
+        key = self.item_cells.pop(item, None)
+        if key is None:
+            return(False)
+        cell = self.cells[key]
+        cell.remove(item)
+        if len(cell) == 0:
+            del self.cells[key]
+        return(True)
+
+    def move(self, item):
+        """Move an item to the cell matching its current position (only if it changed cells)."""
+        old_key = self.item_cells.get(item)
+        new_key = self.cell_of(item.x, item.y)
+        if old_key == new_key:
+            return(False)
+        if old_key is not None:
+            self.remove(item)
+        self.insert(item)
+        return(True)
+
+    def rebuild(self, items):
+        """Clear the grid and insert every item."""
+        self.clear()
+        for item in items:
+            self.insert(item)
+
+    def copy(self, replace):
+        """Return a copy of the grid with every item swapped for replace[item]."""
+        grid = SpatialGrid.__new__(SpatialGrid)
+        grid.cell_size = self.cell_size
+        grid.cells = {key: [replace[item] for item in cell] for key, cell in self.cells.items()}
+        grid.item_cells = {replace[item]: key for item, key in self.item_cells.items()}
+        return(grid)
+
+    def query(self, x, y, radius):
+        """Return every item in a cell that overlaps the square of half-width radius around (x, y).
+
+        Items are sorted by their _order attribute so callers see them in the
+        same order as the battle's own lists. Callers still have to do the exact
+        distance check themselves.
+        """
+        min_cx, min_cy = self.cell_of(x - radius, y - radius)
+        max_cx, max_cy = self.cell_of(x + radius, y + radius)
+        candidates = []
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    candidates.extend(cell)
+        candidates.sort(key=lambda item: item._order)
+        return(candidates)
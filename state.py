@@ -0,0 +1,216 @@
+"""Define a NumPy structure-of-arrays store for ant state.
+
+When a Battle is created with array_state=True, each ant's position, rotation,
+health, team and stats live in one row of an AntState instead of in Python
+attributes, and movement and combat are resolved for every ant at once.
+"""
+
+import math
+import numpy as np
+
+STAT_NAMES = ["size", "health", "speed", "block_damage", "bite_damage", "bite_range", "bite_angle", "smell_range"]
+
+# Columns that Ant attributes read and write through (see models.ArrayAnt)
+FLOAT_COLUMNS = ["x", "y", "rotation"] + STAT_NAMES
+
+_KEY_STRIDE = 2**32 # Packs (cell_x, cell_y) into a single int64 key
+
+_math_atan2 = np.frompyfunc(math.atan2, 2, 1)
+
+def atan2(y, x):
+    """Elementwise math.atan2 (np.arctan2 can differ from it in the last bit, and ants use math.atan2)."""
+    return(_math_atan2(y, x).astype(np.float64))
+
+class AntState():
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.n_rows = 0 # Rows are never reused, dead ants just have alive=False
+        self.ants = [] # Row -> Ant object
+
+        # Team names are stored as small integer codes
+        self.team_codes = {} # {team: code}
+
+        for name in FLOAT_COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+        self.team = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.order = np.zeros(capacity, dtype=np.int64) # The ant's _order (battle iteration order)
+
+        # Last grid cell each ant was indexed in (see Battle.update_grid)
+        self.cell_x = np.zeros(capacity, dtype=np.int64)
+        self.cell_y = np.zeros(capacity, dtype=np.int64)
+
+        # Python list mirrors of the columns ants read through. Reading a NumPy
+        # scalar is several times slower than a list item, and antgorithms read
+        # positions far more often than the batched passes write them.
+        self.values = {name: [] for name in FLOAT_COLUMNS + ["alive"]}
+
+    def _grow(self):
+        """Double the capacity of every column."""
+        self.capacity *= 2
+        for name in FLOAT_COLUMNS + ["team", "alive", "order", "cell_x", "cell_y"]:
+            old_column = getattr(self, name)
+            new_column = np.zeros(self.capacity, dtype=old_column.dtype)
+            new_column[:len(old_column)] = old_column
+            setattr(self, name, new_column)
+
+    def copy(self):
+        """Return a copy of every column (its ants list still holds this store's ants, for the caller to replace)."""
+        state = AntState.__new__(AntState)
+        state.capacity = self.capacity
+        state.n_rows = self.n_rows
+        state.ants = list(self.ants)
+        state.team_codes = dict(self.team_codes)
+        for name in FLOAT_COLUMNS + ["team", "alive", "order", "cell_x", "cell_y"]:
+            setattr(state, name, getattr(self, name).copy())
+        state.values = {name: list(column_values) for name, column_values in self.values.items()}
+        return(state)
+
+    def team_code(self, team):
+        """Return the integer code of a team (assigning one if it's new)."""
+        if team not in self.team_codes:
+            self.team_codes[team] = len(self.team_codes)
+        return(self.team_codes[team])
+
+    def add_row(self, ant, team):
+        """Reserve a row for a new ant and return its index."""
+        if self.n_rows == self.capacity:
+            self._grow()
+        row = self.n_rows
+        self.n_rows += 1
+        self.ants.append(ant)
+        self.team[row] = self.team_code(team)
+        self.alive[row] = True
+        for name, column_values in self.values.items():
+            column_values.append(getattr(self, name)[row].item())
+        return(row)
+
+    def set_value(self, row, name, value):
+        """Set one ant's value in a column and its list mirror."""
+        getattr(self, name)[row] = value
+        self.values[name][row] = getattr(self, name)[row].item()
+
+    def _refresh(self, *names):
+        """Copy columns into their list mirrors after a batched update."""
+        for name in names:
+            self.values[name][:] = getattr(self, name)[:self.n_rows].tolist()
+
+    def rows_with_new_cell(self, cell_size):
+        """Return the live rows whose grid cell changed since the last call (and record the new cells)."""
+        n = self.n_rows
+        cell_x = np.floor(self.x[:n] / cell_size).astype(np.int64)
+        cell_y = np.floor(self.y[:n] / cell_size).astype(np.int64)
+        changed = self.alive[:n] & ((cell_x != self.cell_x[:n]) | (cell_y != self.cell_y[:n]))
+        rows = np.flatnonzero(changed)
+        self.cell_x[rows] = cell_x[rows]
+        self.cell_y[rows] = cell_y[rows]
+        return(rows)
+
+    # Movement (same rules as Ant.walk, Ant.turn and Ant.strafe, for many ants at once)
+    def walk(self, rows, distances, bounds):
+        """Move ants forward; distances of NaN mean full speed. Ants that would leave the battle stay put."""
+        speed = self.speed[rows]
+        distances = np.where(np.isnan(distances), speed, distances)
+        distances = np.where(distances > speed, speed, distances)
+        new_x = self.x[rows] + distances * np.cos(self.rotation[rows])
+        new_y = self.y[rows] + distances * np.sin(self.rotation[rows])
+        in_bounds = (new_x >= 0) & (new_y >= 0) & (new_x <= bounds[0]) & (new_y <= bounds[1])
+        self.x[rows[in_bounds]] = new_x[in_bounds]
+        self.y[rows[in_bounds]] = new_y[in_bounds]
+        self._refresh("x", "y")
+
+    def turn(self, rows, rel_angles):
+        """Turn ants by relative angles in radians."""
+        self.rotation[rows] = (self.rotation[rows] + rel_angles) % (2 * math.pi)
+        self._refresh("rotation")
+
+    def strafe(self, rows, rel_angles, distances):
+        """Strafe ants toward relative angles; distances of NaN mean half speed."""
+        half_speed = self.speed[rows] / 2
+        distances = np.where(np.isnan(distances), half_speed, distances)
+        distances = np.where(distances > half_speed, half_speed, distances)
+        angles = self.rotation[rows] + rel_angles
+        self.x[rows] += distances * np.cos(angles) / 2
+        self.y[rows] += distances * np.sin(angles) / 2
+        self._refresh("x", "y")
+
+    # Neighbours
+    def neighbour_pairs(self, rows, radii):
+        """Return (pair_index, pair_rows, dist_sq): every live ant (pair_rows) within radii[i] of rows[i], other than itself.
+
+        pair_index indexes into rows. Candidates come from binning ants into
+        cells as wide as the largest radius and checking the 3x3 block of cells
+        around each row. Pairs aren't in any particular order.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if len(rows) == 0:
+            return(empty, empty, np.zeros(0, dtype=np.float64))
+        n = self.n_rows
+        x, y = self.x[:n], self.y[:n]
+
+        alive_rows = np.flatnonzero(self.alive[:n])
+        cell_size = max(float(radii.max()), 1.0)
+        keys = np.floor(x[alive_rows] / cell_size).astype(np.int64) * _KEY_STRIDE + np.floor(y[alive_rows] / cell_size).astype(np.int64)
+        by_key = np.argsort(keys, kind="stable")
+        sorted_keys = keys[by_key]
+
+        row_cx = np.floor(x[rows] / cell_size).astype(np.int64)
+        row_cy = np.floor(y[rows] / cell_size).astype(np.int64)
+        pair_index, pair_rows = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour_keys = (row_cx + dx) * _KEY_STRIDE + (row_cy + dy)
+                lo = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+                hi = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+                counts = hi - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                pair_index.append(np.repeat(np.arange(len(rows)), counts))
+                pair_rows.append(alive_rows[by_key[starts + np.arange(total)]])
+        if len(pair_index) == 0:
+            return(empty, empty, np.zeros(0, dtype=np.float64))
+        pair_index = np.concatenate(pair_index)
+        pair_rows = np.concatenate(pair_rows)
+
+        # Same distance check as Ant.sense
+        a = rows[pair_index]
+        dist_sq = (x[pair_rows] - x[a])**2 + (y[pair_rows] - y[a])**2
+        keep = (pair_rows != a) & (dist_sq < radii[pair_index]**2)
+        return(pair_index[keep], pair_rows[keep], dist_sq[keep])
+
+    # Combat
+    def bite_targets(self, attacker_rows):
+        """Return the row each attacker bites (or -1), matching Battle.resolve_attacks.
+
+        That's the first enemy in battle order within the attacker's bite_range
+        and bite_angle (or within 1 pixel).
+        """
+        targets = np.full(len(attacker_rows), -1, dtype=np.int64)
+        pair_attackers, pair_candidates, dist_sq = self.neighbour_pairs(attacker_rows, self.bite_range[attacker_rows])
+        if len(pair_attackers) == 0:
+            return(targets)
+        n = self.n_rows
+        x, y = self.x[:n], self.y[:n]
+
+        # Same checks as Ant.attackable (enemies only)
+        a = attacker_rows[pair_attackers]
+        c = pair_candidates
+        keep = self.team[c] != self.team[a]
+        angle_to_ant = atan2(x[a] - x[c], y[a] - y[c]) % (2*math.pi)
+        keep &= (np.abs(angle_to_ant - self.rotation[a]) < self.bite_angle[a]/2) | (dist_sq < 1)
+        pair_attackers, pair_candidates = pair_attackers[keep], pair_candidates[keep]
+
+        # Keep the first candidate in battle order for each attacker
+        by_order = np.lexsort((self.order[pair_candidates], pair_attackers))
+        pair_attackers, pair_candidates = pair_attackers[by_order], pair_candidates[by_order]
+        first_attackers, first_index = np.unique(pair_attackers, return_index=True)
+        targets[first_attackers] = pair_candidates[first_index]
+        return(targets)
+
+    def suffer(self, rows, damage):
+        """Take damage (always counted as positive, like Ant.suffer) and return the rows that died."""
+        self.health[rows] -= np.abs(damage)
+        self._refresh("health")
+        return(rows[self.health[rows] <= 0])
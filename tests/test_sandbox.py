@@ -0,0 +1,60 @@
+"""Battles keep going when an antgorithm returns an instruction with a bad angle or distance."""
+
+import math
+import os
+import sys
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "antgorithms"))
+
+from models import Battle, Ant
+from simulate import BASIC_ANT_STATS
+from instructions import WALK, TURN
+from sandbox import BudgetExecutor, SandboxExecutor
+import attacking_ant
+
+def bad_turn_kwargs(ant):
+    return(("turn", {"rel_angle": "x"}))
+
+def bad_turn_opcode(ant):
+    return((TURN, None))
+
+def bad_walk_kwargs(ant):
+    return(("walk", {"distance": "far"}))
+
+def bad_walk_opcode(ant):
+    return((WALK, float("nan")))
+
+BAD_ANTGORITHMS = [bad_turn_kwargs, bad_turn_opcode, bad_walk_kwargs, bad_walk_opcode]
+
+def make_battle(bad_antgorithm):
+    """Two ants returning bad instructions next to two attacking ants."""
+    battle = Battle(seed=0)
+    battle.bounds = (200, 200)
+    for i in range(2):
+        Ant(battle, "bad", stats_dict=BASIC_ANT_STATS, init_position=(100 + 10*i, 90, 0.0), antgorithm=bad_antgorithm)
+        Ant(battle, "good", stats_dict=BASIC_ANT_STATS, init_position=(100 + 10*i, 110, -math.pi/2), antgorithm=attacking_ant.antgorithm)
+    return(battle)
+
+class BadInstructionTest(unittest.TestCase):
+    def check_battle_finishes(self, make_executor):
+        for bad_antgorithm in BAD_ANTGORITHMS:
+            with self.subTest(antgorithm=bad_antgorithm.__name__):
+                battle = make_battle(bad_antgorithm)
+                with make_executor() as executor:
+                    battle.executor = executor
+                    winner = battle.run(max_ticks=2000)
+                self.assertEqual(winner, "good")
+                self.assertGreater(executor.team_stats["bad"].errors, 0)
+                self.assertEqual(executor.team_stats["good"].errors, 0)
+
+    def test_budget_executor(self):
+        self.check_battle_finishes(lambda: BudgetExecutor(ant_budget=1.0, hard_limit=None))
+
+    def test_sandbox_executor(self):
+        self.check_battle_finishes(lambda: SandboxExecutor(n_workers=1, ant_budget=1.0, hard_limit=None, tick_timeout=30.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+"""Rank antgorithms with a round-robin tournament of headless battles.
+
+Every antgorithm (in ./antgorithms, or registered by another package, see
+plugins.py) plays every other one over a number of seeds.
+Battles are spread across a process pool, and each finished battle is
+appended to battles.jsonl in the output directory straight away. Rerunning
+with the same output directory picks up where an interrupted tournament
+stopped. Standings (win rate, ticks to victory, survivors) are written to
+standings.csv and summary.json. With --ant-budget, untrusted antgorithms
+can't hold a tournament up (see sandbox.py).
+
+    python tournament.py --seeds 20 --workers 8 --out results/
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+from models import Battle
+from plugins import registry
+from sandbox import BudgetExecutor
+from simulate import add_ants, BASIC_ANT_STATS
+
+ARENA_BOUNDS = (800, 800)
+
+def discover_antgorithms():
+    """Return the names of every antgorithm the registry knows about (nothing is imported)."""
+    return(registry.names())
+
+def load_antgorithm(name):
+    """Return an antgorithm's function, importing its module the first time."""
+    return(registry.antgorithm(name))
+
+def schedule(names, seeds):
+    """Return every (antgorithm_a, antgorithm_b, seed) battle of a round robin."""
+    return([(a, b, seed) for a, b in itertools.combinations(names, 2) for seed in seeds])
+
+def play_battle(a, b, seed, n_ants, max_ticks, ant_budget=None):
+    """Play one headless battle between two antgorithms and return its result as a dict.
+
+    With an ant_budget (seconds), antgorithms run within it (see sandbox.py)
+    and the result also counts each side's overruns, timeouts and errors.
+    """
+    battle = Battle(seed=seed)
+    battle.bounds = ARENA_BOUNDS
+    if ant_budget is not None:
+        battle.executor = BudgetExecutor(ant_budget=ant_budget)
+
+    # Swap sides on odd seeds so neither antgorithm always starts on the left
+    left, right = (150, ARENA_BOUNDS[1]/2), (ARENA_BOUNDS[0] - 150, ARENA_BOUNDS[1]/2)
+    if seed % 2 == 1:
+        left, right = right, left
+    add_ants(battle, a, left, n_ants, load_antgorithm(a))
+    add_ants(battle, b, right, n_ants, load_antgorithm(b))
+
+    winner = battle.run(max_ticks=max_ticks)
+    survivors = battle.alive_counts
+    result = {
+        "a": a,
+        "b": b,
+        "seed": seed,
+        "winner": winner, # None for a draw (time ran out or nobody survived)
+        "ticks": battle.game_tick,
+        "survivors_a": survivors[a],
+        "survivors_b": survivors[b],
+    }
+    if ant_budget is not None:
+        battle.executor.close()
+        for side, name in (("a", a), ("b", b)):
+            stats = battle.executor.team(name)
+            result[f"overruns_{side}"] = stats.overruns
+            result[f"timeouts_{side}"] = stats.timeouts
+            result[f"errors_{side}"] = stats.errors
+    return(result)
+
+def _play_battle_job(job):
+    """Pool wrapper for play_battle."""
+    return(play_battle(*job))
+
+def load_checkpoint(path):
+    """Return the results already in a battles.jsonl file, keyed by (a, b, seed)."""
+    results = {}
+    if not os.path.exists(path):
+        return(results)
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut short by an interruption, that battle gets replayed
+            results[(result["a"], result["b"], result["seed"])] = result
+    return(results)
+
+def _empty_row(name):
+    return({"antgorithm": name, "battles": 0, "wins": 0, "losses": 0, "draws": 0, "victory_ticks": [], "survivors": []})
+
+def standings(results, names):
+    """Return one row of statistics per antgorithm, best win rate first."""
+    rows = {name: _empty_row(name) for name in names}
+    for result in results:
+        for side, other in (("a", "b"), ("b", "a")):
+            row = rows.setdefault(result[side], _empty_row(result[side]))
+            row["battles"] += 1
+            row["survivors"].append(result["survivors_" + side])
+            if result["winner"] == result[side]:
+                row["wins"] += 1
+                row["victory_ticks"].append(result["ticks"])
+            elif result["winner"] == result[other]:
+                row["losses"] += 1
+            else:
+                row["draws"] += 1
+
+    table = []
+    for row in rows.values():
+        victory_ticks = row.pop("victory_ticks")
+        survivors = row.pop("survivors")
+        row["win_rate"] = row["wins"] / row["battles"] if row["battles"] > 0 else 0
+        row["mean_ticks_to_victory"] = sum(victory_ticks) / len(victory_ticks) if victory_ticks else None
+        row["mean_survivors"] = sum(survivors) / len(survivors) if survivors else 0
+        table.append(row)
+    table.sort(key=lambda row: (-row["win_rate"], row["antgorithm"]))
+    return(table)
+
+def pairings(results):
+    """Return head-to-head records: {"a vs b": {"a": wins, "b": wins, "draws": n}}."""
+    records = {}
+    for result in results:
+        key = f"{result['a']} vs {result['b']}"
+        record = records.setdefault(key, {result["a"]: 0, result["b"]: 0, "draws": 0})
+        if result["winner"] is None:
+            record["draws"] += 1
+        else:
+            record[result["winner"]] += 1
+    return(records)
+
+def write_reports(out_dir, results, names, settings):
+    """Write standings.csv and summary.json."""
+    table = standings(results, names)
+    with open(os.path.join(out_dir, "standings.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(table[0].keys()) if table else ["antgorithm"])
+        writer.writeheader()
+        writer.writerows(table)
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump({"settings": settings, "standings": table, "pairings": pairings(results)}, f, indent=2)
+    return(table)
+
+def run_tournament(out_dir, names=None, n_seeds=10, n_ants=50, max_ticks=5000, n_workers=None, ant_budget=None):
+    """Play (or finish) a round-robin tournament and return the standings."""
+    if names is None:
+        names = discover_antgorithms()
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        raise ValueError(f"No antgorithm called {', '.join(unknown)} (found: {', '.join(registry.names())})")
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = os.path.join(out_dir, "battles.jsonl")
+
+    # Battles in the checkpoint are only comparable if they were played with the same settings
+    battle_settings = {"ants": n_ants, "max_ticks": max_ticks, "stats": BASIC_ANT_STATS, "bounds": list(ARENA_BOUNDS)}
+    if ant_budget is not None:
+        battle_settings["ant_budget"] = ant_budget
+    settings_path = os.path.join(out_dir, "battle_settings.json")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if json.load(f) != json.loads(json.dumps(battle_settings)):
+                raise ValueError(out_dir + " holds battles played with different settings, use another --out")
+    else:
+        with open(settings_path, "w") as f:
+            json.dump(battle_settings, f, indent=2)
+
+    done = load_checkpoint(checkpoint_path)
+    jobs = [(a, b, seed, n_ants, max_ticks, ant_budget) for a, b, seed in schedule(names, range(n_seeds)) if (a, b, seed) not in done]
+    print(f"{len(names)} antgorithms, {len(done)} battles already played, {len(jobs)} to go")
+
+    with open(checkpoint_path, "a") as checkpoint:
+        with multiprocessing.Pool(processes=n_workers) as pool:
+            for i, result in enumerate(pool.imap_unordered(_play_battle_job, jobs)):
+                checkpoint.write(json.dumps(result) + "\n")
+                checkpoint.flush() # Every finished battle survives an interruption
+                done[(result["a"], result["b"], result["seed"])] = result
+                print(f"[{i+1}/{len(jobs)}] {result['a']} vs {result['b']} (seed {result['seed']}): {result['winner'] or 'draw'} in {result['ticks']} ticks")
+
+    # Only report on the battles this tournament asked for
+    wanted = set(schedule(names, range(n_seeds)))
+    results = [result for key, result in done.items() if key in wanted]
+    settings = dict(battle_settings, antgorithms=names, seeds=n_seeds)
+    return(write_reports(out_dir, results, names, settings))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a round-robin tournament between antgorithms.")
+    parser.add_argument("--out", default="tournament_results", help="output (and checkpoint) directory")
+    parser.add_argument("--antgorithms", nargs="+", default=None, help="antgorithms to include (default: all of ./antgorithms)")
+    parser.add_argument("--seeds", type=int, default=10, help="battles per pairing")
+    parser.add_argument("--ants", type=int, default=50, help="ants per team")
+    parser.add_argument("--max-ticks", type=int, default=5000, help="battles still going after this many ticks are draws")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--ant-budget", type=float, default=None, metavar="MS",
+                        help="ants whose antgorithm takes more CPU time than this in a tick do nothing (for untrusted antgorithms, see sandbox.py)")
+    args = parser.parse_args()
+
+    table = run_tournament(args.out, names=args.antgorithms, n_seeds=args.seeds, n_ants=args.ants,
+                           max_ticks=args.max_ticks, n_workers=args.workers,
+                           ant_budget=args.ant_budget / 1000 if args.ant_budget is not None else None)
+    for row in table:
+        print(f"{row['antgorithm']:>20}: {row['win_rate']:.0%} won ({row['wins']}-{row['losses']}-{row['draws']})")
@@ -0,0 +1,127 @@
+"""Run whole-team antgorithms over NumPy arrays.
+
+An antgorithm module can define team_antgorithm(team) next to (or instead
+of) antgorithm(self). It's called once per tick for the whole team with a
+TeamView: NumPy arrays of the team's living ants (in battle order) and
+methods for the neighbour data per-ant antgorithms get from sense,
+attackable and nearest. It returns (codes, angles, distances) arrays with
+one instruction per ant (the codes in instructions.py):
+
+    WALK    distance (NaN for full speed)
+    TURN    angle (relative, radians)
+    STRAFE  angle and distance (NaN for half speed)
+    BITE, BLOCK, NOOP
+
+The battle applies them in bulk alongside the per-ant instructions. Team
+antgorithms need Battle(array_state=True):
+
+    battle.use_team_antgorithm("blue", marching_ant.team_antgorithm)
+"""
+
+import math
+import numpy as np
+from instructions import NOOP
+from state import atan2
+
+class TeamView():
+    """One team's living ants as arrays, for one tick."""
+    def __init__(self, battle, team):
+        state = battle.state
+        n = state.n_rows
+        self.battle = battle
+        self.team = team
+        self.game_tick = battle.game_tick
+        self.bounds = battle.bounds
+        self.memory = battle.team_memory.setdefault(team, {}) # Kept from tick to tick
+
+        self._state = state
+        self._code = state.team_code(team)
+        self.rows = np.flatnonzero(state.alive[:n] & (state.team[:n] == self._code)) # Rows are in battle order
+        self.ids = np.array([state.ants[row].id for row in self.rows.tolist()], dtype=np.int64)
+        for name in ["x", "y", "rotation", "size", "health", "speed", "block_damage", "bite_damage", "bite_range", "bite_angle", "smell_range"]:
+            setattr(self, name, getattr(state, name)[self.rows])
+        self._cache = {}
+
+    def __len__(self):
+        return(len(self.rows))
+
+    def new_instructions(self, code=NOOP):
+        """Return (codes, angles, distances) arrays to fill in, every ant doing code with default parameters."""
+        n = len(self.rows)
+        return(np.full(n, code, dtype=np.int64), np.zeros(n, dtype=np.float64), np.full(n, math.nan, dtype=np.float64))
+
+    def _enemy_pairs(self):
+        """Return (pair_index, pair_rows, dist_sq) for the enemies within each ant's smell_range."""
+        if "enemy_pairs" not in self._cache:
+            pair_index, pair_rows, dist_sq = self._state.neighbour_pairs(self.rows, self.smell_range)
+            enemy = self._state.team[pair_rows] != self._code
+            self._cache["enemy_pairs"] = (pair_index[enemy], pair_rows[enemy], dist_sq[enemy])
+            self._cache["friend_counts"] = np.bincount(pair_index[~enemy], minlength=len(self.rows))
+        return(self._cache["enemy_pairs"])
+
+    def enemy_counts(self):
+        """Return how many enemies each ant can sense (len(ant.sense(include_teammates=False)))."""
+        return(np.bincount(self._enemy_pairs()[0], minlength=len(self.rows)))
+
+    def friend_counts(self):
+        """Return how many teammates each ant can sense (len(ant.sense(include_enemies=False)))."""
+        self._enemy_pairs()
+        return(self._cache["friend_counts"])
+
+    def nearest_enemy(self):
+        """Return (x, y, found): the nearest sensed enemy of each ant, like ant.nearest(ant.sense(include_teammates=False)).
+
+        x and y are NaN where found is False.
+        """
+        if "nearest_enemy" not in self._cache:
+            pair_index, pair_rows, dist_sq = self._enemy_pairs()
+            # Nearest first, ties go to the first in battle order (like min over the sensed list)
+            by_distance = np.lexsort((self._state.order[pair_rows], dist_sq, pair_index))
+            pair_index, pair_rows = pair_index[by_distance], pair_rows[by_distance]
+            ants_with_enemies, first = np.unique(pair_index, return_index=True)
+            enemy_x = np.full(len(self.rows), math.nan)
+            enemy_y = np.full(len(self.rows), math.nan)
+            enemy_x[ants_with_enemies] = self._state.x[pair_rows[first]]
+            enemy_y[ants_with_enemies] = self._state.y[pair_rows[first]]
+            found = np.zeros(len(self.rows), dtype=bool)
+            found[ants_with_enemies] = True
+            self._cache["nearest_enemy"] = (enemy_x, enemy_y, found)
+        return(self._cache["nearest_enemy"])
+
+    def can_bite(self):
+        """Return whether each ant has an enemy to bite (len(ant.attackable()) > 0)."""
+        if "can_bite" not in self._cache:
+            self._cache["can_bite"] = self._state.bite_targets(self.rows) >= 0
+        return(self._cache["can_bite"])
+
+    def near_bounds(self, buffer=None):
+        """Return whether each ant is within buffer (default: its size) of the edge, like Ant.near_bounds."""
+        if buffer is None:
+            buffer = self.size
+        return((self.x < buffer) | (self.x > self.bounds[0] - buffer) | (self.y < buffer) | (self.y > self.bounds[1] - buffer))
+
+    def angle_toward(self, target_x, target_y):
+        """Return the absolute angle from each ant toward (target_x, target_y), like Ant.angle_toward."""
+        return(atan2(self.y - target_y, self.x - target_x) + math.pi % (2*math.pi))
+
+    def random(self, mask):
+        """Draw one number from the rng of each ant where mask is True (an array with a value for every ant)."""
+        values = np.full(len(self.rows), math.nan)
+        selected = np.flatnonzero(mask)
+        ants = self._state.ants
+        rows = self.rows
+        values[selected] = [ants[rows[i]].rng.random() for i in selected.tolist()]
+        return(values)
+
+def run_team_antgorithm(battle, team, team_antgorithm):
+    """Run a team antgorithm and return (rows, codes, angles, distances) for Battle to apply."""
+    view = TeamView(battle, team)
+    if len(view) == 0:
+        return(None)
+    codes, angles, distances = team_antgorithm(view)
+    codes = np.asarray(codes, dtype=np.int64)
+    angles = np.broadcast_to(np.asarray(angles, dtype=np.float64), codes.shape)
+    distances = np.broadcast_to(np.asarray(distances, dtype=np.float64), codes.shape)
+    if codes.shape != view.rows.shape:
+        raise ValueError(f"team_antgorithm for {team} returned {len(codes)} instructions for {len(view)} ants")
+    return(view.rows, codes, angles, distances)